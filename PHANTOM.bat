@@ -1,6 +1,6 @@
 @echo off 
 cd C:\Users\PC\Downloads 
-python PHANTOM.py
+python PHANTOM.py %*
 if errorlevel 1 (
     echo.
     echo ==================
@@ -1,11 +1,41 @@
 import os
 import json
+import re
+import ast
+import operator
+import heapq
+import bisect
+import atexit
+import pickle
+import hashlib
+import fnmatch
 import webbrowser
 import subprocess
 import datetime
+import math
 import socket
+import socketserver
+import secrets
+import hmac
+import asyncio
 import sys
 import shlex
+import signal
+import argparse
+import contextlib
+import functools
+import struct
+import mmap
+import csv
+import io
+import shutil
+import threading
+import time
+import types
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
 
 # Optional imports - we'll try to get these if available
@@ -17,6 +47,2583 @@ try:
 except ImportError:
     pass
 
+# NumPy makes the "ask with your notes" search fast - totally optional though
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# psutil can count disk writes on any OS - without it we only manage on Linux
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Some stripped-down Pythons don't ship sqlite, we'll fall back to JSON there
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+# Tab completion and history - not there on Windows without pyreadline3
+try:
+    import readline
+except ImportError:
+    readline = None
+
+# File locking is different on Windows and everything else
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+class StreamedAnswer(str):
+    """An answer we already printed live, so nobody needs to print it again"""
+    
+    text = ''  # Just the AI's words, without the 🤖 in front
+    complete = True  # False if you stopped it halfway
+
+
+class OllamaClient:
+    """One shared connection to Ollama so we don't reconnect for every question"""
+    
+    def __init__(self, base_url='http://localhost:11434', keep_alive='30m'):
+        self.base_url = base_url.rstrip('/')
+        self.keep_alive = keep_alive
+        # A pooled session keeps the TCP connection open between questions
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=8)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.warm_thread = None
+    
+    def post(self, path, payload, **kwargs):
+        """Send something to Ollama's API"""
+        return self.session.post(f"{self.base_url}{path}", json=payload, **kwargs)
+    
+    def generate(self, model, prompt, stream=False, timeout=120, options=None):
+        """Ask the model something - with stream=True you read the chunks yourself"""
+        payload = {
+            'model': model,
+            'prompt': prompt,
+            'stream': stream,
+            'keep_alive': self.keep_alive,
+        }
+        if options:
+            payload['options'] = options
+        return self.post('/api/generate', payload, stream=stream, timeout=timeout)
+    
+    def chat(self, model, messages, stream=False, timeout=120):
+        """Carry on a conversation - Ollama reuses its cache for the unchanged start"""
+        return self.post('/api/chat', {
+            'model': model,
+            'messages': messages,
+            'stream': stream,
+            'keep_alive': self.keep_alive,
+        }, stream=stream, timeout=timeout)
+    
+    def models(self, timeout=2):
+        """Every model Ollama has, with its size - a quick HTTP call, no subprocess"""
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=timeout)
+        response.raise_for_status()
+        return [{'name': m.get('name', ''), 'size': m.get('size', 0),
+                 'modified_at': m.get('modified_at', '')}
+                for m in response.json().get('models', [])]
+    
+    def list_models(self, timeout=2):
+        """Just the names of the models Ollama has"""
+        return [m['name'] for m in self.models(timeout)]
+    
+    def pull(self, model, timeout=(5, 60)):
+        """Start downloading a model - read the progress chunks off what comes back"""
+        return self.post('/api/pull', {'model': model, 'stream': True},
+                         stream=True, timeout=timeout)
+    
+    def embed(self, model, texts, timeout=120):
+        """Turn a list of texts into vectors with an embedding model"""
+        response = self.post('/api/embed', {
+            'model': model,
+            'input': list(texts),
+            'keep_alive': self.keep_alive,
+        }, timeout=timeout)
+        response.raise_for_status()
+        return response.json()['embeddings']
+    
+    def warm_up(self, model):
+        """Get the model loaded into memory in the background before anyone asks"""
+        if self.warm_thread is not None and self.warm_thread.is_alive():
+            return
+        
+        def _load():
+            try:
+                # An empty prompt just loads the model and pins it for keep_alive
+                self.post('/api/generate', {'model': model, 'keep_alive': self.keep_alive},
+                          timeout=120).close()
+            except requests.exceptions.RequestException:
+                pass  # No biggie, the first question will just be a bit slower
+        
+        self.warm_thread = threading.Thread(target=_load, daemon=True)
+        self.warm_thread.start()
+
+
+class PullError(Exception):
+    """A model download that didn't work out"""
+
+
+class ModelManager:
+    """Knows which models Ollama has (without asking it every time) and downloads
+    new ones over the API, picking up where it left off if the connection drops"""
+    
+    def __init__(self, client, path, ttl=600):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.state = {'models': [], 'checked_at': 0, 'unfinished': []}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.state.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+    
+    @staticmethod
+    def matches(wanted, name):
+        """'llama3.2' means 'llama3.2:latest' (or any llama3.2 tag), 'llama3.2:1b'
+        means exactly that one"""
+        if ':' in wanted:
+            return name == wanted
+        return name.split(':')[0] == wanted
+    
+    def installed(self, refresh=False):
+        """The installed models, from the cache unless it's old (or refresh is set)"""
+        with self.lock:
+            if not refresh and time.time() - self.state['checked_at'] < self.ttl:
+                return list(self.state['models'])
+        models = self.client.models()
+        with self.lock:
+            self.state['models'] = models
+            self.state['checked_at'] = time.time()
+            self._save()
+        return models
+    
+    def has(self, model, refresh=False):
+        return any(self.matches(model, m['name']) for m in self.installed(refresh))
+    
+    def unfinished(self):
+        return list(self.state['unfinished'])
+    
+    def _save(self):
+        """Write the state out (call with the lock held)"""
+        temp = self.path.with_suffix('.tmp')
+        try:
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(temp, self.path)
+        except OSError:
+            pass  # It's only a cache
+    
+    def _mark_unfinished(self, model, unfinished, installed=True):
+        with self.lock:
+            pending = [m for m in self.state['unfinished'] if m != model]
+            if unfinished:
+                pending.append(model)
+            elif installed:
+                self.state['checked_at'] = 0  # There's a new model, look again next time
+            self.state['unfinished'] = pending
+            self._save()
+    
+    def pull(self, model, on_progress, attempts=5):
+        """Download a model, calling on_progress with each status chunk. Ollama keeps
+        the parts it already has, so a retry (or a later pull) carries on from there"""
+        self._mark_unfinished(model, True)
+        try:
+            last_error = self._pull_attempts(model, on_progress, attempts)
+        except PullError:
+            # Ollama turned it down (no such model, say) - there's nothing to carry on
+            self._mark_unfinished(model, False, installed=False)
+            raise
+        if last_error is None:
+            return
+        raise PullError(f"gave up after {attempts} tries ({last_error})")
+    
+    def _pull_attempts(self, model, on_progress, attempts):
+        """Try the pull up to attempts times, returning None once it's done or why
+        the last try was cut short (which leaves the model marked unfinished)"""
+        last_error = None
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+            try:
+                with contextlib.closing(self.client.pull(model)) as response:
+                    if response.status_code != 200:
+                        raise PullError(f"Ollama said no (Status {response.status_code})")
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if 'error' in chunk:
+                            raise PullError(chunk['error'])
+                        on_progress(chunk)
+                        if chunk.get('status') == 'success':
+                            self._mark_unfinished(model, False)
+                            return None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                last_error = e  # Dropped connection - try again, it'll resume
+                continue
+            except ValueError:
+                raise PullError("Ollama sent back something I couldn't read")
+            last_error = "the download ended before it was done"
+        return last_error
+
+
+class CommandTrie:
+    """A prefix tree of command names, so finding a command is one walk over the input"""
+    
+    # These can't clash with the single characters the tree is made of
+    PREFIX = '__prefix__'
+    EXACT = '__exact__'
+    
+    def __init__(self):
+        self.root = {}
+    
+    def add(self, name, value, exact=False):
+        """Add a command - exact ones only match the whole input, like custom commands"""
+        node = self.root
+        for ch in name:
+            node = node.setdefault(ch, {})
+        node[self.EXACT if exact else self.PREFIX] = value
+    
+    def remove(self, name, exact=False):
+        """Take a command out and tidy up any branches nothing uses anymore"""
+        path = [self.root]
+        for ch in name:
+            node = path[-1].get(ch)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].pop(self.EXACT if exact else self.PREFIX, None)
+        for ch in reversed(name):
+            if path.pop():
+                break
+            del path[-1][ch]
+    
+    def match(self, text):
+        """Returns (exact match, length of longest prefix match, its value).
+        A command only counts if a space or the end of the line comes right after it,
+        so 'chat news' is chat with 'news', not 'chat new' with 's'."""
+        node = self.root
+        best_len, best = 0, None
+        if self.PREFIX in node:
+            best = node[self.PREFIX]
+        for i, ch in enumerate(text, 1):
+            node = node.get(ch)
+            if node is None:
+                return None, best_len, best
+            if self.PREFIX in node and (i == len(text) or text[i].isspace()):
+                best_len, best = i, node[self.PREFIX]
+        return node.get(self.EXACT), best_len, best
+
+
+class PrefixIndex:
+    """Sorted words, so everything starting with a prefix is one bisect away instead
+    of a scan. load() fills it in the first time anyone asks."""
+    
+    def __init__(self, load):
+        self.load = load
+        self.words = None
+    
+    def reset(self):
+        """Lots changed at once - just load it all again next time"""
+        self.words = None
+    
+    def add(self, word):
+        if self.words is None:
+            return  # Not loaded yet, it'll be in there when it is
+        i = bisect.bisect_left(self.words, word)
+        if i == len(self.words) or self.words[i] != word:
+            self.words.insert(i, word)
+    
+    def remove(self, word):
+        if self.words is None:
+            return
+        i = bisect.bisect_left(self.words, word)
+        if i < len(self.words) and self.words[i] == word:
+            del self.words[i]
+    
+    def starting_with(self, prefix, limit=200):
+        if self.words is None:
+            self.words = sorted(set(self.load()))
+        words = self.words
+        i = bisect.bisect_left(words, prefix)
+        found = []
+        while i < len(words) and len(found) < limit and words[i].startswith(prefix):
+            found.append(words[i])
+            i += 1
+        return found
+
+
+class LineCompleter:
+    """Tab completion for the whole line - command names, then whatever the command
+    takes after it (topics, colors, your custom commands)"""
+    
+    def __init__(self, commands, topics, colors, custom):
+        self.commands = commands
+        self.topics = topics
+        self.colors = colors
+        self.custom = custom
+        # Longest first, so 'remove command x' isn't mistaken for something shorter
+        self.arguments = {
+            "what do you know about": topics,
+            "remove command": custom,
+            "setcolor": colors,
+            "forget": topics,
+            "teach": topics,
+        }
+        self.matches = []
+    
+    def candidates(self, line):
+        lowered = line.lower()
+        for command, index in self.arguments.items():
+            if lowered.startswith(command + ' '):
+                partial = lowered[len(command) + 1:].lstrip()
+                return [f"{command} {word}" for word in index.starting_with(partial)]
+        return self.commands.starting_with(lowered)
+    
+    def complete(self, text, state):
+        """What readline calls - once with state 0, then 1, 2... until we say None"""
+        if state == 0:
+            self.matches = self.candidates(text)
+        return self.matches[state] if state < len(self.matches) else None
+
+
+class JsonStorage:
+    """Saves our JSON files from a background thread. A burst of changes turns into
+    one write, every write is all-or-nothing (temp file + rename), and two Phantoms
+    saving the same file keep each other's changes instead of clobbering them."""
+    
+    def __init__(self, delay=0.5):
+        self.delay = delay
+        self.dirty = {}   # path -> data waiting to be written
+        self.synced = {}  # path -> (our text last time we read/wrote it, file stamp after)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.writer = None
+        self.failing = set()  # Paths whose last write failed - we keep trying them
+    
+    @staticmethod
+    def _stamp(path):
+        """Changes whenever somebody rewrites the file"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    
+    @contextlib.contextmanager
+    def _locked(self, path):
+        """Only one Phantom at a time gets to write this file"""
+        with open(path.with_name(path.name + '.lock'), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    
+    def load(self, path, default):
+        with self.lock:
+            if path in self.dirty:
+                return self.dirty[path]  # Newer than what's on disk
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+                stamp = self._stamp(path)
+            data = json.loads(text)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            print(f"Hmm, couldn't load {path.name}: {e}")
+            return default
+        with self.lock:
+            self.synced[path] = (text, stamp)
+        return data
+    
+    def save(self, path, data):
+        """Mark a file as changed - the writer thread gets to it in a moment"""
+        with self.lock:
+            self.dirty[path] = data
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, daemon=True)
+                self.writer.start()
+    
+    def _write_loop(self):
+        while True:
+            time.sleep(self.delay)  # Let a burst of changes pile up first
+            self.flush()
+            with self.lock:
+                if not self.dirty:
+                    self.writer = None
+                    return
+    
+    def flush(self):
+        """Write out everything that changed, right now"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.dirty = self.dirty, {}
+            for path, data in pending.items():
+                try:
+                    self._write(path, data)
+                except RuntimeError:
+                    # It got changed while we were writing it out, go again next time
+                    with self.lock:
+                        self.dirty.setdefault(path, data)
+                except OSError as e:
+                    # Often just for a moment (on Windows a reader holding the file open
+                    # is enough), so hang on to it and try again - only say so once
+                    with self.lock:
+                        self.dirty.setdefault(path, data)
+                    if path not in self.failing:
+                        self.failing.add(path)
+                        print(f"Oops, couldn't save {path.name} (will keep trying): {e}")
+                else:
+                    self.failing.discard(path)
+    
+    @staticmethod
+    def replace(path, text):
+        """Write a whole file so it's either all old or all new, never half of each"""
+        temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(temp, 'w', encoding='utf-8') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(temp)
+            raise
+    
+    def _write(self, path, data):
+        text = json.dumps(data, indent=2)
+        with self.lock:
+            base, stamp = self.synced.get(path, ('{}', None))
+        with self._locked(path):
+            now = self._stamp(path)
+            if text == base and now == stamp:
+                return  # Nothing actually changed
+            out = text
+            if isinstance(data, dict) and now is not None and now != stamp:
+                # Somebody else saved it since we last looked - keep their changes too
+                out = self._merge(path, data, base)
+            self.replace(path, out)
+            # After a merge the file has more than we do, so always merge from now on
+            stamp = self._stamp(path) if out is text else None
+        with self.lock:
+            self.synced[path] = (text, stamp)
+    
+    @staticmethod
+    def _merge(path, ours, base_text):
+        """Their file, plus whatever we changed since base (ours wins on a clash)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                theirs = json.load(f)
+            base = json.loads(base_text)
+        except (OSError, ValueError):
+            return json.dumps(ours, indent=2)
+        if not isinstance(theirs, dict) or not isinstance(base, dict):
+            return json.dumps(ours, indent=2)
+        missing = object()
+        for key in base.keys() | ours.keys():
+            if key not in ours:
+                theirs.pop(key, None)  # We deleted it
+            elif base.get(key, missing) != ours[key]:
+                theirs[key] = ours[key]
+        return json.dumps(theirs, indent=2)
+
+
+class JsonKnowledgeStore(MutableMapping):
+    """Keeps everything in memory and rewrites knowledge.json - fine for small setups"""
+    
+    def __init__(self, path, load, save):
+        self.path = path
+        self.save = save
+        self.data = load(path, {})
+        if not isinstance(self.data, dict):
+            self.data = {}
+    
+    def __getitem__(self, topic):
+        return self.data[topic]
+    
+    def __setitem__(self, topic, info):
+        self.data[topic] = info
+        self.save(self.path, self.data)
+    
+    def __delitem__(self, topic):
+        del self.data[topic]
+        self.save(self.path, self.data)
+    
+    def __iter__(self):
+        return iter(self.data)
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def update_many(self, items):
+        """Add a whole bunch of topics with just one save"""
+        self.data.update(items)
+        self.save(self.path, self.data)
+
+
+class SQLiteKnowledgeStore(MutableMapping):
+    """Keeps knowledge in a SQLite file so each change only touches one row"""
+    
+    def __init__(self, path):
+        self.path = path
+        # Background threads read knowledge too, so share one connection behind a lock
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS knowledge (topic TEXT PRIMARY KEY, info TEXT NOT NULL)"
+        )
+    
+    def __getitem__(self, topic):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT info FROM knowledge WHERE topic = ?", (topic,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(topic)
+        return row[0]
+    
+    def __contains__(self, topic):
+        with self.lock:
+            return self.db.execute(
+                "SELECT 1 FROM knowledge WHERE topic = ?", (topic,)
+            ).fetchone() is not None
+    
+    def __setitem__(self, topic, info):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO knowledge (topic, info) VALUES (?, ?) "
+                "ON CONFLICT(topic) DO UPDATE SET info = excluded.info",
+                (topic, info)
+            )
+    
+    def __delitem__(self, topic):
+        with self.lock:
+            deleted = self.db.execute("DELETE FROM knowledge WHERE topic = ?", (topic,)).rowcount
+        if not deleted:
+            raise KeyError(topic)
+    
+    def __iter__(self):
+        with self.lock:
+            topics = self.db.execute("SELECT topic FROM knowledge ORDER BY topic").fetchall()
+        return (row[0] for row in topics)
+    
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM knowledge").fetchone()[0]
+    
+    def items(self):
+        """Every (topic, info), a page at a time instead of one query per topic"""
+        last = ''
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT topic, info FROM knowledge WHERE topic > ? ORDER BY topic LIMIT 1000",
+                    (last,)
+                ).fetchall()
+            yield from rows
+            if len(rows) < 1000:
+                return
+            last = rows[-1][0]
+    
+    def update_many(self, items, replace=False):
+        """Add a whole bunch of topics in one transaction (instead of everything that's
+        there, if replace is set)"""
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                if replace:
+                    self.db.execute("DELETE FROM knowledge")
+                self.db.executemany(
+                    "INSERT INTO knowledge (topic, info) VALUES (?, ?) "
+                    "ON CONFLICT(topic) DO UPDATE SET info = excluded.info",
+                    items
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+
+class NoteJournal:
+    """Notes live in an append-only file, with a little index so we never load them all"""
+    
+    # Each index entry is the note's timestamp plus where its line starts in the journal
+    RECORD = struct.Struct('<16sQ')
+    
+    def __init__(self, path, index_path):
+        self.path = path
+        self.index_path = index_path
+        self.path.touch(exist_ok=True)
+        if not self._index_ok():
+            self.rebuild_index()
+    
+    def _index_ok(self):
+        """Cheap sanity check - does the last index entry point at the last line?"""
+        if not self.index_path.exists():
+            return False
+        index_size = self.index_path.stat().st_size
+        journal_size = self.path.stat().st_size
+        if index_size % self.RECORD.size:
+            return False
+        if index_size == 0:
+            return journal_size == 0
+        _, offset = self._record(index_size // self.RECORD.size - 1)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return offset + len(f.readline()) == journal_size
+    
+    @staticmethod
+    def _parse(line):
+        """One note from one line - None for a blank or broken one"""
+        if not line.strip():
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    
+    def rebuild_index(self):
+        """Read the journal once and write a fresh index for it. Broken lines are left
+        out, and a half-written one at the very end (a crash mid-save) gets cut off."""
+        with open(self.path, 'rb') as journal, open(self.index_path, 'wb') as index:
+            offset, last, good_end = 0, '', 0
+            for line in journal:
+                note = self._parse(line)
+                if note is not None:
+                    record, last = self._pack(note, offset, last)
+                    index.write(record)
+                    good_end = offset + len(line)
+                elif not line.strip():
+                    good_end = offset + len(line)
+                offset += len(line)
+        if good_end < offset:
+            os.truncate(self.path, good_end)
+    
+    def _pack(self, note, offset, last):
+        """Make an index entry - undated or out-of-order notes borrow the previous time,
+        so the index always stays sorted for the date searches"""
+        ts = note.get('timestamp', '') if isinstance(note, dict) else ''
+        ts = max(ts[:16], last)
+        return self.RECORD.pack(ts.encode('utf-8'), offset), ts
+    
+    def _record(self, i, f=None):
+        """Read index entry number i (starting at 0)"""
+        if f is None:
+            with open(self.index_path, 'rb') as f:
+                return self._record(i, f)
+        f.seek(i * self.RECORD.size)
+        ts, offset = self.RECORD.unpack(f.read(self.RECORD.size))
+        return ts.rstrip(b'\0').decode('utf-8'), offset
+    
+    def __len__(self):
+        return self.index_path.stat().st_size // self.RECORD.size
+    
+    def __iter__(self):
+        return self.range(0, len(self))
+    
+    def append(self, note):
+        """Add a note to the end - only the new line gets written"""
+        line = (json.dumps(note) + '\n').encode('utf-8')
+        with open(self.path, 'ab') as journal:
+            offset = journal.seek(0, os.SEEK_END)
+            journal.write(line)
+        count = len(self)
+        last = self._record(count - 1)[0] if count else ''
+        with open(self.index_path, 'ab') as index:
+            index.write(self._pack(note, offset, last)[0])
+    
+    def range(self, start, stop):
+        """Stream notes start..stop-1 straight off the disk"""
+        stop = min(stop, len(self))
+        if start >= stop:
+            return
+        _, offset = self._record(start)
+        with open(self.path, 'rb') as journal:
+            journal.seek(offset)
+            for _ in range(stop - start):
+                line = journal.readline()
+                while line and self._parse(line) is None:
+                    line = journal.readline()  # Not in the index either, so skip it
+                if not line:
+                    return
+                yield json.loads(line)
+    
+    def bisect(self, timestamp):
+        """Position of the first note at or after this timestamp"""
+        lo, hi = 0, len(self)
+        with open(self.index_path, 'rb') as f:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._record(mid, f)[0] < timestamp:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return lo
+    
+    def clear(self):
+        """Throw every note away"""
+        self.path.write_bytes(b'')
+        self.index_path.write_bytes(b'')
+    
+    def delete(self, i):
+        """Remove one note - this is the only time the journal gets rewritten"""
+        temp = self.path.with_suffix('.tmp')
+        with open(self.path, 'rb') as journal, open(temp, 'wb') as out:
+            position = 0
+            for line in journal:
+                if self._parse(line) is None:
+                    continue
+                if position != i:
+                    out.write(line)
+                position += 1
+        os.replace(temp, self.path)
+        self.rebuild_index()
+
+
+class SearchIndex:
+    """Word and trigram index over knowledge and notes, so 'find' doesn't scan everything"""
+    
+    VERSION = 1
+    
+    def __init__(self, path, signature):
+        self.path = path
+        # What the stores looked like at startup - tells us if the saved index is stale
+        self.signature = signature
+        self.loaded = False
+        self.dirty = False
+        self.pending = []  # Changes made before the index was loaded
+        self.lock = threading.RLock()
+        self.docs = {}       # doc id -> Counter of its words
+        self.postings = {}   # word -> {doc id: count}
+        self.trigrams = {}   # trigram -> set of words containing it
+    
+    @staticmethod
+    def words(text):
+        return re.findall(r"[a-z0-9]+", str(text).lower())
+    
+    @staticmethod
+    def grams(word):
+        padded = f"  {word} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def ensure(self, knowledge, notes):
+        """Load the saved index, or build it from scratch if it's missing or stale"""
+        with self.lock:
+            if self.loaded:
+                return
+            saved = None
+            if self.path.exists():
+                try:
+                    with open(self.path, 'rb') as f:
+                        saved = pickle.load(f)
+                except (OSError, pickle.PickleError, EOFError, AttributeError):
+                    saved = None
+            if saved and saved.get('version') == self.VERSION \
+                    and saved.get('signature') == self.signature:
+                self.docs = saved['docs']
+                self.postings = saved['postings']
+                self.trigrams = saved['trigrams']
+                self.loaded = True
+                for change in self.pending:
+                    change()
+            else:
+                self.loaded = True
+                self.rebuild(knowledge, notes)
+            self.pending = []
+    
+    def rebuild(self, knowledge, notes):
+        """Index everything again from the stores"""
+        with self.lock:
+            self.docs, self.postings, self.trigrams = {}, {}, {}
+            for topic, info in knowledge.items():
+                self._add(('k', topic), f"{topic} {info}")
+            self._add_notes(notes)
+            self.dirty = True
+    
+    def invalidate(self):
+        """Too much changed to patch it - build the index again next time it's needed"""
+        with self.lock:
+            self.loaded = False
+            self.dirty = False
+            self.pending = []
+            self.signature = None
+    
+    def _add_notes(self, notes):
+        for i, note in enumerate(notes):
+            self._add(('n', i), note.get('text', '') if isinstance(note, dict) else note)
+    
+    def _add(self, doc, text):
+        self._remove(doc)
+        counts = Counter(self.words(text))
+        self.docs[doc] = counts
+        for word, count in counts.items():
+            if word not in self.postings:
+                self.postings[word] = {}
+                for gram in self.grams(word):
+                    self.trigrams.setdefault(gram, set()).add(word)
+            self.postings[word][doc] = count
+    
+    def _remove(self, doc):
+        counts = self.docs.pop(doc, None)
+        if not counts:
+            return
+        for word in counts:
+            docs = self.postings.get(word)
+            if docs is None:
+                continue
+            docs.pop(doc, None)
+            if not docs:
+                # Nobody uses this word anymore, forget its trigrams too
+                del self.postings[word]
+                for gram in self.grams(word):
+                    words = self.trigrams.get(gram)
+                    if words is not None:
+                        words.discard(word)
+                        if not words:
+                            del self.trigrams[gram]
+    
+    def _change(self, change):
+        """Apply a change now, or hold onto it until the index gets loaded"""
+        with self.lock:
+            if self.loaded:
+                change()
+                self.dirty = True
+            else:
+                self.pending.append(change)
+    
+    def add_knowledge(self, topic, info):
+        self._change(lambda: self._add(('k', topic), f"{topic} {info}"))
+    
+    def remove_knowledge(self, topic):
+        self._change(lambda: self._remove(('k', topic)))
+    
+    def add_note(self, position, note):
+        self._change(lambda: self._add(('n', position), note.get('text', '')))
+    
+    def reset_notes(self, notes):
+        """Notes got cleared or renumbered - drop them all and index what's left"""
+        def change():
+            for doc in [d for d in self.docs if d[0] == 'n']:
+                self._remove(doc)
+            self._add_notes(notes)
+        self._change(change)
+    
+    def similar_words(self, word):
+        """Words in the index that look like this one, with how alike they are (0-1)"""
+        if word in self.postings:
+            # Spelled right, no need to go hunting for look-alikes
+            yield word, 1.0
+            return
+        grams = self.grams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.trigrams.get(gram, ()))
+        for other, count in shared.items():
+            # A word has len + 1 trigrams, which is all we need for the likeness score
+            score = count / (len(grams) + len(other) + 1 - count)
+            if score >= 0.3:
+                yield other, score
+    
+    def search(self, query, limit=10):
+        """Best matching docs for the query, typos and all, as (score, doc) pairs"""
+        with self.lock:
+            total = len(self.docs) or 1
+            scores = Counter()
+            for word in set(self.words(query)):
+                for match, likeness in self.similar_words(word):
+                    docs = self.postings[match]
+                    # Rare words count for more than words that are everywhere
+                    weight = likeness * math.log(1 + total / len(docs))
+                    for doc, count in docs.items():
+                        scores[doc] += weight * (1 + math.log(count))
+            return heapq.nlargest(limit, ((score, doc) for doc, score in scores.items()))
+    
+    def save(self):
+        """Write the index out so next startup doesn't have to rebuild it"""
+        with self.lock:
+            if not self.loaded or not self.dirty:
+                return
+            temp = self.path.with_suffix('.tmp')
+            try:
+                with open(temp, 'wb') as f:
+                    pickle.dump({
+                        'version': self.VERSION,
+                        'signature': self.signature,
+                        'docs': self.docs,
+                        'postings': self.postings,
+                        'trigrams': self.trigrams,
+                    }, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp, self.path)
+                self.dirty = False
+            except OSError:
+                pass
+
+
+class EmbeddingIndex:
+    """Vectors for everything you taught me, so 'ask' can bring along the useful bits.
+    The vectors are plain float32 rows in one file and a journal says which row is
+    which, so teaching one thing writes one row and one line - not the whole index."""
+    
+    VERSION = 2
+    
+    def __init__(self, path, journal_path, old_paths=()):
+        self.path = path
+        self.journal_path = journal_path
+        self.vectors = None
+        self.ids = []     # Row -> doc id (None for a row that's free to reuse)
+        self.hashes = []  # Row -> fingerprint of the text it was made from
+        self.rows = {}    # Doc id -> row
+        self.model = None
+        self.dim = 0
+        self.lock = threading.RLock()
+        self._load()
+        if self.model is None and old_paths:
+            self._convert(*old_paths)
+    
+    def _load(self):
+        self.vectors, self.ids, self.hashes, self.rows = None, [], [], {}
+        self.model, self.dim = None, 0
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != self.VERSION:
+                    return
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        row = entry['row']
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Half-written at the end, the row file will say so
+                    doc = tuple(entry['id']) if entry.get('id') is not None else None
+                    while len(self.ids) <= row:
+                        self.ids.append(None)
+                        self.hashes.append(None)
+                    old = self.ids[row]
+                    if old is not None and self.rows.get(old) == row:
+                        del self.rows[old]
+                    self.ids[row], self.hashes[row] = doc, entry.get('hash')
+                    if doc is not None:
+                        self.rows[doc] = row
+            count = os.path.getsize(self.path) // (header['dim'] * 4) if header['dim'] else 0
+            if count != len(self.ids):
+                raise ValueError("index and vectors don't line up")
+            # Memory-mapped, so a big index doesn't all have to fit in RAM at once
+            if count:
+                self.vectors = np.memmap(self.path, dtype=np.float32, mode='r',
+                                         shape=(count, header['dim']))
+            self.model, self.dim = header['model'], header['dim']
+        except (OSError, ValueError, KeyError, TypeError):
+            self.vectors, self.ids, self.hashes, self.rows = None, [], [], {}
+            self.model, self.dim = None, 0
+    
+    def _convert(self, npy_path, meta_path):
+        """Bring over an index from the old single .npy file, without re-embedding"""
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            matrix = np.load(npy_path)
+            ids = [tuple(doc) for doc in meta['ids']]
+            if len(ids) != len(matrix):
+                return
+            self._rewrite(meta['model'], ids, meta['hashes'], matrix)
+        except (OSError, ValueError, KeyError):
+            return
+        for old in (npy_path, meta_path):
+            with contextlib.suppress(OSError):
+                os.remove(old)
+    
+    @staticmethod
+    def fingerprint(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _normalise(matrix):
+        # Done once here so a search is just one matrix-vector product
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(len(matrix), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+    
+    def _rewrite(self, model, ids, hashes, matrix):
+        """Write both files from scratch - for a new model, or to squeeze out free rows"""
+        dim = matrix.shape[1] if len(matrix) else 0
+        # Let go of the old memory map first, Windows won't replace an open file
+        self.vectors = None
+        temp = self.path.with_suffix('.tmp')
+        with open(temp, 'wb') as f:
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        os.replace(temp, self.path)
+        lines = [json.dumps({'version': self.VERSION, 'model': model, 'dim': dim})]
+        lines += [json.dumps({'row': row, 'id': doc, 'hash': h})
+                  for row, (doc, h) in enumerate(zip(ids, hashes))]
+        JsonStorage.replace(self.journal_path, "\n".join(lines) + "\n")
+        self._load()
+    
+    def update(self, changes, model, embed, batch_size=64):
+        """Patch just these docs in - changes is doc id -> new text, or None if it's
+        gone. Returns how many texts had to be embedded."""
+        with self.lock:
+            if self.model != model:
+                return None  # Different model, everything has to be redone - use sync
+            todo, gone = [], []
+            for doc, text in changes.items():
+                if text is None:
+                    if doc in self.rows:
+                        gone.append(doc)
+                    continue
+                h = self.fingerprint(text)
+                row = self.rows.get(doc)
+                if row is None or self.hashes[row] != h:
+                    todo.append((doc, h, text))
+            if not todo and not gone:
+                return 0
+            
+            fresh = []
+            for i in range(0, len(todo), batch_size):
+                chunk = todo[i:i + batch_size]
+                fresh.extend(embed([text for _, _, text in chunk]))
+            vectors = self._normalise(fresh) if fresh else None
+            if vectors is not None and self.dim and vectors.shape[1] != self.dim:
+                return None  # The model changed shape on us - start over with sync
+            dim = self.dim or (vectors.shape[1] if vectors is not None else 0)
+            
+            free = [row for row, doc in enumerate(self.ids) if doc is None]
+            journal = []
+            self.vectors = None
+            with open(self.path, 'r+b' if self.path.exists() else 'w+b') as f:
+                for doc in gone:
+                    row = self.rows.pop(doc)
+                    f.seek(row * dim * 4)
+                    f.write(bytes(dim * 4))  # Zeros, so it never comes up in a search
+                    self.ids[row], self.hashes[row] = None, None
+                    free.append(row)
+                    journal.append({'row': row, 'id': None, 'hash': None})
+                for (doc, h, _), vector in zip(todo, vectors if vectors is not None else []):
+                    row = self.rows.get(doc)
+                    if row is None:
+                        row = free.pop() if free else len(self.ids)
+                        if row == len(self.ids):
+                            self.ids.append(None)
+                            self.hashes.append(None)
+                    f.seek(row * dim * 4)
+                    f.write(vector.tobytes())
+                    self.ids[row], self.hashes[row], self.rows[doc] = doc, h, row
+                    journal.append({'row': row, 'id': doc, 'hash': h})
+            
+            if not self.journal_path.exists() or self.dim != dim:
+                header = json.dumps({'version': self.VERSION, 'model': model, 'dim': dim})
+                JsonStorage.replace(self.journal_path, header + "\n")
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in journal))
+            self._load()
+            
+            # Lots of holes from deleted docs? Squeeze them out once in a while
+            holes = sum(doc is None for doc in self.ids)
+            if holes > 100 and holes > len(self.ids) // 2:
+                keep = [row for row, doc in enumerate(self.ids) if doc is not None]
+                self._rewrite(model, [self.ids[r] for r in keep], [self.hashes[r] for r in keep],
+                              np.asarray(self.vectors)[keep])
+            return len(todo)
+    
+    def sync(self, entries, model, embed, batch_size=64):
+        """Bring the index up to date with everything - only new or changed texts get
+        embedded, and only their rows get written. Returns how many got embedded."""
+        with self.lock:
+            entries = dict(entries)
+            if self.model == model:
+                changes = {doc: text for doc, text in entries.items()}
+                changes.update({doc: None for doc in self.rows if doc not in entries})
+                count = self.update(changes, model, embed, batch_size)
+                if count is not None:
+                    return count
+            
+            # New model (or no index yet) - embed the lot and write it in one go
+            docs = list(entries)
+            fresh = []
+            for i in range(0, len(docs), batch_size):
+                fresh.extend(embed([entries[doc] for doc in docs[i:i + batch_size]]))
+            matrix = self._normalise(fresh) if fresh else np.zeros((0, 0), dtype=np.float32)
+            self._rewrite(model, docs, [self.fingerprint(entries[doc]) for doc in docs], matrix)
+            return len(docs)
+    
+    def query(self, vector, k):
+        """The k closest entries to this vector, as (similarity, doc id) pairs"""
+        with self.lock:
+            if self.vectors is None or not len(self.vectors):
+                return []
+            q = np.asarray(vector, dtype=np.float32)
+            q /= np.linalg.norm(q) or 1
+            scores = self.vectors @ q
+            # Ask for a few extra in case free rows sneak into the top
+            wanted = min(k + len(self.ids) - len(self.rows), len(scores))
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+            top = top[np.argsort(-scores[top])]
+            found = [(float(scores[i]), self.ids[i]) for i in top if self.ids[i] is not None]
+            return found[:k]
+
+
+class FileIndex:
+    """Every file under the folders you pick, kept in SQLite, plus all the names in one
+    big string in memory so 'locate' is a quick text search instead of a table scan.
+    A refresh only rewrites the file lists of folders whose modified time changed -
+    everywhere else it just catches up on sizes and times."""
+    
+    VERSION = 1
+    
+    def __init__(self, path, names_path, skip=()):
+        self.path = path
+        self.names_path = names_path
+        self.skip = {name.lower() for name in skip}
+        self.lock = threading.RLock()
+        self.refreshing = threading.Lock()
+        self.db = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (id INTEGER PRIMARY KEY, parent INTEGER,
+                                             path TEXT UNIQUE, mtime INTEGER);
+            CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, dir INTEGER,
+                                              name TEXT, size INTEGER, mtime INTEGER);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        # (lowercase names one per line, where each line starts, file ids) - swapped in
+        # as one piece, so a search never sees names from one refresh and ids from another
+        self.table = None
+    
+    def refreshed_at(self):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'refreshed_at'").fetchone()
+        return float(row[0]) if row else None
+    
+    def counts(self):
+        with self.lock:
+            files = self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            dirs = self.db.execute("SELECT COUNT(*) FROM dirs").fetchone()[0]
+        return files, dirs
+    
+    def _scan(self, path):
+        """List one folder as (mtime, [(name, size, mtime)], [subfolder paths])"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        files, subdirs = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith('.') and entry.name.lower() not in self.skip:
+                                subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            files.append((entry.name, st.st_size, st.st_mtime_ns))
+                    except OSError:
+                        pass
+        except OSError:
+            return None
+        return mtime, files, subdirs
+    
+    def refresh(self, roots, workers=8, progress=None):
+        """Walk the roots, lots of folders at once. Returns (folders whose list changed,
+        folders unchanged, folders gone). Only one refresh runs at a time."""
+        if not self.refreshing.acquire(blocking=False):
+            return None
+        try:
+            with self.lock:
+                rows = self.db.execute("SELECT id, parent, path, mtime FROM dirs").fetchall()
+                # If the last walk got cut off, a folder's mtime may be saved while some
+                # of its subfolders never were - so don't trust any of them this time
+                row = self.db.execute("SELECT value FROM meta WHERE key = 'complete'").fetchone()
+                trusted = row is not None and row[0] == '1'
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('complete', '0')")
+            known = {path: (dir_id, mtime if trusted else None)
+                     for dir_id, _, path, mtime in rows}
+            children = defaultdict(list)
+            for dir_id, parent, path, _ in rows:
+                children[parent].append(path)
+            
+            seen, listed, same, writes = set(), 0, 0, 0
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = {}
+                
+                def visit(path, parent):
+                    if path not in seen:
+                        seen.add(path)
+                        old = known.get(path)
+                        pending[pool.submit(self._scan, path)] = (path, parent)
+                
+                for root in roots:
+                    visit(os.path.abspath(root), None)
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path, parent = pending.pop(future)
+                        result = future.result()
+                        if result is None:
+                            seen.discard(path)  # Gone (or we can't read it anymore)
+                            continue
+                        mtime, files, subdirs = result
+                        old = known.get(path)
+                        if old is not None and mtime == old[1]:
+                            # Nothing added, removed or renamed in here - but a file can
+                            # still have been written to, so catch up on those, then look deeper
+                            same += 1
+                            dir_id = old[0]
+                            writes += self._update_stats(dir_id, files)
+                            for child in children[dir_id]:
+                                visit(child, dir_id)
+                            continue
+                        listed += 1
+                        dir_id = self._store_dir(path, parent, mtime, files, old)
+                        for child in subdirs:
+                            visit(child, dir_id)
+                        writes += len(files) + 1
+                        if writes > 50000:
+                            self._commit()
+                            writes = 0
+                        if progress is not None:
+                            progress(listed, same)
+            
+            gone = [dir_id for path, (dir_id, _) in known.items() if path not in seen]
+            with self.lock:
+                for i in range(0, len(gone), 500):
+                    part = gone[i:i + 500]
+                    marks = ",".join("?" * len(part))
+                    self.db.execute(f"DELETE FROM files WHERE dir IN ({marks})", part)
+                    self.db.execute(f"DELETE FROM dirs WHERE id IN ({marks})", part)
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('refreshed_at', ?)",
+                                (str(time.time()),))
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('complete', '1')")
+            self._commit()
+            if listed or gone or not self.names_path.exists():
+                self._build_names()
+            return listed, same, len(gone)
+        finally:
+            self._commit()
+            self.refreshing.release()
+    
+    def _store_dir(self, path, parent, mtime, files, old):
+        """Swap in the new list of files for one folder"""
+        with self.lock:
+            if not self.db.in_transaction:
+                self.db.execute("BEGIN")
+            if old is None:
+                dir_id = self.db.execute("INSERT INTO dirs (parent, path, mtime) VALUES (?, ?, ?)",
+                                         (parent, path, mtime)).lastrowid
+            else:
+                dir_id = old[0]
+                self.db.execute("UPDATE dirs SET mtime = ? WHERE id = ?", (mtime, dir_id))
+                self.db.execute("DELETE FROM files WHERE dir = ?", (dir_id,))
+            self.db.executemany(
+                "INSERT INTO files (dir, name, size, mtime) VALUES (?, ?, ?, ?)",
+                ((dir_id, name, size, file_mtime) for name, size, file_mtime in files)
+            )
+        return dir_id
+    
+    def _update_stats(self, dir_id, files):
+        """Fix up the size and time of files in a folder whose list didn't change.
+        Returns how many rows that touched"""
+        with self.lock:
+            stored = {name: (size, mtime) for name, size, mtime in self.db.execute(
+                "SELECT name, size, mtime FROM files WHERE dir = ?", (dir_id,))}
+            changed = [(size, mtime, dir_id, name) for name, size, mtime in files
+                       if name in stored and stored[name] != (size, mtime)]
+            if changed:
+                if not self.db.in_transaction:
+                    self.db.execute("BEGIN")
+                self.db.executemany(
+                    "UPDATE files SET size = ?, mtime = ? WHERE dir = ? AND name = ?", changed)
+        return len(changed)
+    
+    def _commit(self):
+        with self.lock:
+            if self.db.in_transaction:
+                self.db.execute("COMMIT")
+    
+    def _build_names(self):
+        """Lay every name out in one string and save it, so loading it is instant"""
+        ids, starts, lines, offset = array('q'), array('q'), [], 0
+        with self.lock:
+            rows = self.db.execute("SELECT id, name FROM files ORDER BY id").fetchall()
+        for file_id, name in rows:
+            name = name.lower()
+            ids.append(file_id)
+            starts.append(offset)
+            lines.append(name)
+            offset += len(name) + 1
+        names = "\n".join(lines) + "\n"
+        temp = self.names_path.with_suffix('.tmp')
+        try:
+            with open(temp, 'wb') as f:
+                pickle.dump({'version': self.VERSION, 'ids': ids, 'starts': starts,
+                             'names': names}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, self.names_path)
+        except OSError:
+            pass
+        self.table = (names, starts, ids)
+    
+    def _load_names(self):
+        if self.table is not None:
+            return
+        try:
+            with open(self.names_path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved.get('version') == self.VERSION:
+                self.table = (saved['names'], saved['starts'], saved['ids'])
+                return
+        except (OSError, pickle.PickleError, EOFError, AttributeError):
+            pass
+        self._build_names()
+    
+    def search(self, pattern, limit=20):
+        """Files whose name contains pattern - or matches it, if it's a *.glob -
+        as (path, size, mtime)"""
+        self._load_names()
+        names, starts, ids = self.table
+        pattern = pattern.lower()
+        matcher = None
+        literal = pattern
+        if any(c in pattern for c in '*?['):
+            matcher = re.compile(fnmatch.translate(pattern)).match
+            # Jump between spots with the longest plain bit, and check the glob there.
+            # A [abc] group isn't plain text - any one of its letters will do
+            plain = re.sub(r'\[!?\]?[^\]]*\]', '*', pattern)
+            literal = max(re.split(r'[*?\[\]]', plain), key=len)
+        
+        found, pos = [], 0
+        while len(found) < limit and pos < len(names):
+            pos = names.find(literal, pos) if literal else pos
+            if pos == -1:
+                break
+            line = bisect.bisect_right(starts, pos) - 1
+            start = starts[line]
+            end = names.index('\n', start)
+            if matcher is None or matcher(names[start:end]):
+                found.append(ids[line])
+            pos = end + 1
+        return self.lookup(found)
+    
+    def lookup(self, file_ids):
+        """Full paths for these files, in the same order"""
+        if not file_ids:
+            return []
+        marks = ",".join("?" * len(file_ids))
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT f.id, d.path, f.name, f.size, f.mtime FROM files f "
+                f"JOIN dirs d ON d.id = f.dir WHERE f.id IN ({marks})", file_ids
+            ).fetchall()
+        by_id = {row[0]: (os.path.join(row[1], row[2]), row[3], row[4]) for row in rows}
+        return [by_id[i] for i in file_ids if i in by_id]
+
+
+class ChatSession:
+    """A named conversation that remembers recent turns, within a token budget"""
+    
+    def __init__(self, name, path, load_json, save_json, budget=2048):
+        self.name = name
+        self.path = path
+        self.save_json = save_json
+        self.budget = budget
+        saved = load_json(path, {})
+        if not isinstance(saved, dict):
+            saved = {}
+        self.messages = saved.get('messages', [])  # The turns we still send along
+        self.dropped = saved.get('dropped', [])    # Questions from turns that fell off the window
+    
+    @staticmethod
+    def tokens(text):
+        """Rough token count - about 4 characters a token is close enough for budgeting"""
+        return len(text) // 4 + 4
+    
+    def add(self, role, content):
+        self.messages.append({'role': role, 'content': content})
+        self._trim()
+    
+    def take_back(self):
+        """Forget the question we just added - the AI never got to answer it"""
+        if self.messages and self.messages[-1]['role'] == 'user':
+            self.messages.pop()
+    
+    def _trim(self):
+        """Drop the oldest turns once we're over budget.
+        We drop down to half the budget in one go, so the start of the conversation
+        stays the same for a good while and Ollama can keep reusing its cache for it."""
+        total = sum(self.tokens(m['content']) for m in self.messages)
+        if total <= self.budget:
+            return
+        while total > self.budget // 2 and len(self.messages) > 2:
+            old = self.messages.pop(0)
+            total -= self.tokens(old['content'])
+            if old['role'] == 'user':
+                self.dropped.append(old['content'][:80])
+        # An assistant reply shouldn't be first without the question it answered
+        if self.messages and self.messages[0]['role'] == 'assistant':
+            self.messages.pop(0)
+        self.dropped = self.dropped[-20:]
+    
+    def outgoing(self):
+        """The messages to send - a short recap of dropped turns, then recent ones"""
+        if not self.dropped:
+            return list(self.messages)
+        recap = "Earlier in this chat the user asked about: " + "; ".join(self.dropped)
+        return [{'role': 'system', 'content': recap}] + self.messages
+    
+    def save(self):
+        # Copies, since the actual write happens a moment later on another thread
+        self.save_json(self.path, {'name': self.name, 'messages': list(self.messages),
+                                   'dropped': list(self.dropped)})
+
+
+class ResponseCache:
+    """Remembers AI answers to questions you've asked before.
+    Recent ones stay in memory, the rest live in a little SQLite file."""
+    
+    def __init__(self, path, max_entries=1000, memory_entries=128, ttl=86400):
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()  # key -> (answer, saved at)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.db = None
+        if sqlite3 is not None:
+            self.db = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, answer TEXT NOT NULL, "
+                "created REAL NOT NULL, used REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+    
+    @staticmethod
+    def key(prompt, model, options=None):
+        """Same question (ignoring case and spacing), same model, same options = same key"""
+        normal = " ".join(prompt.lower().split())
+        raw = json.dumps([normal, model, options or {}], sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        with self.lock:
+            now = time.time()
+            found = self.memory.get(key)
+            if found is not None and now - found[1] < self.ttl:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return found[0]
+            self.memory.pop(key, None)
+            
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT answer, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] < self.ttl:
+                    self.db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+    
+    def _remember(self, key, answer, created):
+        self.memory[key] = (answer, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+    
+    def put(self, key, answer):
+        with self.lock:
+            now = time.time()
+            self._remember(key, answer, now)
+            if self.db is None:
+                return
+            self.db.execute(
+                "INSERT INTO responses (key, answer, created, used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET answer = excluded.answer, "
+                "created = excluded.created, used = excluded.used",
+                (key, answer, now, now)
+            )
+            # Throw out stale answers, then the least recently used ones if we're too big
+            self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self.db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+    
+    def __len__(self):
+        with self.lock:
+            if self.db is None:
+                return len(self.memory)
+            return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.hits = self.misses = 0
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses")
+
+
+class PingEngine:
+    """Checks lots of hosts at once by timing TCP connections, and can keep watching them.
+    (Real ICMP pings need admin rights, but connecting to a port works for everyone.)"""
+    
+    # At most this many connections open at once - enough for every probe of
+    # 128 hosts x 4 to go out together, and well under the usual 1024 open files
+    def __init__(self, history=500, concurrency=512):
+        self.history = {}  # host -> recent (time, ms or None) samples
+        self.history_size = history
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.watch_thread = None
+        self.watch_stop = threading.Event()
+        self.watch_targets = []
+        self.watch_every = 0
+    
+    @staticmethod
+    def split_target(target, default_port=443):
+        """host:port, [ipv6]:port, or just a host (a bare IPv6 address has no port)"""
+        if target.startswith('['):
+            host, _, rest = target[1:].partition(']')
+            port = rest[1:] if rest.startswith(':') else ''
+            return host, int(port) if port.isdigit() else default_port
+        host, _, port = target.rpartition(':')
+        if host and ':' not in host and port.isdigit():
+            return host, int(port)
+        return target, default_port
+    
+    async def _probe(self, host, port, timeout, delay, limit):
+        """One connection attempt, returns how long it took in ms (None if no answer)"""
+        await asyncio.sleep(delay)
+        async with limit:
+            started = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+                writer.close()
+            except ConnectionRefusedError:
+                pass  # Still counts - the host answered, there's just nothing on that port
+            except (OSError, asyncio.TimeoutError):
+                return None
+            return (time.perf_counter() - started) * 1000
+    
+    async def _measure(self, targets, count, timeout, interval):
+        targets = list(dict.fromkeys(targets))  # Same host twice? Once is enough
+        # Room for every probe at once (up to the cap), or dead hosts queue up behind
+        # each other and cost a timeout per batch instead of one in total
+        limit = asyncio.Semaphore(max(1, min(self.concurrency, len(targets) * count)))
+        jobs = {}
+        for target in targets:
+            host, port = self.split_target(target)
+            # A host's probes go out staggered but overlapping, so a dead host
+            # costs one timeout instead of one per probe
+            jobs[target] = [self._probe(host, port, timeout, i * interval, limit)
+                            for i in range(count)]
+        flat = await asyncio.gather(*(p for probes in jobs.values() for p in probes))
+        results, i = {}, 0
+        for target in targets:
+            results[target] = flat[i:i + count]
+            i += count
+        return results
+    
+    def measure(self, targets, count=4, timeout=2.0, interval=0.2):
+        """Probe every target at the same time. Returns target -> list of ms/None"""
+        return asyncio.run(self._measure(targets, count, timeout, interval))
+    
+    @staticmethod
+    def summarize(samples):
+        """min/avg/max/jitter in ms plus loss %, from a list of ms/None samples"""
+        got = [ms for ms in samples if ms is not None]
+        loss = 100 * (len(samples) - len(got)) / len(samples) if samples else 100
+        if not got:
+            return {'loss': loss}
+        # Jitter is how much each reply differs from the one before, on average
+        diffs = [abs(b - a) for a, b in zip(got, got[1:])]
+        return {
+            'min': min(got),
+            'avg': sum(got) / len(got),
+            'max': max(got),
+            'jitter': sum(diffs) / len(diffs) if diffs else 0.0,
+            'loss': loss,
+        }
+    
+    def record(self, results):
+        with self.lock:
+            now = time.time()
+            for target, samples in results.items():
+                ring = self.history.setdefault(target, deque(maxlen=self.history_size))
+                for ms in samples:
+                    ring.append((now, ms))
+    
+    def start_watch(self, targets, every, timeout):
+        """Keep probing these hosts in the background every few seconds"""
+        self.stop_watch()
+        self.watch_stop = threading.Event()
+        self.watch_targets, self.watch_every = targets, every
+        stop = self.watch_stop
+        
+        def _loop():
+            while not stop.is_set():
+                self.record(self.measure(targets, count=1, timeout=timeout))
+                stop.wait(every)
+        
+        self.watch_thread = threading.Thread(target=_loop, daemon=True)
+        self.watch_thread.start()
+    
+    def stop_watch(self):
+        if self.watch_thread is not None:
+            self.watch_stop.set()
+            self.watch_thread = None
+            return True
+        return False
+
+
+class CalcError(Exception):
+    """Something about a calc expression we won't (or can't) work out"""
+
+
+class _ScalarOnly(CalcError):
+    """A function that has no NumPy version got a whole range at once"""
+
+
+class ExpressionEngine:
+    """Safe math for calc: expressions get parsed once, checked node by node and kept
+    around, and every step counts against a budget so nothing can run forever"""
+    
+    MAX_LENGTH = 500        # characters in one expression
+    MAX_STEPS = 10000       # operations in one evaluation
+    MAX_PLAIN_STEPS = 300000  # operations for a whole range without NumPy
+    MAX_BITS = 14000        # how big an integer result can get (~4,200 digits, just
+                            # under what Python is willing to turn into text)
+    MAX_RANGE = 10000000    # values in one 'for x in a..b'
+    MAX_PLAIN_RANGE = 100000  # ...when we don't have NumPy to do it in one go
+    
+    BINARY = {
+        ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+        ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod, ast.Pow: operator.pow,
+    }
+    UNARY = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+    
+    CONSTANTS = {'pi': math.pi, 'e': math.e, 'tau': math.tau}
+    # How many numbers each function takes as (fewest, most), None for no limit -
+    # anything not listed takes exactly one
+    ARITY = {'log': (1, 2), 'round': (1, 2), 'min': (2, None), 'max': (2, None),
+             'hypot': (2, None)}
+    
+    def __init__(self, cache_size=256):
+        self.variables = {}
+        self.cache = OrderedDict()  # expression -> compiled version
+        self.cache_size = cache_size
+        self.functions = {
+            'sqrt': math.sqrt, 'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+            'asin': math.asin, 'acos': math.acos, 'atan': math.atan,
+            'log': math.log, 'log10': math.log10, 'log2': math.log2, 'exp': math.exp,
+            'floor': math.floor, 'ceil': math.ceil, 'abs': abs, 'round': round,
+            'min': min, 'max': max, 'hypot': math.hypot,
+            'degrees': math.degrees, 'radians': math.radians,
+            'factorial': self._factorial,
+        }
+        self.vector_functions = {}
+        if np is not None:
+            self.vector_functions = {
+                'sqrt': np.sqrt, 'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+                'asin': np.arcsin, 'acos': np.arccos, 'atan': np.arctan,
+                'log': np.log, 'log10': np.log10, 'log2': np.log2, 'exp': np.exp,
+                'floor': np.floor, 'ceil': np.ceil, 'abs': np.abs, 'round': np.round,
+                'min': lambda *a: functools.reduce(np.minimum, a),
+                'max': lambda *a: functools.reduce(np.maximum, a),
+                'hypot': lambda *a: functools.reduce(np.hypot, a),
+                'degrees': np.degrees, 'radians': np.radians,
+            }
+    
+    @staticmethod
+    def _factorial(n):
+        # 1500! is about 4,100 digits - much past that and it can't be printed
+        if n != int(n) or not 0 <= n <= 1500:
+            raise CalcError("factorial only works for whole numbers from 0 to 1500")
+        return math.factorial(int(n))
+    
+    def compile(self, expression):
+        """Parse and check an expression, or grab it from the cache if we've seen it"""
+        compiled = self.cache.get(expression)
+        if compiled is not None:
+            self.cache.move_to_end(expression)
+            return compiled
+        if len(expression) > self.MAX_LENGTH:
+            raise CalcError(f"that's too long (max {self.MAX_LENGTH} characters)")
+        try:
+            tree = ast.parse(expression.replace('^', '**'), mode='eval')
+        except RecursionError:
+            raise CalcError("that's nested way too deep")
+        compiled = self._build(tree.body)
+        self.cache[expression] = compiled
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return compiled
+    
+    def _build(self, node):
+        """Turn an AST node into a little function - anything not on the list is refused"""
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            value = node.value
+            return lambda run: value
+        if isinstance(node, ast.Name):
+            name = node.id
+            return lambda run: run.lookup(name)
+        if isinstance(node, ast.BinOp) and type(node.op) in self.BINARY:
+            left, right = self._build(node.left), self._build(node.right)
+            op = type(node.op)
+            return lambda run: run.binary(op, left(run), right(run))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in self.UNARY:
+            operand = self._build(node.operand)
+            op = self.UNARY[type(node.op)]
+            return lambda run: run.step(op(operand(run)))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            name = node.func.id
+            if name not in self.functions:
+                raise CalcError(f"I don't know the function '{name}'")
+            fewest, most = self.ARITY.get(name, (1, 1))
+            if len(node.args) < fewest or (most is not None and len(node.args) > most):
+                if fewest == most:
+                    wanted = f"{fewest} number{'s' if fewest > 1 else ''}"
+                elif most is None:
+                    wanted = f"at least {fewest} numbers"
+                else:
+                    wanted = f"{fewest} or {most} numbers"
+                raise CalcError(f"{name}() takes {wanted}, not {len(node.args)}")
+            args = [self._build(a) for a in node.args]
+            return lambda run: run.call(name, [a(run) for a in args])
+        raise CalcError("I can only do numbers, + - * / // % **, and math functions")
+    
+    def evaluate(self, expression, extra=None, vector=False):
+        """Work out an expression. extra holds temporary variables, like x in a range"""
+        compiled = self.compile(expression)
+        return compiled(_CalcRun(self, extra or {}, vector))
+    
+    def evaluate_range(self, expression, name, start, stop, step=1):
+        """Work out an expression for every value of a variable from start to stop"""
+        if step == 0:
+            raise CalcError("the step can't be 0")
+        count = max(0, math.floor((stop - start) / step) + 1)
+        if count == 0:
+            raise CalcError("that range is empty")
+        if np is not None:
+            if count > self.MAX_RANGE:
+                raise CalcError(f"that's too many values (max {self.MAX_RANGE:,})")
+            values = start + step * np.arange(count, dtype=np.float64)
+            try:
+                # inf and nan are fine answers here, no need for NumPy to shout about them
+                with np.errstate(all='ignore'):
+                    result = self.evaluate(expression, {name: values}, vector=True)
+                    return np.broadcast_to(np.asarray(result, dtype=np.float64), values.shape)
+            except _ScalarOnly as e:
+                # Something like factorial has to go one value at a time
+                if count > self.MAX_PLAIN_RANGE:
+                    raise CalcError(f"{e} only works one value at a time, so at most "
+                                    f"{self.MAX_PLAIN_RANGE:,} values")
+                return np.asarray(self._evaluate_plain(expression, name, start, step, count),
+                                  dtype=np.float64)
+        if count > self.MAX_PLAIN_RANGE:
+            raise CalcError(f"without numpy I can only do {self.MAX_PLAIN_RANGE:,} values "
+                            f"(type 'install numpy' for more)")
+        return self._evaluate_plain(expression, name, start, step, count)
+    
+    def _evaluate_plain(self, expression, name, start, step, count):
+        """The range one value at a time, in plain Python"""
+        compiled = self.compile(expression)
+        # One step budget for the whole range, not one per value
+        run = _CalcRun(self, {}, False, self.MAX_PLAIN_STEPS)
+        values = []
+        for i in range(count):
+            run.extra = {name: start + i * step}
+            values.append(compiled(run))
+        return values
+
+
+class _CalcRun:
+    """One evaluation - keeps count of the steps so a nasty expression gets cut off"""
+    
+    def __init__(self, engine, extra, vector, max_steps=None):
+        self.engine = engine
+        self.extra = extra
+        self.vector = vector
+        self.steps = 0
+        self.max_steps = max_steps or engine.MAX_STEPS
+    
+    def step(self, value):
+        self.steps += 1
+        if self.steps > self.max_steps:
+            raise CalcError("that takes too many steps")
+        return value
+    
+    def lookup(self, name):
+        for scope in (self.extra, self.engine.variables, self.engine.CONSTANTS):
+            if name in scope:
+                return scope[name]
+        raise CalcError(f"'{name}' isn't set - try: calc {name} = 5")
+    
+    def binary(self, op, left, right):
+        self.step(None)
+        # Plain ints can show up in a vector run too (x + 9**9**9), so always check
+        if isinstance(left, int) and isinstance(right, int):
+            bits = self.engine.MAX_BITS
+            # Check how big an integer would get before actually making it
+            if op is ast.Pow:
+                if right < 0:
+                    pass  # That's a fraction, it'll be a float anyway
+                elif abs(left) > 1 and right * math.log2(abs(left)) > bits:
+                    raise CalcError("that number would be way too big")
+            elif op is ast.Mult and left.bit_length() + right.bit_length() > bits:
+                raise CalcError("that number would be way too big")
+        return self.engine.BINARY[op](left, right)
+    
+    def call(self, name, args):
+        self.step(None)
+        table = self.engine.functions
+        if self.vector and any(isinstance(a, np.ndarray) for a in args):
+            if name not in self.engine.vector_functions:
+                raise _ScalarOnly(f"{name}()")
+            table = self.engine.vector_functions
+        try:
+            return table[name](*args)
+        except (ValueError, TypeError):
+            raise CalcError(f"{name}() can't take {self._shown(args)}")
+        except OverflowError:
+            raise CalcError(f"{name}({self._shown(args)}) is way too big")
+    
+    @staticmethod
+    def _shown(args):
+        return ", ".join(f"{a:g}" if isinstance(a, float) else str(a) for a in args)
+
+
+class Job:
+    """One run of a custom command, with the tail end of whatever it printed"""
+    
+    def __init__(self, job_id, name, command, output_lines):
+        self.id = job_id
+        self.name = name
+        self.command = command
+        self.status = 'queued'
+        self.process = None
+        self.returncode = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.ended_at = None
+        self.cpu_seconds = None  # Only known on Mac/Linux
+        self.output = deque(maxlen=output_lines)
+        self.output_count = 0
+    
+    def runtime(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.ended_at or time.time()) - self.started_at
+
+
+class JobManager:
+    """Runs custom commands in the background - only so many at once, the rest wait
+    in line, and finished ones get cleaned up so they don't hang around as zombies"""
+    
+    def __init__(self, max_running=4, output_lines=200, keep_finished=100):
+        self.max_running = max_running
+        self.output_lines = output_lines
+        self.keep_finished = keep_finished
+        self.jobs = OrderedDict()  # id -> Job
+        self.waiting = deque()
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.reaper = None
+    
+    def submit(self, name, command):
+        with self.lock:
+            job = Job(self.next_id, name, command, self.output_lines)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            self.waiting.append(job)
+            self._start_waiting()
+            self._ensure_reaper()
+            return job
+    
+    def running(self):
+        return [j for j in self.jobs.values() if j.status == 'running']
+    
+    def unreaped(self):
+        """Jobs whose process we still have to wait for - killed ones too, or they'd
+        stay zombies"""
+        return [j for j in self.jobs.values()
+                if j.process is not None and j.returncode is None
+                and j.status in ('running', 'killed')]
+    
+    def _start_waiting(self):
+        """Start queued jobs while there's room (call with the lock held)"""
+        while self.waiting and len(self.running()) < self.max_running:
+            job = self.waiting.popleft()
+            try:
+                job.process = subprocess.Popen(
+                    job.command, shell=True, stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    text=True, errors='replace',
+                    # Own process group, so kill gets the whole thing and not just the shell
+                    **({'start_new_session': True} if os.name != 'nt'
+                       else {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP})
+                )
+            except OSError as e:
+                job.status, job.ended_at = 'failed', time.time()
+                job.output.append(f"Couldn't start: {e}")
+                continue
+            job.status, job.started_at = 'running', time.time()
+            threading.Thread(target=self._capture, args=(job,), daemon=True).start()
+    
+    def _capture(self, job):
+        """Keep the last lines of the job's output"""
+        for line in job.process.stdout:
+            job.output.append(line.rstrip('\n'))
+            job.output_count += 1
+        job.process.stdout.close()
+    
+    def _ensure_reaper(self):
+        if self.reaper is None or not self.reaper.is_alive():
+            self.reaper = threading.Thread(target=self._reap_loop, daemon=True)
+            self.reaper.start()
+    
+    def _reap_loop(self):
+        """Collect finished jobs and start waiting ones, until there's nothing left to do"""
+        while True:
+            with self.lock:
+                for job in self.unreaped():
+                    self._reap(job)
+                self._start_waiting()
+                self._trim()
+                if not self.unreaped() and not self.waiting:
+                    self.reaper = None
+                    return
+            time.sleep(0.2)
+    
+    def _reap(self, job):
+        if hasattr(os, 'wait4'):
+            # wait4 tells us how much CPU the job used, not just that it finished
+            try:
+                pid, status, usage = os.wait4(job.process.pid, os.WNOHANG)
+            except ChildProcessError:
+                pid, status, usage = 0, 0, None
+                job.process.poll()
+            if pid:
+                job.process.returncode = os.waitstatus_to_exitcode(status)
+                job.cpu_seconds = usage.ru_utime + usage.ru_stime
+        else:
+            job.process.poll()
+        if job.process.returncode is None:
+            return
+        job.returncode = job.process.returncode
+        job.ended_at = time.time()
+        if job.status == 'running':
+            job.status = 'done' if job.returncode == 0 else 'failed'
+    
+    def _trim(self):
+        """Forget the oldest finished jobs once there's a lot of them"""
+        finished = [j.id for j in self.jobs.values()
+                    if j.status not in ('queued', 'running') and j.ended_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
+    
+    def kill(self, job_id):
+        """Stop a job (or take it out of the queue). Returns False if it wasn't active"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status not in ('queued', 'running'):
+                return False
+            if job.status == 'queued':
+                self.waiting.remove(job)
+                job.status, job.ended_at = 'cancelled', time.time()
+                return True
+            job.status = 'killed'
+            try:
+                if os.name == 'nt':
+                    subprocess.run(['taskkill', '/F', '/T', '/PID', str(job.process.pid)],
+                                   capture_output=True)
+                else:
+                    os.killpg(job.process.pid, signal.SIGTERM)
+            except (OSError, ProcessLookupError):
+                job.process.kill()
+            self._ensure_reaper()  # Someone still has to wait for it
+            return True
+
+
+class Question:
+    """One 'ask' running in the background, and what's come back so far"""
+    
+    def __init__(self, question_id, text, use_cache=True, model=None, owner=None):
+        self.id = question_id
+        self.text = text
+        self.use_cache = use_cache
+        self.model = model  # From 'ask --model', otherwise picked when it runs
+        self.owner = owner  # Where its notices go - the window that asked it
+        self.status = 'queued'
+        self.pieces = []
+        self.answer = None
+        self.response = None  # The open Ollama stream, so cancel can hang up on it
+        self.cancelled = False
+        self.seen = False
+        self.queued_at = time.time()
+        self.started_at = None
+        self.ended_at = None
+    
+    def runtime(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.ended_at or time.time()) - self.started_at
+
+
+class AskQueue:
+    """Answers questions on worker threads so the prompt never waits on the AI.
+    A few go to Ollama at once, the rest wait in a line that only gets so long."""
+    
+    def __init__(self, answer, on_done=None, parallel=2, max_waiting=20, keep_finished=50):
+        self.answer = answer      # answer(question) -> text, does the actual asking
+        self.on_done = on_done    # on_done(question), called from the worker thread
+        self.parallel = max(1, parallel)
+        self.max_waiting = max_waiting
+        self.keep_finished = keep_finished
+        self.questions = OrderedDict()  # id -> Question
+        self.waiting = deque()
+        self.workers = 0
+        self.next_id = 1
+        self.lock = threading.Lock()
+    
+    def submit(self, text, use_cache=True, model=None, owner=None):
+        """Queue a question up. Returns None if the line is already full"""
+        with self.lock:
+            if len(self.waiting) >= self.max_waiting:
+                return None
+            question = Question(self.next_id, text, use_cache, model, owner)
+            self.next_id += 1
+            self.questions[question.id] = question
+            self.waiting.append(question)
+            if self.workers < self.parallel:
+                self.workers += 1
+                threading.Thread(target=self._work, daemon=True).start()
+            return question
+    
+    def active(self):
+        return [q for q in self.questions.values() if q.status in ('queued', 'running')]
+    
+    def _work(self):
+        """Keep answering questions until the line is empty, then go away"""
+        while True:
+            with self.lock:
+                if not self.waiting:
+                    self.workers -= 1
+                    return
+                question = self.waiting.popleft()
+                question.status, question.started_at = 'running', time.time()
+            try:
+                text = self.answer(question)
+            except Exception as e:
+                text = f"❌ Something went wrong: {str(e)}"
+            with self.lock:
+                question.response = None
+                question.ended_at = time.time()
+                if question.cancelled:
+                    question.status = 'cancelled'
+                else:
+                    question.answer = text
+                    question.status = 'failed' if text.startswith('❌') else 'done'
+                self._trim()
+            if self.on_done is not None and question.status != 'cancelled':
+                self.on_done(question)
+    
+    def _trim(self):
+        """Forget the oldest finished questions once there's a lot of them (lock held)"""
+        finished = [q.id for q in self.questions.values()
+                    if q.status not in ('queued', 'running')]
+        for question_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.questions[question_id]
+    
+    def cancel(self, question_id):
+        """Stop a question (or take it out of line). Returns False if it wasn't active"""
+        with self.lock:
+            question = self.questions.get(question_id)
+            if question is None or question.status not in ('queued', 'running'):
+                return False
+            question.cancelled = True
+            if question.status == 'queued':
+                self.waiting.remove(question)
+                question.status, question.ended_at = 'cancelled', time.time()
+                return True
+            response = question.response
+        # Hanging up is what makes Ollama stop generating
+        if response is not None:
+            with contextlib.suppress(Exception):
+                response.close()
+        return True
+
+
+class Instruments:
+    """Optional timing for every command - fixed-size histograms, so it never grows"""
+    
+    # Upper edges of the time buckets, in seconds
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, float('inf'))
+    
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.commands = {}  # name -> {'count', 'wall', 'cpu', 'written', 'buckets'}
+        self._proc = psutil.Process() if psutil is not None else None
+    
+    def disk_written(self):
+        """Bytes this process has written to disk so far (None if we can't tell)"""
+        if self._proc is not None:
+            try:
+                return self._proc.io_counters().write_bytes
+            except (AttributeError, OSError, psutil.Error):
+                pass
+        try:
+            with open('/proc/self/io', 'rb') as f:
+                for line in f:
+                    if line.startswith(b'write_bytes:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+    
+    def measure(self, name, func, *args):
+        """Run func(*args) and write down how long it took and what it wrote. If it
+        hands back lines to print as they're made, making them counts too."""
+        spent = [0.0, 0.0, 0]  # wall, cpu, bytes written
+        written = self.disk_written()
+        result = None
+        try:
+            result = self._timed(spent, func, *args)
+        finally:
+            if not isinstance(result, types.GeneratorType):
+                self._finish(name, spent, written)
+        if isinstance(result, types.GeneratorType):
+            return self._timed_lines(name, result, spent, written)
+        return result
+    
+    @staticmethod
+    def _timed(spent, func, *args):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return func(*args)
+        finally:
+            spent[0] += time.perf_counter() - wall
+            spent[1] += time.thread_time() - cpu
+    
+    def _timed_lines(self, name, lines, spent, written):
+        """Pass the lines along, only counting the time spent making them
+        (not printing them, or waiting at the pager)"""
+        try:
+            while True:
+                try:
+                    line = self._timed(spent, next, lines)
+                except StopIteration:
+                    return
+                yield line
+        finally:
+            lines.close()
+            self._finish(name, spent, written)
+    
+    def _finish(self, name, spent, written):
+        if written is not None:
+            spent[2] = max(0, (self.disk_written() or written) - written)
+        self.record(name, spent[0], spent[1], spent[2] if written is not None else None)
+    
+    def record(self, name, wall, cpu, written):
+        with self.lock:
+            stats = self.commands.get(name)
+            if stats is None:
+                stats = self.commands[name] = {
+                    'count': 0, 'wall': 0.0, 'cpu': 0.0, 'written': 0,
+                    'buckets': [0] * len(self.BUCKETS),
+                }
+            stats['count'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            stats['written'] += written or 0
+            stats['buckets'][bisect.bisect_left(self.BUCKETS, wall)] += 1
+    
+    def percentile(self, stats, q):
+        """Roughly where the q-th percentile falls (the top of its bucket), in seconds"""
+        target = q * stats['count']
+        seen = 0
+        for edge, count in zip(self.BUCKETS, stats['buckets']):
+            seen += count
+            if seen >= target:
+                return edge
+        return self.BUCKETS[-1]
+    
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+    
+    def prometheus(self):
+        """Everything in Prometheus' text format"""
+        lines = [
+            "# HELP phantom_command_duration_seconds Wall time per Phantom command.",
+            "# TYPE phantom_command_duration_seconds histogram",
+        ]
+        with self.lock:
+            commands = {name: dict(stats) for name, stats in self.commands.items()}
+        for name, stats in sorted(commands.items()):
+            total = 0
+            for edge, count in zip(self.BUCKETS, stats['buckets']):
+                total += count
+                le = '+Inf' if edge == float('inf') else f"{edge:g}"
+                lines.append(f'phantom_command_duration_seconds_bucket{{command="{name}",le="{le}"}} {total}')
+            lines.append(f'phantom_command_duration_seconds_sum{{command="{name}"}} {stats["wall"]:.6f}')
+            lines.append(f'phantom_command_duration_seconds_count{{command="{name}"}} {stats["count"]}')
+        lines += [
+            "# HELP phantom_command_cpu_seconds_total CPU time spent per Phantom command.",
+            "# TYPE phantom_command_cpu_seconds_total counter",
+        ]
+        lines += [f'phantom_command_cpu_seconds_total{{command="{name}"}} {stats["cpu"]:.6f}'
+                  for name, stats in sorted(commands.items())]
+        lines += [
+            "# HELP phantom_command_disk_write_bytes_total Bytes written to disk per Phantom command.",
+            "# TYPE phantom_command_disk_write_bytes_total counter",
+        ]
+        lines += [f'phantom_command_disk_write_bytes_total{{command="{name}"}} {stats["written"]}'
+                  for name, stats in sorted(commands.items())]
+        return "\n".join(lines) + "\n"
+
+
+class AnswerLog:
+    """How fast the AI answered, kept in a small rolling log on disk. Ollama tells us
+    how long it spent loading the model, reading the prompt and writing the answer;
+    we add how long we waited for the first word and for the whole thing."""
+    
+    # Ollama's own numbers, straight from its last chunk (durations are in nanoseconds)
+    OLLAMA_FIELDS = ('load_duration', 'prompt_eval_count', 'prompt_eval_duration',
+                     'eval_count', 'eval_duration', 'total_duration')
+    
+    def __init__(self, path, keep=2000):
+        self.path = path
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.entries = None  # Read in the first time somebody looks
+        self.lines = None    # How long the file is, so we know when to trim it
+    
+    @classmethod
+    def entry(cls, model, kind, started, first, final, status):
+        """One log line - started/first are perf_counter() times, final is Ollama's
+        last chunk (or the whole reply when it wasn't streamed)"""
+        now = time.perf_counter()
+        record = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'model': model or '?',
+            'kind': kind,
+            'status': status,
+            'ttft': round(first - started, 4) if first is not None else None,
+            'total': round(now - started, 4),
+        }
+        for field in cls.OLLAMA_FIELDS:
+            if isinstance(final, dict) and isinstance(final.get(field), (int, float)):
+                record[field] = final[field]
+        return record
+    
+    def _count_lines(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return sum(1 for _ in f)
+        except OSError:
+            return 0
+    
+    def add(self, record):
+        """Append one line - and every so often cut the file back to the newest ones"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            if self.lines is None:
+                self.lines = self._count_lines()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.lines += 1
+            if self.entries is not None:
+                self.entries.append(record)
+            # Trimming rewrites the file, so let it grow a bit past the limit first
+            if self.lines > self.keep + max(self.keep // 4, 1):
+                self._trim()
+    
+    def _trim(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            newest = deque(f, maxlen=self.keep)
+        temp = self.path.with_suffix('.tmp')
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.writelines(newest)
+        os.replace(temp, self.path)
+        self.lines = len(newest)
+    
+    def load(self):
+        """Everything in the log, oldest first"""
+        with self.lock:
+            if self.entries is None:
+                self.entries = deque(maxlen=self.keep)
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            with contextlib.suppress(ValueError):
+                                self.entries.append(json.loads(line))
+                except OSError:
+                    pass
+            return list(self.entries)
+    
+    def clear(self):
+        with self.lock:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path)
+            self.entries = deque(maxlen=self.keep)
+            self.lines = 0
+    
+    @staticmethod
+    def rate(count, duration):
+        """Tokens per second from a count and a duration in nanoseconds"""
+        if not count or not duration:
+            return None
+        return count / (duration / 1e9)
+    
+    @classmethod
+    def figures(cls, record):
+        """The numbers worth comparing, worked out from one log line"""
+        load = record.get('load_duration')
+        return {
+            'ttft': record.get('ttft'),
+            'total': record.get('total'),
+            'tok/s': cls.rate(record.get('eval_count'), record.get('eval_duration')),
+            'prompt tok/s': cls.rate(record.get('prompt_eval_count'),
+                                     record.get('prompt_eval_duration')),
+            'load': load / 1e9 if load is not None else None,
+            'prompt tokens': record.get('prompt_eval_count'),
+            'answer tokens': record.get('eval_count'),
+        }
+    
+    @staticmethod
+    def percentile(values, q):
+        """The q-th percentile of some numbers (nearest rank, so it's a real sample)"""
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+    
+    def by_model(self):
+        """model -> {'answers', 'failed', 'stopped', figure name -> list of values}"""
+        models = {}
+        for record in self.load():
+            stats = models.setdefault(record.get('model', '?'),
+                                      {'answers': 0, 'failed': 0, 'stopped': 0})
+            status = record.get('status')
+            if status == 'error':
+                stats['failed'] += 1
+                continue
+            if status == 'stopped':
+                stats['stopped'] += 1
+                continue
+            stats['answers'] += 1
+            for name, value in self.figures(record).items():
+                if value is not None:
+                    stats.setdefault(name, []).append(value)
+        return models
+
+
+class OutputRenderer:
+    """Writes results out a line at a time through a buffer, pausing every screenful.
+    A result can be a plain string or any iterable of lines, so a huge list starts
+    showing up right away and never has to be built in memory all at once."""
+    
+    def __init__(self, stream=None, buffer_size=65536):
+        self.stream = stream or sys.stdout
+        self.buffer_size = buffer_size
+    
+    def is_tty(self):
+        try:
+            return self.stream.isatty()
+        except (AttributeError, ValueError):
+            return False
+    
+    def render(self, result, color='', reset='', page_lines=0):
+        """Write result with each line wrapped in color/reset, stopping for a
+        '-- more --' prompt every page_lines lines (0 = never stop)"""
+        lines = result.split('\n') if isinstance(result, str) else result
+        buffer, size, shown = [], 0, 0
+        try:
+            for item in lines:
+                for line in item.split('\n'):
+                    # Only ask for more once we know there actually is more
+                    if page_lines and shown and shown % page_lines == 0:
+                        self._flush(buffer)
+                        size = 0
+                        if not self._more():
+                            return
+                    text = f"{color}{line}{reset}\n" if color else f"{line}\n"
+                    buffer.append(text)
+                    size += len(text)
+                    shown += 1
+                    if size >= self.buffer_size:
+                        self._flush(buffer)
+                        size = 0
+        finally:
+            self._flush(buffer)
+            # Stop the generator early too, so it can close any files it had open
+            if hasattr(lines, 'close'):
+                lines.close()
+    
+    def _flush(self, buffer):
+        if buffer:
+            self.stream.write("".join(buffer))
+            buffer.clear()
+        self.stream.flush()
+    
+    def _more(self):
+        self.stream.write("-- more (Enter for the next page, q to stop) --")
+        self.stream.flush()
+        try:
+            answer = input()
+        except (EOFError, KeyboardInterrupt):
+            self.stream.write("\n")
+            return False
+        return answer.strip().lower() not in ('q', 'quit', 'n', 'no')
+
+
+# Bulk import - these run on the worker processes, so they live out here where the
+# workers can find them
+IMPORT_KINDS = ('.md', '.markdown', '.txt', '.csv')
+_HEADING = re.compile(r'^#{1,6}\s+(.+?)\s*#*\s*$')
+_TOPIC_LINE = re.compile(r'^([^:]{1,200}):\s*(.+)$')
+
+
+def _parse_chunk(path, start, end):
+    """Read one piece of a file and split it into (topic, info) pairs"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8', errors='replace')
+    kind = os.path.splitext(path)[1].lower()
+    stem = os.path.splitext(os.path.basename(path))[0].lower()
+    if kind == '.csv':
+        return _parse_csv(text, header=start == 0)
+    if kind in ('.md', '.markdown'):
+        return _parse_markdown(text, stem)
+    return _parse_text(text, stem)
+
+
+def _parse_markdown(text, stem):
+    """Each heading is a topic, and everything under it (up to the next one) is the info"""
+    entries = []
+    topic, body, fenced = stem, [], False
+    
+    def finish():
+        info = "\n".join(body).strip()
+        if topic and info:
+            entries.append((topic, info))
+    
+    for line in text.splitlines():
+        if line.lstrip().startswith('```'):
+            fenced = not fenced
+        heading = None if fenced else _HEADING.match(line)
+        if heading:
+            finish()
+            topic, body = heading.group(1).strip().lower(), []
+        else:
+            body.append(line)
+    finish()
+    return entries
+
+
+def _parse_text(text, stem):
+    """'topic: info' lines, like teach - other lines carry on the topic before them"""
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = _TOPIC_LINE.match(line)
+        if match:
+            entries.append((match.group(1).strip().lower(), match.group(2).strip()))
+        elif entries:
+            entries[-1] = (entries[-1][0], f"{entries[-1][1]} {line}")
+        else:
+            entries.append((stem, line))
+    return entries
+
+
+def _parse_csv(text, header=True):
+    """First column is the topic, the rest is the info. header says this is the start of
+    the file, where a header row gets skipped (later chunks can't have one)"""
+    entries = []
+    for row in csv.reader(io.StringIO(text)):
+        if len(row) < 2 or not row[0].strip():
+            continue
+        topic = row[0].strip().lower()
+        if header and not entries and topic in ('topic', 'name', 'title', 'key'):
+            continue  # Header
+        info = ", ".join(cell.strip() for cell in row[1:] if cell.strip())
+        if info:
+            entries.append((topic, info))
+    return entries
+
+
+def _starts_topic(mm, pos):
+    """Does the line starting at pos begin a new 'topic: info' entry?"""
+    end = mm.find(b'\n', pos)
+    line = mm[pos:end if end != -1 else len(mm)].decode('utf-8', errors='replace')
+    return _TOPIC_LINE.match(line.strip()) is not None
+
+
+def _plan_chunks(path, size, chunk_size):
+    """Cut a big file into pieces that can be parsed separately, each starting where a
+    new entry starts: a heading for Markdown, a row for CSV (not a line inside a quoted
+    field), a 'topic:' line for text (not a line carrying on the one before).
+    Small files are one piece."""
+    if size <= chunk_size:
+        return [(0, size)]
+    kind = os.path.splitext(path)[1].lower()
+    markdown = kind in ('.md', '.markdown')
+    boundary = b'\n#' if markdown else b'\n'
+    # A cut can't land between an odd number of these - inside a ``` block or a quote
+    fence = b'```' if markdown else b'"' if kind == '.csv' else None
+    plain_text = not markdown and kind != '.csv'
+    chunks, start = [], 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        while start < size:
+            cut = mm.find(boundary, start + chunk_size)
+            opened = mm[start:cut].count(fence) if fence and cut != -1 else 0
+            while cut != -1 and (opened % 2 or plain_text and not _starts_topic(mm, cut + 1)):
+                later = mm.find(boundary, cut + 1)
+                if fence and later != -1:
+                    opened += mm[cut:later].count(fence)
+                cut = later
+            end = size if cut == -1 else cut + 1
+            chunks.append((start, end))
+            start = end
+    return chunks
+
 
 class Phantom:
     # ============================================
@@ -73,23 +2680,98 @@ class Phantom:
         
         # These are our "memory" files
         self.knowledge_file = self.config_dir / "knowledge.json"
+        self.knowledge_db = self.config_dir / "knowledge.db"
         self.commands_file = self.config_dir / "commands.json"
         self.notes_file = self.config_dir / "notes.json"
+        self.journal_file = self.config_dir / "notes.jsonl"
+        self.journal_index_file = self.config_dir / "notes.idx"
         self.settings_file = self.config_dir / "settings.json"
+        self.status_file = self.config_dir / "ollama_status.json"
+        self.models_file = self.config_dir / "models.json"
+        
+        # Saves happen in the background, and anything left gets written on the way out
+        self.storage = JsonStorage()
+        atexit.register(self.storage.flush)
         
         # Load everything we remember from before
-        self.knowledge = self.load_json(self.knowledge_file, {})
-        self.custom_commands = self.load_json(self.commands_file, {})
-        self.notes = self.load_json(self.notes_file, [])
         self.settings = self.load_json(self.settings_file, {})
+        self.storage.delay = self.settings.get('save_delay', 0.5)
+        self.knowledge = self.open_knowledge_store()
+        self.custom_commands = self.load_json(self.commands_file, {})
+        self.notes = self.open_note_journal()
+        
+        # The 'find' index gets loaded the first time you search
+        self.search_file = self.config_dir / "search_index.pickle"
+        self.import_state_file = self.config_dir / "import_state.json"
+        
+        # Your files, for 'locate' - opened the first time you use it
+        self.files = None
+        self.located = []  # The last locate's results, so 'open 2' works
+        self.search = SearchIndex(self.search_file, self.search_signature())
+        atexit.register(self.save_search_index)
+        
+        # Saved chat conversations, and the one we're in right now
+        self.chats_dir = self.config_dir / "chats"
+        self.chat_session = None
+        
+        # Per-command timing, off unless you turn it on with 'stats on'
+        self.instruments = Instruments(self.settings.get('instrumentation', False))
+        self.metrics_file = self.config_dir / "metrics.prom"
+        atexit.register(self._export_metrics_on_exit)
+        
+        # How fast every AI answer came back, for 'aistats'
+        self.answer_log = AnswerLog(self.config_dir / "ai_log.jsonl",
+                                    self.settings.get('ai_log_size', 2000))
+        
+        # Custom commands run as background jobs
+        self.jobs = JobManager(self.settings.get('max_jobs', 4),
+                               self.settings.get('job_output_lines', 200))
+        
+        # Questions asked with 'ask ... &', answered while you keep typing
+        self.asks = AskQueue(self._answer_in_background, self._announce_answer,
+                             self.settings.get('ask_parallel', 2),
+                             self.settings.get('ask_queue_size', 20))
+        self.notices = deque()  # "Your answer is ready" lines waiting for the next prompt
+        self.local = threading.local()  # A daemon window's thread gets its own notices
         
-        # Just making sure notes is always a list, not something weird
-        if not isinstance(self.notes, list):
-            self.notes = []
+        # The math engine for calc, which also remembers your variables
+        self.calc = ExpressionEngine()
+        
+        # For pinging lots of hosts at once, and watching them over time
+        self.pinger = PingEngine(self.settings.get('ping_history', 500))
+        
+        # Answers to questions you've asked before
+        self.response_cache = ResponseCache(
+            self.config_dir / "response_cache.db",
+            self.settings.get('cache_max_entries', 1000),
+            self.settings.get('cache_memory_entries', 128),
+            self.settings.get('cache_ttl', 86400),
+        )
+        
+        # Vectors for 'ask' to look things up with, only loaded if you turn rag on
+        self.embeddings = None
+        self.embeddings_dirty = True
+        self.embedding_changes = {}  # doc id -> new text (None if it's gone), patched in on the next ask
+        
+        # One shared connection to the AI, set up once
+        self.ollama = None
+        if OLLAMA_AVAILABLE:
+            self.ollama = OllamaClient(
+                self.settings.get('ollama_url', 'http://localhost:11434'),
+                self.settings.get('ollama_keep_alive', '30m'),
+            )
+        
+        # Which models Ollama has, and the one you picked with 'model use' this time
+        self.models = None
+        if self.ollama is not None:
+            self.models = ModelManager(self.ollama, self.models_file,
+                                       self.settings.get('ollama_status_ttl', 600))
+        self.session_model = None
         
         # Let's see if we have AI capabilities
         self.ollama_path = self._find_ollama_path()
-        self.ollama_ready = self._check_ollama_status()
+        self.warm_up_when_ready = False
+        self._start_ollama_probe()
         self.rainbow_offset = 0  # For our rainbow text effect
         
         # All the pretty colors we can use!
@@ -107,6 +2789,10 @@ class Phantom:
             'lime': '\033[38;5;118m', 'teal': '\033[38;5;51m',
         }
         
+        # Colors only make sense on a real terminal, not when piped into a file
+        self.renderer = OutputRenderer()
+        self.use_color = self.renderer.is_tty() and 'NO_COLOR' not in os.environ
+        
         # What color should we use? Let's check what we saved before
         self.current_color = self.settings.get('text_color', 'bright_cyan')
         
@@ -114,6 +2800,11 @@ class Phantom:
         if self.current_color not in self.colors or self.current_color == 'reset':
             self.current_color = 'bright_cyan'
         
+        # Batch mode flips these - there's nobody around to answer yes/no or watch
+        # words stream in
+        self.interactive = True
+        self.assume_yes = False
+        
         # Now let's set up all our commands
         self.init_commands()
     
@@ -126,11 +2817,20 @@ class Phantom:
             "listcolors": self.list_colors,
             "setcolor": self.change_color,
             "clear notes": self.clear_notes,
+            "delete note": self.delete_note,
             "list commands": self.list_commands,
+            "jobs": self.list_jobs,
+            "job": self.show_job,
+            "kill": self.kill_job,
             "add command": self.add_command,
             "remove command": self.remove_command,
             "search": self.web_search,
             "forget": self.forget,
+            "find": self.find,
+            "import": self.import_knowledge,
+            "locate": self.locate,
+            "index": self.file_index,
+            "export": self.export_knowledge,
             "teach": self.teach,
             "notes": self.list_notes,
             "note": self.add_note,
@@ -145,35 +2845,161 @@ class Phantom:
             "rgb": self.set_rgb_color,
             "ip": self.show_ip,
             "banner": self.show_banner,
+            "stats": self.show_stats,
+            "aistats": self.show_ai_stats,
             "download": self.download_ollama,
+            "models": self.list_models,
+            "model": self.model_command,
             "ask": self.ask_ai,
+            "ask!": self.ask_fresh,
+            "results": self.show_results,
+            "cancel": self.cancel_question,
+            "cache stats": self.cache_stats,
+            "cache clear": self.cache_clear,
+            "rag": self.set_rag,
+            "chat": self.chat,
+            "chat new": self.chat_new,
+            "chat resume": self.chat_resume,
+            "chat list": self.chat_list,
+            "chat end": self.chat_end,
         }
+        
+        # These only read stuff (or just take a while), so batch mode can run a bunch
+        # of them side by side. calc isn't here because of variables and ans.
+        self.parallel_safe = {
+            self.ping_site, self.ask_ai, self.ask_fresh, self.recall,
+            self.get_time, self.find, self.show_ip, self.show_results,
+        }
+        
+        # Build the lookup tree once instead of sorting commands on every line
+        self.dispatch = CommandTrie()
+        for name, func in self.core_commands.items():
+            self.dispatch.add(name, func)
+        for name in self.custom_commands:
+            self.dispatch.add(name, name, exact=True)
+        
+        # Tab completion - each list gets loaded the first time you press Tab
+        self.completer = LineCompleter(
+            PrefixIndex(lambda: list(self.core_commands) + list(self.custom_commands)),
+            PrefixIndex(lambda: iter(self.knowledge)),
+            PrefixIndex(lambda: (c for c in self.colors if c != 'reset')),
+            PrefixIndex(lambda: list(self.custom_commands)),
+        )
     
     def load_json(self, filepath, default=None):
         """Load stuff from our saved files. If something goes wrong, no biggie!"""
-        if filepath.exists():
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"Hmm, couldn't load {filepath.name}: {e}")
-                return default if default is not None else {}
-        return default if default is not None else {}
+        return self.storage.load(filepath, default if default is not None else {})
     
     def save_json(self, filepath, data):
-        """Save our stuff so we remember it next time"""
-        try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2)
-        except IOError as e:
-            print(f"Oops, couldn't save {filepath.name}: {e}")
+        """Save our stuff so we remember it next time (in the background, in a moment)"""
+        self.storage.save(filepath, data)
+    
+    def open_knowledge_store(self):
+        """Pick where knowledge lives - SQLite unless you asked for plain JSON"""
+        backend = self.settings.get('knowledge_backend', 'sqlite')
+        if backend == 'json' or sqlite3 is None:
+            restore = not self.knowledge_file.exists()
+            store = JsonKnowledgeStore(self.knowledge_file, self.load_json, self.save_json)
+            moved = self._migrated_knowledge() if restore else None
+            if moved:
+                store.update_many(moved)
+            return store
+        
+        store = SQLiteKnowledgeStore(self.knowledge_db)
+        
+        # First run with SQLite, or back from JSON? Then the JSON file is the latest word
+        if self.knowledge_file.exists():
+            old = self.load_json(self.knowledge_file, {})
+            # (An empty one could just be unreadable - don't wipe the database for that)
+            if isinstance(old, dict) and old:
+                store.update_many(old.items(), replace=True)
+            os.replace(self.knowledge_file, self.knowledge_file.with_suffix('.json.migrated'))
+        return store
+    
+    def _migrated_knowledge(self):
+        """What was moved into SQLite, for going back to JSON - the database if we can
+        still read it, otherwise the copy of knowledge.json kept at the move"""
+        if sqlite3 is not None and self.knowledge_db.exists():
+            try:
+                return list(SQLiteKnowledgeStore(self.knowledge_db).items())
+            except sqlite3.Error:
+                pass
+        old = self.load_json(self.knowledge_file.with_suffix('.json.migrated'), {})
+        return list(old.items()) if isinstance(old, dict) else []
+    
+    def open_note_journal(self):
+        """Open the notes journal, moving old notes.json notes into it the first time"""
+        fresh = not self.journal_file.exists()
+        journal = NoteJournal(self.journal_file, self.journal_index_file)
+        if fresh and self.notes_file.exists():
+            old = self.load_json(self.notes_file, [])
+            if isinstance(old, list):
+                with open(self.journal_file, 'w', encoding='utf-8') as f:
+                    for note in old:
+                        f.write(json.dumps(note) + '\n')
+                journal.rebuild_index()
+            self.notes_file.rename(self.notes_file.with_suffix('.json.migrated'))
+        return journal
+    
+    def search_signature(self):
+        """A cheap fingerprint of the stores, saved with the index to spot a stale one"""
+        return (len(self.knowledge), len(self.notes), self.journal_file.stat().st_size)
+    
+    def save_search_index(self):
+        """Save the search index (with a fresh fingerprint) if anything changed"""
+        if self.search.dirty:
+            self.search.signature = self.search_signature()
+            self.search.save()
+    
+    def confirm(self, question):
+        """Ask a yes/no question - in batch mode we go with --yes instead of asking"""
+        if not self.interactive:
+            print(f"{question}{'yes' if self.assume_yes else 'no'} (batch mode)")
+            return self.assume_yes
+        print(question, end='')
+        answer = input()
+        # A yes/no isn't worth keeping in the up-arrow history
+        if readline is not None and answer.strip() and readline.get_current_history_length():
+            readline.remove_history_item(readline.get_current_history_length() - 1)
+        return answer.strip().lower() == 'yes'
     
     def colorize(self, text):
         """Make text pretty and colorful!"""
+        if not self.use_color:
+            return text
+        return f"{self.color_code()}{text}{self.colors['reset']}"
+    
+    def color_code(self):
+        """The color to use next - in rainbow mode, each call moves along the rainbow"""
         if self.settings.get('rainbow_mode', False):
-            return self.rainbow_text(text)
-        color_code = self.colors.get(self.current_color, self.colors['bright_cyan'])
-        return f"{color_code}{text}{self.colors['reset']}"
+            return self._next_rainbow_color()
+        return self.colors.get(self.current_color, self.colors['bright_cyan'])
+    
+    def show(self, result):
+        """Print a command's result - a string or lines - in one color, a page at a time"""
+        color = reset = ''
+        if self.use_color:
+            color, reset = self.color_code(), self.colors['reset']
+        page_lines = 0
+        if self.interactive and self.settings.get('pager', True) and self.renderer.is_tty():
+            page_lines = max(5, shutil.get_terminal_size().lines - 1)
+        self.renderer.render(result, color, reset, page_lines)
+    
+    @staticmethod
+    def _guarded_lines(lines):
+        """A command's lines, but if making them breaks partway, say so instead of
+        crashing (or ending a whole batch)"""
+        try:
+            yield from lines
+        except Exception as e:
+            yield f"❌ Oops, something broke: {str(e)}"
+    
+    @staticmethod
+    def as_text(result):
+        """Squash a result that came back as lines into one string"""
+        if result is None or isinstance(result, str):
+            return result
+        return "\n".join(result)
     
     def set_rgb_color(self, args):
         """Turn rainbow mode on or off - because who doesn't love rainbows?"""
@@ -190,6 +3016,11 @@ class Phantom:
     
     def rainbow_text(self, text):
         """Making text cycle through rainbow colors!"""
+        if not self.use_color:
+            return text
+        return self._next_rainbow_color() + text + self.colors['reset']
+    
+    def _next_rainbow_color(self):
         rainbow_colors = [
             '\033[38;5;196m',  # Red
             '\033[38;5;214m',  # Orange
@@ -199,20 +3030,21 @@ class Phantom:
             '\033[38;5;93m',   # Purple
         ]
         current_color = rainbow_colors[self.rainbow_offset % len(rainbow_colors)]
-        result = current_color + text + self.colors['reset']
         self.rainbow_offset = (self.rainbow_offset + 1) % len(rainbow_colors)
-        return result
+        return current_color
     
     def list_colors(self, args):
         """Show all the cool colors you can pick from"""
-        result = "\n=== 🎨 Available Colors ===\n"
+        yield ""
+        yield "=== 🎨 Available Colors ==="
+        yield ""
         all_colors = [c for c in self.colors.keys() if c != 'reset']
         for i in range(0, len(all_colors), 6):
             row = all_colors[i:i+6]
-            result += "\n  " + ", ".join(row)
-        result += f"\n\n💡 Current color: {self.current_color}"
-        result += f"\n💡 Usage: setcolor [name] or rgb on/off"
-        return result
+            yield "  " + ", ".join(row)
+        yield ""
+        yield f"💡 Current color: {self.current_color}"
+        yield f"💡 Usage: setcolor [name] or rgb on/off"
     
     def change_color(self, args):
         """Change what color everything looks like"""
@@ -236,19 +3068,17 @@ class Phantom:
         package = args.strip().lower()
         packages = {
             'requests': 'requests',
-            'all': 'requests'
+            'numpy': 'numpy',
+            'all': 'requests numpy'
         }
         if not package:
-            return "Available packages: requests, all"
+            return "Available packages: requests, numpy, all"
         if package not in packages:
-            return f"❌ I don't know that package. Try: requests or all"
+            return f"❌ I don't know that package. Try: requests, numpy or all"
         
         to_install = packages[package]
         print(f"📦 Installing {to_install}...")
-        print("Continue? (yes/no): ", end='')
-        response = input().strip().lower()
-        
-        if response != 'yes':
+        if not self.confirm("Continue? (yes/no): "):
             return "Okay, cancelled that."
         
         try:
@@ -266,13 +3096,10 @@ class Phantom:
     
     def _find_ollama_path(self):
         """Let's see if Ollama (the AI thing) is installed anywhere"""
-        try:
-            result = subprocess.run(['ollama', '--version'], 
-                                  capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                return 'ollama'
-        except (subprocess.TimeoutExpired, FileNotFoundError, OSError):
-            pass
+        # Looking on PATH is instant, no need to actually run ollama
+        found = shutil.which('ollama')
+        if found:
+            return found
         
         # Maybe it's in one of these common spots?
         if os.name == 'nt':
@@ -292,22 +3119,80 @@ class Phantom:
     
     def _check_ollama_status(self):
         """Is Ollama not just installed, but ready to go with a model?"""
-        if not self._is_ollama_installed():
+        # Asking the server directly is way cheaper than running 'ollama list'
+        # (which needs the server running anyway)
+        if self.models is None:
             return False
         try:
-            result = subprocess.run([self.ollama_path, 'list'], 
-                                  capture_output=True, text=True, timeout=5)
-            return 'llama3.2' in result.stdout.lower()
-        except (subprocess.TimeoutExpired, OSError):
+            return self.models.has(self.current_model, refresh=True)
+        except (requests.exceptions.RequestException, ValueError):
             return False
     
+    def _start_ollama_probe(self):
+        """Figure out if the AI is ready without making you wait for it"""
+        self._ollama_ready = None
+        self._probe_thread = None
+        self._checked_at = 0
+        
+        # If we checked recently, just trust what we found last time. "Not ready" only
+        # counts for a few seconds though - they might be starting Ollama right now
+        cached = self.load_json(self.status_file, {})
+        if isinstance(cached, dict):
+            ready = bool(cached.get('ready'))
+            checked_at = cached.get('checked_at', 0)
+            if time.time() - checked_at < self._status_ttl(ready):
+                self._ollama_ready, self._checked_at = ready, checked_at
+                return
+        
+        def _probe():
+            self._finish_probe(self._check_ollama_status())
+        
+        self._probe_thread = threading.Thread(target=_probe, daemon=True)
+        self._probe_thread.start()
+    
+    def _status_ttl(self, ready):
+        """How long a check stays good - a "yes" for a while, a "no" only briefly"""
+        if ready:
+            return self.settings.get('ollama_status_ttl', 600)
+        return self.settings.get('ollama_status_retry', 15)
+    
+    def _finish_probe(self, ready):
+        """The background check is done - remember what it found"""
+        self.ollama_ready = ready
+        if ready and self.warm_up_when_ready and self.ollama is not None:
+            self.ollama.warm_up(self._pick_model(''))
+    
+    def _forget_ollama_status(self):
+        """Throw away the cached status so the next check is a fresh one"""
+        try:
+            self.status_file.unlink()
+        except OSError:
+            pass
+    
+    @property
+    def ollama_ready(self):
+        """Is the AI good to go? Only waits if the background check isn't done yet"""
+        if self._ollama_ready is None and self._probe_thread is not None:
+            self._probe_thread.join()
+        # Wasn't ready last time we looked? That may have changed, so look again
+        if self._ollama_ready is False and time.time() - self._checked_at >= self._status_ttl(False):
+            self._finish_probe(self._check_ollama_status())
+        return bool(self._ollama_ready)
+    
+    @ollama_ready.setter
+    def ollama_ready(self, ready):
+        self._ollama_ready = ready
+        self._checked_at = time.time()
+        self.save_json(self.status_file, {'ready': ready, 'checked_at': self._checked_at})
+    
     def check_dependencies(self, args):
         """See what features we have available"""
         result = "\n=== 📦 What Do We Have? ===\n"
         result += f"\n  {'✅' if OLLAMA_AVAILABLE else '❌'} requests (needed for AI features)"
+        result += f"\n  {'✅' if np is not None else '❌'} numpy (needed for rag)"
         
         if self.ollama_ready:
-            result += f"\n  ✅ Ollama + llama3.2 (AI is ready to chat!)"
+            result += f"\n  ✅ Ollama + {self.current_model} (AI is ready to chat!)"
         else:
             if self._is_ollama_installed():
                 result += f"\n  ⚠️  Ollama is here, but run 'download' to get the AI model"
@@ -319,40 +3204,207 @@ class Phantom:
         return result
     
     def download_ollama(self, args):
-        """Download the AI brain (it's pretty big!)"""
+        """Download the AI brain (it's pretty big!) - or another model: download [name]"""
         if not OLLAMA_AVAILABLE:
             return "❌ First you need to: install requests"
         
         if not self._is_ollama_installed():
             return "❌ You need to install Ollama first! Get it from ollama.com"
         
-        if self.ollama_ready:
+        model = args.strip() or self.current_model
+        if not args.strip() and self.ollama_ready and model not in self.models.unfinished():
             return "✅ AI is already ready! Just type: ask [your question]"
         
-        print("🧠 This will download the AI model (~2GB, takes 2-5 minutes)...")
-        print("Continue? (yes/no): ", end='')
-        
-        if input().strip().lower() != 'yes':
+        print(f"🧠 This will download {model} (a few GB, takes a few minutes)...")
+        if not self.confirm("Continue? (yes/no): "):
             return "Okay, maybe later!"
         
+        result = self._pull_model(model)
+        if result.startswith('✅') and self.ollama_ready:
+            return "\n✅ AI INSTALLED! Try it out: ask hello"
+        return result
+    
+    @staticmethod
+    def _size(count):
+        """1536 -> '1.5 KB'"""
+        for unit in ('B', 'KB', 'MB', 'GB'):
+            if count < 1024 or unit == 'GB':
+                return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+            count /= 1024
+    
+    def _pull_model(self, model):
+        """Download a model through Ollama's API with a progress bar"""
+        if self.models is None:
+            return "❌ First you need to: install requests"
+        
+        # Per part of the model: when we started on it and how much it had already
+        seen = {}
+        state = {'status': None, 'bar': False, 'tenth': -1}
+        
+        def show(chunk):
+            status = chunk.get('status', '')
+            total, completed = chunk.get('total'), chunk.get('completed')
+            if total and completed is not None:
+                started, had = seen.setdefault(status, (time.time(), completed))
+                speed = (completed - had) / max(time.time() - started, 1e-6)
+                filled = int(20 * completed / total)
+                line = (f"📦 {status[:26]:<26} [{'#' * filled}{'.' * (20 - filled)}] "
+                        f"{completed / total:6.1%} {self._size(completed)}/{self._size(total)} "
+                        f"{self._size(speed)}/s")
+                if self.interactive:
+                    print("\r" + self.colorize(line), end='', flush=True)
+                    state['bar'] = True
+                elif status != state['status'] or completed * 10 // total > state['tenth']:
+                    # No carriage returns in a log file - just every 10% or so
+                    state['tenth'] = completed * 10 // total
+                    print(line, flush=True)
+            elif status != state['status']:
+                if state['bar']:
+                    print()
+                    state['bar'] = False
+                print(self.colorize(f"📦 {status}"), flush=True)
+            state['status'] = status
+        
+        try:
+            print(self.colorize(f"\n📦 Downloading {model}...\n"))
+            self.models.pull(model, show)
+        except KeyboardInterrupt:
+            return f"⏸ Stopped - 'model pull {model}' carries on from where it got to"
+        except PullError as e:
+            return f"❌ Couldn't download {model}: {e}"
+        finally:
+            if state['bar']:
+                print()
+        
+        if ModelManager.matches(self.current_model, model) or \
+                ModelManager.matches(model, self.current_model):
+            self.ollama_ready = True
+        return f"✅ Got {model}! Use it with: model use {model} (or ask --model {model} ...)"
+    
+    @property
+    def current_model(self):
+        """The model for this session - 'model use' beats the saved default"""
+        return self.session_model or self.settings.get('model', 'llama3.2')
+    
+    def _pick_model(self, prompt, override=None):
+        """Which model answers this: ask --model, then 'model use', then small/large
+        by how long the prompt is (if that's set up), then the default"""
+        if override:
+            return override
+        if self.session_model:
+            return self.session_model
+        small, large = self.settings.get('small_model'), self.settings.get('large_model')
+        if small and large:
+            return small if len(prompt) <= self.settings.get('route_chars', 400) else large
+        return self.current_model
+    
+    def _status_error(self, status, model=None):
+        if status == 404 and model:
+            return f"❌ Ollama doesn't have {model} - get it with: model pull {model}"
+        return f"❌ Got an error (Status {status}) - is Ollama actually running?"
+    
+    def model_command(self, args):
+        """Pick and get AI models - model list/use/default/pull/route"""
+        if self.models is None:
+            return "❌ Need to install requests first"
+        words = args.split()
+        action = words[0].lower() if words else 'list'
+        
+        if action in ('list', 'refresh'):
+            return self._model_list(refresh=action == 'refresh')
+        
+        if action in ('use', 'default'):
+            if len(words) != 2:
+                return f"Usage: model {action} [name] - type 'models' to see what you've got"
+            name = words[1]
+            try:
+                if not self.models.has(name):
+                    return f"❌ I don't see {name} here - get it with: model pull {name}"
+            except (requests.exceptions.RequestException, ValueError):
+                pass  # Can't check right now, trust them
+            if action == 'use':
+                self.session_model = name
+                message = f"✓ Using {name} until you quit"
+            else:
+                self.session_model = None
+                self.settings['model'] = name
+                self.save_json(self.settings_file, self.settings)
+                self._forget_ollama_status()
+                message = f"✓ {name} is the default model now"
+            self.ollama.warm_up(name)
+            return message
+        
+        if action == 'pull':
+            if len(words) > 1:
+                name = words[1]
+            else:
+                unfinished = self.models.unfinished()
+                name = unfinished[-1] if unfinished else self.current_model
+            return self._pull_model(name)
+        
+        if action == 'route':
+            if words[1:2] == ['off']:
+                self.settings.pop('small_model', None)
+                self.settings.pop('large_model', None)
+                self.save_json(self.settings_file, self.settings)
+                return "✓ Every question goes to the same model again"
+            if len(words) not in (3, 4) or (len(words) == 4 and not words[3].isdigit()):
+                return "Usage: model route [small model] [large model] [chars], or model route off"
+            self.settings['small_model'], self.settings['large_model'] = words[1], words[2]
+            if len(words) == 4:
+                self.settings['route_chars'] = int(words[3])
+            self.save_json(self.settings_file, self.settings)
+            return (f"✓ Questions up to {self.settings.get('route_chars', 400)} characters go to "
+                    f"{words[1]}, longer ones to {words[2]}")
+        
+        return "Usage: models, model use/default [name], model pull [name], model route ..."
+    
+    def list_models(self, args):
+        """Which AI models you've got"""
+        return self.model_command("list")
+    
+    def _model_list(self, refresh=False):
         try:
-            print("\n📦 Downloading the AI brain...\n")
-            result = subprocess.run([self.ollama_path, 'pull', 'llama3.2'], 
-                                  capture_output=False, text=True, timeout=600)
-            
-            if result.returncode == 0:
-                self.ollama_ready = True
-                return "\n✅ AI INSTALLED! Try it out: ask hello"
-            return "❌ Something went wrong with the download."
-        except subprocess.TimeoutExpired:
-            return "❌ Download took too long and timed out."
-        except Exception as e:
-            return f"❌ Error: {str(e)}"
+            models = self.models.installed(refresh)
+        except (requests.exceptions.RequestException, ValueError):
+            return "❌ Can't connect to Ollama. Try opening a terminal and running 'ollama serve'"
+        
+        roles = [(self.settings.get('model', 'llama3.2'), 'default'),
+                 (self.session_model, 'this session'),
+                 (self.settings.get('small_model'), 'short questions'),
+                 (self.settings.get('large_model'), 'long questions')]
+        lines = ["\n=== 🧠 Models ===\n"]
+        for model in sorted(models, key=lambda m: m['name']):
+            name = model['name']
+            marks = [role for wanted, role in roles if wanted and ModelManager.matches(wanted, name)]
+            pointer = "👉" if ModelManager.matches(self.current_model, name) else "  "
+            lines.append(f"\n  {pointer} {name:<32}{self._size(model['size']):>10}"
+                         f"{'  (' + ', '.join(marks) + ')' if marks else ''}")
+        if not models:
+            lines.append(f"\n  (none yet - try: model pull {self.current_model})")
+        for name in self.models.unfinished():
+            lines.append(f"\n  ⏸  {name} (download didn't finish - model pull {name})")
+        lines.append("\n\n💡 model use [name], model default [name], model pull [name], "
+                     "model route [small] [large] [chars]")
+        return "".join(lines)
     
-    def ask_ai(self, args):
+    def ask_ai(self, args, use_cache=True):
         """Talk to the AI - ask it anything!"""
         question = args.strip()
         
+        # 'ask ... &' (or the ask_in_background setting) hands it off to a worker
+        background = question.endswith('&')
+        if background:
+            question = question[:-1].strip()
+        background = background or self.settings.get('ask_in_background', False)
+        
+        # 'ask --model mistral why is the sky blue' picks the model just this once
+        model = None
+        if question.startswith('--model'):
+            _, _, rest = question.partition(' ')
+            model, _, question = rest.strip().partition(' ')
+            question = question.strip()
+        
         if not question:
             return "Usage: ask [your question]"
         
@@ -362,44 +3414,510 @@ class Phantom:
         if not OLLAMA_AVAILABLE:
             return "❌ Need to install requests first"
         
+        # Batch mode already runs asks side by side and needs the answer right there
+        if background and self.interactive:
+            asked = self.asks.submit(question, use_cache, model, self._notice_box())
+            if asked is None:
+                return (f"❌ {self.asks.max_waiting} questions are already waiting - "
+                        f"try again in a bit (or cancel some, see: results)")
+            busy = len(self.asks.active()) - 1
+            waiting = f", {busy} ahead of it" if busy else ""
+            return f"⏳ Working on that in the background as question {asked.id}{waiting}"
+        
+        prompt, model, options, cache_key, use_cache, cached = \
+            self._prepare_ask(question, model, use_cache)
+        if cached is not None:
+            return f"🤖 {cached}"
+        
+        send = lambda: self.ollama.generate(model, prompt, stream=True, timeout=(5, 120),
+                                            options=options)
+        extract = lambda chunk: chunk.get('response', '')
+        if self.interactive and self.settings.get('stream_answers', True):
+            answer = self._stream_reply(send, extract, model)
+            if use_cache and isinstance(answer, StreamedAnswer) and answer.complete:
+                self.response_cache.put(cache_key, answer.text)
+            return answer
+        
+        print(self.colorize("🧠 Let me think about that...\n"))
+        text, error = self._collect_reply(send, extract, model)
+        if text is None:
+            return error
+        if use_cache:
+            self.response_cache.put(cache_key, text)
+        return f"🤖 {text}"
+    
+    def ask_fresh(self, args):
+        """Like ask, but skips the cache and gets a brand new answer"""
+        return self.ask_ai(args, use_cache=False)
+    
+    def _prepare_ask(self, text, model=None, use_cache=True, warn=None):
+        """Everything before actually asking: notes for context, which model, and
+        whether we already have the answer. Returns (prompt, model, options, cache key,
+        use_cache, cached answer or None)"""
+        prompt = text
+        if self.settings.get('rag_enabled', False):
+            prompt = self._with_context(text, warn)
+        model = self._pick_model(prompt, model)
+        options = self.settings.get('ollama_options', {})
+        cache_key = ResponseCache.key(prompt, model, options)
+        use_cache = use_cache and self.settings.get('cache_enabled', True)
+        cached = self.response_cache.get(cache_key) if use_cache else None
+        return prompt, model, options, cache_key, use_cache, cached
+    
+    def _answer_in_background(self, question):
+        """What the ask workers run - like ask_ai, but quietly collects the answer"""
+        prompt, model, options, cache_key, use_cache, cached = self._prepare_ask(
+            question.text, question.model, question.use_cache,
+            lambda message: self._notify(question.owner, message))
+        if cached is not None:
+            question.pieces.append(cached)
+            return f"🤖 {cached}"
+        
+        def hold(response):
+            question.response = response  # So cancel can hang up on it
+        
+        # The pieces go straight onto the question, so 'results N' can peek while it's going
+        status, error = self._stream(
+            lambda: self.ollama.generate(model, prompt, stream=True, timeout=(5, 120),
+                                         options=options),
+            lambda chunk: chunk.get('response', ''),
+            model, 'background', question.pieces.append,
+            hold=hold, cancelled=lambda: question.cancelled
+        )
+        if status != 'ok':
+            return error
+        answer = ''.join(question.pieces)
+        if use_cache and not question.cancelled:
+            self.response_cache.put(cache_key, answer)
+        return f"🤖 {answer}"
+    
+    def _announce_answer(self, question):
+        """Let them know an answer is in, at their next prompt"""
+        preview = question.text if len(question.text) <= 40 else question.text[:37] + "..."
+        icon = "🔔" if question.status == 'done' else "⚠️ "
+        self._notify(question.owner, f"{icon} Question {question.id} ({preview}) is "
+                                     f"{question.status} - see it with: results {question.id}")
+    
+    def _notice_box(self):
+        """Where notices for whoever's typing on this thread go - a daemon window has
+        its own, otherwise it's ours"""
+        box = getattr(self.local, 'notices', None)
+        return self.notices if box is None else box
+    
+    def _notify(self, box, text):
+        """Leave a notice for whoever asked. It only gets queued here - the thread that
+        owns the prompt prints it, since readline can't be touched from a worker while
+        input() is waiting"""
+        box = self.notices if box is None else box
+        box.append(text)
+    
+    def _print_notices(self):
+        """Print the notices waiting for whoever's typing on this thread"""
+        box = self._notice_box()
+        if not box:
+            return
+        lines = []
+        with contextlib.suppress(IndexError):
+            while True:
+                lines.append(self.colorize(box.popleft()))
+        if lines:
+            print("\n".join(lines))
+    
+    def show_results(self, args):
+        """Answers to background questions - results, or results [N] for one of them"""
+        question_id = args.strip()
+        if question_id:
+            question = self.asks.questions.get(int(question_id)) if question_id.isdigit() else None
+            if question is None:
+                return "Usage: results [N] - type 'results' to see them all"
+            question.seen = True
+            if question.answer is not None:
+                return question.answer
+            if question.status == 'cancelled':
+                return f"🚫 Question {question.id} was cancelled"
+            if question.status == 'queued':
+                return f"⏳ Question {question.id} is still waiting its turn"
+            so_far = ''.join(question.pieces)
+            return (f"🤖 {so_far}" if so_far else "🤖") + \
+                f"\n\n⏳ (still going, {question.runtime():.0f}s so far)"
+        
+        with self.asks.lock:
+            questions = list(self.asks.questions.values())
+        if not questions:
+            return "🤖 No background questions yet. Try: ask [your question] &"
+        icons = {'queued': '⏳', 'running': '▶️ ', 'done': '✅', 'failed': '❌',
+                 'cancelled': '🚫'}
+        lines = [f"\n=== 🤖 Background Questions ({self.asks.parallel} at once) ===\n"]
+        for question in questions:
+            new = " (new!)" if question.status == 'done' and not question.seen else ""
+            lines.append(f"\n  {icons.get(question.status, '?')} [{question.id}] "
+                         f"{question.text[:50]} - {question.status}, "
+                         f"{question.runtime():.1f}s{new}")
+        lines.append("\n\n💡 results [N] shows an answer, cancel [N] stops one")
+        return "".join(lines)
+    
+    def cancel_question(self, args):
+        """Stop a background question, or take it out of line"""
+        question_id = args.strip()
+        if not question_id.isdigit():
+            return "Usage: cancel [question number] - type 'results' to see them"
+        if self.asks.cancel(int(question_id)):
+            return f"✓ Cancelled question {question_id}"
+        return f"❌ Question {question_id} isn't running or waiting"
+    
+    def _stream(self, send, extract, model, kind, sink, hold=None, cancelled=None):
+        """Read a streamed reply from Ollama, handing each piece to sink(piece) as it
+        arrives. Everything that asks the AI comes through here, so errors, timing and
+        hanging up work the same everywhere. send() starts the request, extract() pulls
+        the text out of each chunk, hold(response) gets the open stream, and cancelled()
+        says whether somebody else hung up on it. Returns (status, error message) -
+        status is 'ok', 'stopped' or 'error'."""
+        cancelled = cancelled or (lambda: False)
+        response = None
+        started, first, final, status = time.perf_counter(), None, None, 'error'
         try:
-            print(self.colorize("🧠 Let me think about that...\n"))
+            response = send()
+            if hold is not None:
+                hold(response)
+            if cancelled():
+                status = 'stopped'
+                return status, ""
+            if response.status_code != 200:
+                return status, self._status_error(response.status_code, model)
             
-            response = requests.post(
-                'http://localhost:11434/api/generate',
-                json={
-                    'model': 'llama3.2',
-                    'prompt': question,
-                    'stream': False
-                },
-                timeout=120
-            )
+            # Ollama sends one JSON object per line until it says it's done
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    return status, f"❌ Ollama said: {chunk['error']}"
+                piece = extract(chunk)
+                if piece:
+                    if first is None:
+                        first = time.perf_counter()
+                    sink(piece)
+                if chunk.get('done'):
+                    final = chunk
+                    break
             
-            if response.status_code == 200:
-                answer = response.json().get('response', 'Hmm, no response came back')
-                return f"🤖 {answer}"
-            return f"❌ Got an error (Status {response.status_code}) - is Ollama actually running?"
-                
-        except requests.exceptions.Timeout:
+            if first is None:
+                return status, "🤖 Hmm, no response came back"
+            status = 'ok'
+            return status, None
+        except KeyboardInterrupt:
+            status = 'stopped'
+            raise
+        except Exception as e:
+            if cancelled():
+                status = 'stopped'
+                return status, ""  # That's just us hanging up on it
+            return status, self._ollama_error(e)
+        finally:
+            # Closing the connection is what tells Ollama to stop generating
+            if response is not None:
+                response.close()
+            if cancelled():
+                status = 'stopped'
+            self._log_answer(model, kind, started, first, final, status)
+    
+    def _ollama_error(self, error):
+        """What to tell them when talking to Ollama blew up"""
+        if isinstance(error, requests.exceptions.Timeout):
             return "❌ That took too long, gave up waiting."
-        except requests.exceptions.ConnectionError:
+        if isinstance(error, requests.exceptions.ConnectionError):
+            self._forget_ollama_status()
             return "❌ Can't connect to Ollama. Try opening a terminal and running 'ollama serve'"
-        except Exception as e:
-            return f"❌ Something went wrong: {str(e)}"
+        if isinstance(error, ValueError):
+            return "❌ Ollama sent back something I couldn't read."
+        return f"❌ Something went wrong: {str(error)}"
+    
+    def _stream_reply(self, send, extract, model=None, kind='ask'):
+        """Print a streamed reply word by word as it arrives"""
+        pieces = []
+        
+        def show(piece):
+            if not pieces:
+                print(self.colorize("🤖 "), end='', flush=True)
+            pieces.append(piece)
+            print(self.colorize(piece), end='', flush=True)
+        
+        try:
+            status, error = self._stream(send, extract, model, kind, show)
+        except KeyboardInterrupt:
+            # Ctrl+C just stops the answer, not the whole assistant
+            print(self.colorize("\n✋ Stopped.\n"))
+            return self._streamed(pieces, complete=False)
+        if pieces:
+            print()
+        if status != 'ok':
+            return error
+        return self._streamed(pieces)
+    
+    def _collect_reply(self, send, extract, model=None, kind='ask'):
+        """Like _stream_reply, but quietly - for batch mode and scripts.
+        Returns (text, None) or (None, error message)"""
+        pieces = []
+        status, error = self._stream(send, extract, model, kind, pieces.append)
+        if status != 'ok':
+            return None, error
+        return ''.join(pieces), None
+    
+    def _log_answer(self, model, kind, started, first, final, status):
+        """Write down how this answer went, for 'aistats'"""
+        if not self.settings.get('ai_stats', True):
+            return
+        try:
+            self.answer_log.add(AnswerLog.entry(model, kind, started, first, final, status))
+        except OSError:
+            pass  # Not being able to log is no reason to lose the answer
+    
+    def _streamed(self, pieces, complete=True):
+        text = ''.join(pieces)
+        answer = StreamedAnswer(f"🤖 {text}")
+        answer.text = text
+        answer.complete = complete
+        return answer
+    
+    def cache_stats(self, args):
+        """How much the answer cache has been helping"""
+        cache = self.response_cache
+        asked = cache.hits + cache.misses
+        rate = f"{cache.hits / asked:.0%}" if asked else "n/a"
+        return (
+            f"\n=== 🗃️  Answer Cache ===\n"
+            f"\n  Saved answers: {len(cache)} (max {cache.max_entries}, "
+            f"{len(cache.memory)} in memory)"
+            f"\n  This session: {cache.hits} hits, {cache.misses} misses (hit rate {rate})"
+            f"\n  Answers expire after: {cache.ttl / 3600:g} hours"
+            f"\n\n💡 Use 'ask! [question]' to skip the cache"
+        )
+    
+    def cache_clear(self, args):
+        """Forget every saved answer"""
+        count = len(self.response_cache)
+        self.response_cache.clear()
+        return f"✓ Cleared {count} saved answers"
+    
+    def _chat_path(self, name):
+        return self.chats_dir / f"{name}.json"
+    
+    def _chat_exists(self, name):
+        """Saved on disk, or about to be"""
+        path = self._chat_path(name)
+        with self.storage.lock:
+            if path in self.storage.dirty:
+                return True
+        return path.exists()
+    
+    def _open_chat(self, name):
+        self.chats_dir.mkdir(exist_ok=True)
+        self.chat_session = ChatSession(name, self._chat_path(name), self.load_json,
+                                        self.save_json, self.settings.get('chat_token_budget', 2048))
+        return self.chat_session
+    
+    def chat(self, args):
+        """Have a back-and-forth with the AI that remembers what you said"""
+        message = args.strip()
+        if not message:
+            return "Usage: chat [message] (or chat new/resume/list/end)"
+        if not self.ollama_ready:
+            return "❌ You need to run 'download' first to get the AI!"
+        if not OLLAMA_AVAILABLE:
+            return "❌ Need to install requests first"
+        
+        session = self.chat_session or self._open_chat('default')
+        session.add('user', message)
+        
+        model = self.current_model
+        send = lambda: self.ollama.chat(model, session.outgoing(), stream=True, timeout=(5, 120))
+        extract = lambda chunk: chunk.get('message', {}).get('content', '')
+        if self.interactive and self.settings.get('stream_answers', True):
+            answer = self._stream_reply(send, extract, model, 'chat')
+            text = answer.text if isinstance(answer, StreamedAnswer) else None
+        else:
+            print(self.colorize("🧠 Let me think about that...\n"))
+            text, error = self._collect_reply(send, extract, model, 'chat')
+            answer = f"🤖 {text}" if text is not None else error
+        
+        if text is None:
+            session.take_back()
+        else:
+            session.add('assistant', text)
+            session.save()
+        return answer
+    
+    def _chat_name(self, args):
+        name = args.strip().lower()
+        if name and all(c.isalnum() or c in '-_' for c in name):
+            return name
+        return None
+    
+    def chat_new(self, args):
+        """Start a fresh conversation"""
+        name = self._chat_name(args) or datetime.datetime.now().strftime('chat-%Y%m%d-%H%M%S')
+        if self._chat_exists(name):
+            return f"❌ There's already a chat called '{name}' - use: chat resume {name}"
+        self._open_chat(name)
+        return f"✓ Started chat '{name}' - talk with: chat [message]"
+    
+    def chat_resume(self, args):
+        """Pick up an old conversation where you left off"""
+        name = self._chat_name(args)
+        if not name:
+            return "Usage: chat resume [name]"
+        if not self._chat_exists(name):
+            return f"❌ No chat called '{name}'. Type 'chat list' to see them"
+        session = self._open_chat(name)
+        return f"✓ Back in chat '{name}' ({len(session.messages)} messages remembered)"
+    
+    def chat_list(self, args):
+        """Show all your saved conversations"""
+        names = {p.stem for p in self.chats_dir.glob('*.json')} if self.chats_dir.exists() else set()
+        with self.storage.lock:
+            names.update(p.stem for p in self.storage.dirty if p.parent == self.chats_dir)
+        names = sorted(names)
+        if not names:
+            return "💬 No chats yet. Start one with: chat [message]"
+        current = self.chat_session.name if self.chat_session else None
+        lines = ["\n=== 💬 Your Chats ===\n"]
+        for name in names:
+            lines.append(f"\n  {'➤' if name == current else ' '} {name}")
+        return "".join(lines)
+    
+    def chat_end(self, args):
+        """Leave the current conversation (it stays saved)"""
+        if self.chat_session is None:
+            return "You're not in a chat right now."
+        name = self.chat_session.name
+        self.chat_session.save()
+        self.chat_session = None
+        return f"✓ Left chat '{name}' - come back with: chat resume {name}"
+    
+    def _note_context(self, note):
+        """How a note reads when we hand it to the AI"""
+        if not isinstance(note, dict):
+            return str(note)
+        return f"Note from {note.get('timestamp', 'some time')}: {note.get('text', '')}"
+    
+    def _rag_entries(self):
+        """Everything worth looking up: each knowledge topic and each note"""
+        for topic, info in self.knowledge.items():
+            yield ('k', topic), f"{topic}: {info}"
+        for i, note in enumerate(self.notes):
+            yield ('n', i), self._note_context(note)
+    
+    def _sync_embeddings(self):
+        """Embed whatever's new since last time. Returns how many got embedded"""
+        if self.embeddings is None:
+            self.embeddings = EmbeddingIndex(
+                self.config_dir / "embeddings.f32", self.config_dir / "embeddings.jsonl",
+                (self.config_dir / "embeddings.npy", self.config_dir / "embeddings.json"))
+        model = self.settings.get('embed_model', 'nomic-embed-text')
+        embed = lambda texts: self.ollama.embed(model, texts)
+        # Just a few things taught or forgotten? Patch those in instead of checking everything
+        if not self.embeddings_dirty:
+            changes, self.embedding_changes = self.embedding_changes, {}
+            count = self.embeddings.update(changes, model, embed)
+            if count is not None:
+                return count
+        self.embedding_changes = {}
+        count = self.embeddings.sync(self._rag_entries(), model, embed)
+        self.embeddings_dirty = False
+        return count
+    
+    def _embedding_changed(self, doc, text):
+        """One topic or note changed - remember it for the next time we need the vectors"""
+        self.embedding_changes[doc] = text
+    
+    def _with_context(self, question, warn=None):
+        """Add the most relevant stuff you taught me to the question"""
+        warn = warn or (lambda message: print(self.colorize(message)))
+        if np is None:
+            warn("⚠️  rag is on but numpy isn't installed, asking without your notes")
+            return question
+        try:
+            if self.embeddings_dirty or self.embeddings is None or self.embedding_changes:
+                self._sync_embeddings()
+            model = self.settings.get('embed_model', 'nomic-embed-text')
+            vector = self.ollama.embed(model, [question])[0]
+            matches = self.embeddings.query(vector, self.settings.get('rag_top_k', 4))
+        except (requests.exceptions.RequestException, KeyError, ValueError, IndexError) as e:
+            warn(f"⚠️  Couldn't look through your notes ({e}), asking without them")
+            return question
+        
+        if not matches:
+            return question
+        texts = dict(self._rag_entries_for([doc for _, doc in matches]))
+        context = "\n".join(f"- {texts[doc]}" for _, doc in matches if doc in texts)
+        return (
+            "Here is some stuff the user saved earlier that might help:\n"
+            f"{context}\n\n"
+            "Use it if it's relevant, otherwise just answer normally.\n\n"
+            f"Question: {question}"
+        )
+    
+    def _rag_entries_for(self, docs):
+        """Just the texts for these particular doc ids, without reading everything"""
+        for kind, key in docs:
+            if kind == 'k':
+                info = self.knowledge.get(key)
+                if info is not None:
+                    yield (kind, key), f"{key}: {info}"
+            else:
+                for note in self.notes.range(key, key + 1):
+                    yield (kind, key), self._note_context(note)
+    
+    def set_rag(self, args):
+        """Let 'ask' use what you taught me and your notes as extra context"""
+        args = args.strip().lower()
+        if args in ['on', 'off']:
+            if args == 'on' and np is None:
+                return "❌ This needs numpy first: install numpy"
+            self.settings['rag_enabled'] = args == 'on'
+            self.save_json(self.settings_file, self.settings)
+            return f"✓ Asking with your notes is now {args.upper()}"
+        if args == 'sync':
+            if np is None:
+                return "❌ This needs numpy first: install numpy"
+            if not OLLAMA_AVAILABLE or not self.ollama_ready:
+                return "❌ The AI isn't set up yet - run 'download' first"
+            model = self.settings.get('embed_model', 'nomic-embed-text')
+            try:
+                count = self._sync_embeddings()
+            except requests.exceptions.RequestException as e:
+                return f"❌ Couldn't embed with '{model}' - try: ollama pull {model} ({e})"
+            return f"✓ Embeddings up to date ({count} new or changed)"
+        return "Usage: rag on/off, rag sync"
     
     def show_help(self, args):
         """Show what I can do for you!"""
         return f"""
 === {self.PROGRAM_NAME} - What Can I Do? ===
 
-🤖 AI STUFF: download, ask [question]
+🤖 AI STUFF: download, ask [question], ask! [question] (skip the cache),
+            ask [question] & (answers in the background), results [N], cancel [N],
+            ask --model [name] [question], models, model use/default/pull [name],
+            model route [small model] [large model] [chars] (or off),
+            rag on/off/sync (ask using your notes), cache stats, cache clear
+💬 CHAT: chat [message], chat new [name], chat resume [name], chat list, chat end
 🎨 COLORS: listcolors, setcolor [name], rgb on/off
-📝 NOTES: note [text], notes, clear notes  
-🧠 MEMORY: teach [topic]: [info], what do you know about [topic], forget
-🌐 WEB: open [site], search [query], ping [site], ip
+📝 NOTES: note [text], notes, notes page [N], notes all, notes since [date],
+          notes between [date] [date], delete note [N], clear notes
+🧠 MEMORY: teach [topic]: [info], what do you know about [topic], forget,
+          find [words] (searches knowledge and notes),
+          import [file or folder] (.md .txt .csv), export [file]
+🌐 WEB: open [site], search [query], ping [site] [site...], ip,
+        ping watch [sites] every [N], ping watch stop, ping history [site]
+📂 FILES: locate [name or *.glob], open [file or number from locate],
+          index (status), index refresh, index add/remove [folder]
 💻 SYSTEM: time, calc [math problem], clear screen, banner
-⚙️ CUSTOM: add command [name]: [action], list commands
-📦 SETUP: install requests, check dependencies
+📊 STATS: stats on/off, stats, stats reset, stats export,
+          aistats (how fast the AI answers), aistats [model], aistats clear
+🔢 MATH: calc x = 5, calc sqrt(x) * ans, calc x**2 for x in 1..1000000 (step 2)
+⚙️ CUSTOM: add command [name]: [action], list commands, remove command [name]
+⚙️ JOBS: jobs, job [id] (shows its output), kill [id]
+📦 SETUP: install requests/numpy/all, check dependencies
 
 Want AI powers? Type 'download' to get started!
 """
@@ -418,7 +3936,9 @@ Want AI powers? Type 'download' to get started!
         if not topic or not info:
             return "❌ I need both a topic and some info about it!"
         self.knowledge[topic] = info
-        self.save_json(self.knowledge_file, self.knowledge)
+        self.search.add_knowledge(topic, info)
+        self.completer.topics.add(topic)
+        self._embedding_changed(('k', topic), f"{topic}: {info}")
         return f"✓ Got it! I'll remember about '{topic}'"
     
     def forget(self, args):
@@ -428,7 +3948,9 @@ Want AI powers? Type 'download' to get started!
             return "Usage: forget [topic]"
         if topic in self.knowledge:
             del self.knowledge[topic]
-            self.save_json(self.knowledge_file, self.knowledge)
+            self.search.remove_knowledge(topic)
+            self.completer.topics.remove(topic)
+            self._embedding_changed(('k', topic), None)
             return f"✓ Okay, forgot everything about '{topic}'"
         return f"❌ I don't actually know anything about '{topic}'"
     
@@ -437,15 +3959,200 @@ Want AI powers? Type 'download' to get started!
         topic = args.strip().lower()
         if not topic:
             return "Usage: what do you know about [topic]"
-        if topic in self.knowledge:
-            return f"📖 {topic}: {self.knowledge[topic]}"
+        info = self.knowledge.get(topic)
+        if info is not None:
+            return f"📖 {topic}: {info}"
         return f"❌ I don't know anything about '{topic}' yet. Want to teach me?"
     
+    def find(self, args):
+        """Search everything you taught me and all your notes - typos are fine"""
+        query = args.strip()
+        if not query:
+            return "Usage: find [words]"
+        self.search.ensure(self.knowledge, self.notes)
+        hits = self.search.search(query, self.settings.get('find_limit', 10))
+        if not hits:
+            return f"🔍 Nothing matches '{query}'"
+        
+        lines = [f"\n=== 🔍 Results for '{query}' ===\n"]
+        for score, (kind, key) in hits:
+            if kind == 'k':
+                info = self.knowledge.get(key, '')
+                lines.append(f"\n  📖 {key}: {info[:100]}")
+            else:
+                note = next(self.notes.range(key, key + 1), {})
+                txt = note.get('text', note) if isinstance(note, dict) else str(note)
+                lines.append(f"\n  📝 [{key + 1}] {txt[:100]}")
+        return "".join(lines)
+    
+    def _knowledge_changed(self):
+        """Lots of topics changed at once - start the indexes over instead of patching"""
+        self.search.invalidate()
+        self.embeddings_dirty = True
+        self.completer.topics.reset()
+    
+    def _import_files(self, root):
+        """Every file we know how to read under root, as (path, size, mtime)"""
+        if root.is_file():
+            paths = [root] if root.suffix.lower() in IMPORT_KINDS else []
+        else:
+            paths = []
+            for folder, subfolders, names in os.walk(root):
+                subfolders[:] = sorted(d for d in subfolders if not d.startswith('.'))
+                paths.extend(Path(folder, name) for name in sorted(names)
+                             if name.lower().endswith(IMPORT_KINDS))
+        files = []
+        for path in paths:
+            st = path.stat()
+            if st.st_size:
+                files.append((str(path), st.st_size, st.st_mtime_ns))
+        return files
+    
+    def _parse_all(self, tasks, pool, workers):
+        """Parse every chunk, in order - only a few at a time are in flight, so a big
+        import never has all its parsed topics sitting in memory at once"""
+        if pool is None:
+            for task in tasks:
+                yield task, _parse_chunk(*task)
+            return
+        tasks = iter(tasks)
+        window = deque()
+        for task in tasks:
+            window.append((task, pool.submit(_parse_chunk, *task)))
+            if len(window) >= workers * 2:
+                break
+        while window:
+            task, future = window.popleft()
+            yield task, future.result()
+            task = next(tasks, None)
+            if task is not None:
+                window.append((task, pool.submit(_parse_chunk, *task)))
+    
+    def import_knowledge(self, args):
+        """Load a file or a whole folder of .md, .txt or .csv files into what I know"""
+        target = args.strip().strip('"')
+        if not target:
+            return "Usage: import [file or folder] (.md, .txt or .csv)"
+        root = Path(target).expanduser().resolve()
+        if not root.exists():
+            return f"❌ Can't find {root}"
+        try:
+            files = self._import_files(root)
+        except OSError as e:
+            return f"❌ Couldn't read {root}: {e}"
+        if not files:
+            return f"❌ No .md, .txt or .csv files in {root}"
+        
+        # Same import as last time that got stopped? Skip the files it already did
+        state = self.load_json(self.import_state_file, {})
+        done = state.get('done', {}) if state.get('root') == str(root) else {}
+        todo = [f for f in files if done.get(f[0]) != [f[1], f[2]]]
+        state = {'root': str(root),
+                 'done': {f[0]: [f[1], f[2]] for f in files if done.get(f[0]) == [f[1], f[2]]}}
+        if len(todo) < len(files):
+            print(self.colorize(f"⏩ Picking up where the last import stopped "
+                                f"({len(files) - len(todo)} files already done)"))
+        
+        # Big files get cut up so the worker processes can share them
+        chunk_size = self.settings.get('import_chunk_mb', 4) * 1024 * 1024
+        tasks = [(path, start, end) for path, size, _ in todo
+                 for start, end in _plan_chunks(path, size, chunk_size)]
+        left = Counter(path for path, _, _ in tasks)
+        stamps = {path: [size, mtime] for path, size, mtime in todo}
+        total = sum(size for _, size, _ in todo)
+        workers = max(1, self.settings.get('import_workers', os.cpu_count() or 1))
+        pool = None
+        if len(tasks) > 1 and total > 1024 * 1024 and workers > 1:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+        
+        batch, finished = [], []
+        count = read = files_done = 0
+        started = shown = time.perf_counter()
+        
+        def write_batch():
+            # One transaction for the lot, then remember which files are fully in
+            if batch:
+                self.knowledge.update_many(batch)
+                batch.clear()
+            for path in finished:
+                state['done'][path] = stamps[path]
+            finished.clear()
+            self.save_json(self.import_state_file, state)
+        
+        try:
+            for (path, start, end), entries in self._parse_all(tasks, pool, workers):
+                batch.extend(entries)
+                count += len(entries)
+                read += end - start
+                left[path] -= 1
+                if not left[path]:
+                    finished.append(path)
+                    files_done += 1
+                if len(batch) >= 5000:
+                    write_batch()
+                now = time.perf_counter()
+                if self.interactive and now - shown > 0.2:
+                    shown = now
+                    print("\r" + self.colorize(
+                        f"📥 {files_done}/{len(todo)} files, {read / max(total, 1):.0%}, "
+                        f"{count:,} topics ({count / (now - started):,.0f}/s)"), end='', flush=True)
+            write_batch()
+        except KeyboardInterrupt:
+            write_batch()
+            return "\n⏸ Import stopped - run the same import again to carry on from there"
+        except (OSError, ValueError) as e:
+            write_batch()
+            return f"\n❌ Import stopped on a file it couldn't read ({e}) - fix it and run it again"
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            self._knowledge_changed()
+        
+        self.save_json(self.import_state_file, {})
+        elapsed = time.perf_counter() - started
+        if self.interactive:
+            print()
+        return (f"✓ Imported {count:,} topics from {len(todo)} files in {elapsed:.1f}s "
+                f"({count / max(elapsed, 1e-9):,.0f} topics/s, "
+                f"{total / 1024 / 1024 / max(elapsed, 1e-9):.1f} MB/s)")
+    
+    def export_knowledge(self, args):
+        """Save everything I know to a .md, .txt or .csv file (import can read it back)"""
+        target = args.strip().strip('"')
+        if not target:
+            return "Usage: export [file] (.md, .txt or .csv)"
+        path = Path(target).expanduser()
+        if path.is_dir():
+            path = path / "knowledge.md"
+        kind = path.suffix.lower()
+        if kind not in IMPORT_KINDS:
+            return "❌ I can export to .md, .txt or .csv"
+        
+        temp = path.with_name(f".{path.name}.tmp")
+        count = 0
+        try:
+            with open(temp, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f) if kind == '.csv' else None
+                if writer:
+                    writer.writerow(['topic', 'info'])
+                for topic, info in self.knowledge.items():
+                    if writer:
+                        writer.writerow([topic, info])
+                    elif kind == '.txt':
+                        f.write(f"{topic}: {' '.join(info.split())}\n")
+                    else:
+                        f.write(f"## {topic}\n\n{info}\n\n")
+                    count += 1
+            os.replace(temp, path)
+        except OSError as e:
+            return f"❌ Couldn't write {path}: {e}"
+        return f"✓ Exported {count:,} topics to {path}"
+    
     def open_app(self, args):
-        """Open a website for you"""
-        target = args.strip()
+        """Open a website, a file, or something 'locate' found"""
+        target = args.strip().strip('"')
         if not target:
-            return "Usage: open [website]"
+            return "Usage: open [website, file, or number from locate]"
         if any(target.startswith(x) for x in ["http://", "https://", "www."]):
             url = target if target.startswith("http") else f"https://{target}"
             try:
@@ -453,7 +4160,149 @@ Want AI powers? Type 'download' to get started!
                 return f"✓ Opening {target} in your browser!"
             except Exception as e:
                 return f"❌ Couldn't open browser: {str(e)}"
-        return "Don't forget to add http:// or www. to the start!"
+        
+        if target.isdigit() and self.located:
+            number = int(target)
+            if not 1 <= number <= len(self.located):
+                return f"❌ Pick a number from 1 to {len(self.located)}"
+            return self._open_path(self.located[number - 1])
+        
+        path = Path(target).expanduser()
+        if path.exists():
+            return self._open_path(str(path))
+        
+        # Not a path - maybe it's the name of something in the file index
+        if sqlite3 is not None and self._file_index().refreshed_at() is not None:
+            matches = self._file_index().search(target, self.settings.get('locate_limit', 20))
+            exact = [m for m in matches if os.path.basename(m[0]).lower() == target.lower()]
+            if len(exact) == 1 or len(matches) == 1:
+                return self._open_path((exact or matches)[0][0])
+            if matches:
+                return self._located_lines(target, matches, "Which one? Type: open [number]")
+        return "❌ Can't find that - for websites add http:// or www. to the start!"
+    
+    def _open_path(self, path):
+        """Open a file or folder with whatever the computer normally uses for it"""
+        try:
+            if os.name == 'nt':
+                os.startfile(path)
+            elif sys.platform == 'darwin':
+                subprocess.Popen(['open', path])
+            else:
+                subprocess.Popen(['xdg-open', path], stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL)
+        except OSError as e:
+            return f"❌ Couldn't open {path}: {e}"
+        return f"✓ Opening {path}"
+    
+    def _file_index(self):
+        if self.files is None:
+            self.files = FileIndex(self.config_dir / "files.db",
+                                   self.config_dir / "file_names.pickle",
+                                   self.settings.get('index_skip', ['node_modules', '__pycache__']))
+        return self.files
+    
+    def _index_roots(self):
+        return self.settings.get('index_roots', [str(Path.home())])
+    
+    def _refresh_files(self, background=False):
+        """Look for new, moved and deleted files - in the background, or right here
+        with a running count"""
+        index = self._file_index()
+        workers = self.settings.get('index_workers', 8)
+        if background:
+            threading.Thread(target=index.refresh, args=(self._index_roots(), workers),
+                             daemon=True).start()
+            return None
+        
+        def progress(listed, same):
+            if self.interactive:
+                print("\r" + self.colorize(f"📂 Looked through {listed + same:,} folders..."),
+                      end='', flush=True)
+        
+        started = time.perf_counter()
+        result = index.refresh(self._index_roots(), workers, progress)
+        if self.interactive:
+            print()
+        if result is None:
+            return "⏳ Already updating the file index in the background, hang on"
+        listed, same, gone = result
+        files, _ = index.counts()
+        return (f"✓ File index up to date: {files:,} files ({listed:,} folders re-listed, "
+                f"{same:,} unchanged, {gone:,} gone) in {time.perf_counter() - started:.1f}s")
+    
+    def file_index(self, args):
+        """The list of your files that locate searches - index, index refresh,
+        index add [folder], index remove [folder]"""
+        if sqlite3 is None:
+            return "❌ The file index needs sqlite3, and this Python doesn't have it"
+        words = args.strip()
+        action, _, folder = words.partition(' ')
+        action = action.lower()
+        folder = folder.strip().strip('"')
+        
+        if action == 'refresh':
+            return self._refresh_files()
+        if action in ('add', 'remove'):
+            if not folder:
+                return f"Usage: index {action} [folder]"
+            folder = str(Path(folder).expanduser().resolve())
+            roots = [r for r in self._index_roots() if r != folder]
+            if action == 'add':
+                if not os.path.isdir(folder):
+                    return f"❌ {folder} isn't a folder"
+                roots.append(folder)
+            self.settings['index_roots'] = roots
+            self.save_json(self.settings_file, self.settings)
+            return f"✓ {'Added' if action == 'add' else 'Removed'} {folder} - " \
+                   f"'index refresh' to update the index"
+        if action:
+            return "Usage: index, index refresh, index add [folder], index remove [folder]"
+        
+        index = self._file_index()
+        files, dirs = index.counts()
+        when = index.refreshed_at()
+        when = datetime.datetime.fromtimestamp(when).strftime('%Y-%m-%d %H:%M') if when else "never"
+        lines = ["\n=== 📂 File Index ===\n",
+                 f"\n  {files:,} files in {dirs:,} folders, last updated: {when}",
+                 "\n  Folders it looks through:"]
+        lines.extend(f"\n    {root}" for root in self._index_roots())
+        if index.refreshing.locked():
+            lines.append("\n\n  ⏳ Updating right now...")
+        return "".join(lines)
+    
+    def locate(self, args):
+        """Find files on this computer by name - locate report, locate *.pdf"""
+        pattern = args.strip().strip('"')
+        if not pattern:
+            return "Usage: locate [part of a name, or a pattern like *.pdf]"
+        if sqlite3 is None:
+            return "❌ The file index needs sqlite3, and this Python doesn't have it"
+        index = self._file_index()
+        refreshed = index.refreshed_at()
+        if refreshed is None:
+            self._refresh_files(background=True)
+            return ("📂 First time! Making a list of your files in the background - "
+                    "try again in a bit (type 'index' to see how it's going)")
+        # Old list? Answer from it anyway, and freshen it up behind the scenes
+        if time.time() - refreshed > self.settings.get('index_refresh_every', 3600):
+            self._refresh_files(background=True)
+        
+        matches = index.search(pattern, self.settings.get('locate_limit', 20))
+        if not matches:
+            return f"📂 No files match '{pattern}'"
+        return self._located_lines(pattern, matches, "Open one with: open [number]")
+    
+    def _located_lines(self, pattern, matches, footer):
+        self.located = [path for path, _, _ in matches]
+        lines = [f"\n=== 📂 Files matching '{pattern}' ===\n"]
+        for number, (path, size, mtime) in enumerate(matches, 1):
+            when = datetime.datetime.fromtimestamp(mtime / 1e9).strftime('%Y-%m-%d')
+            lines.append(f"\n  [{number}] {path}  ({self._size(size)}, {when})")
+        if len(matches) >= self.settings.get('locate_limit', 20):
+            lines.append("\n\n  (just the first few - be more specific to narrow it down)")
+        lines.append(f"\n\n💡 {footer}")
+        return "".join(lines)
     
     def web_search(self, args):
         """Let me Google that for you!"""
@@ -477,79 +4326,237 @@ Want AI powers? Type 'download' to get started!
         if not args.strip():
             return "Usage: note [what you want to remember]"
         timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
-        self.notes.append({"text": args.strip(), "timestamp": timestamp})
-        self.save_json(self.notes_file, self.notes)
+        note = {"text": args.strip(), "timestamp": timestamp}
+        self.notes.append(note)
+        self.search.add_note(len(self.notes) - 1, note)
+        self._embedding_changed(('n', len(self.notes) - 1), self._note_context(note))
         return "✓ Note saved!"
     
+    def _parse_note_date(self, text):
+        """Turn 'today', 'yesterday' or 2024-01-31 (with optional HH:MM) into a timestamp"""
+        text = text.strip().lower()
+        today = datetime.date.today()
+        if text == 'today':
+            return today.strftime('%Y-%m-%d')
+        if text == 'yesterday':
+            return (today - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+        for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+            try:
+                return datetime.datetime.strptime(text, fmt).strftime(fmt)
+            except ValueError:
+                pass
+        return None
+    
+    def _note_lines(self, title, start, notes, footer=None):
+        """Lay out a bunch of notes a line at a time, numbered from start + 1"""
+        yield ""
+        yield f"=== 📝 {title} ==="
+        for i, note in enumerate(notes, start + 1):
+            ts = note.get('timestamp', 'No date') if isinstance(note, dict) else 'No date'
+            txt = note.get('text', note) if isinstance(note, dict) else str(note)
+            yield ""
+            yield f"[{i}] {ts}"
+            yield f"    {txt}"
+        if footer:
+            yield ""
+            yield footer
+    
     def list_notes(self, args):
-        """Show me all your notes"""
-        if not self.notes:
+        """Show your notes a page at a time, or just the ones from certain dates"""
+        total = len(self.notes)
+        if not total:
             return "📝 You don't have any notes yet. Add one with: note [text]"
-        result = "\n=== 📝 Your Notes ===\n"
-        for i, note in enumerate(self.notes, 1):
-            ts = note.get('timestamp', 'No date')
-            txt = note.get('text', note) if isinstance(note, dict) else str(note)
-            result += f"\n[{i}] {ts}\n    {txt}\n"
-        return result
+        
+        words = args.strip().lower().split()
+        page_size = max(1, int(self.settings.get('notes_page_size', 20)))
+        pages = (total + page_size - 1) // page_size
+        
+        if words == ['all']:
+            # Streams straight off the disk, so even years of notes start right away
+            return self._note_lines(f"All {total} Notes", 0, self.notes.range(0, total))
+        
+        if words and words[0] == 'since':
+            since = self._parse_note_date(" ".join(words[1:]))
+            if since is None:
+                return "Usage: notes since [YYYY-MM-DD]"
+            start = self.notes.bisect(since)
+            if start == total:
+                return f"📝 No notes since {since}"
+            return self._note_lines(f"Notes since {since}", start,
+                                    self.notes.range(start, total))
+        
+        if words and words[0] == 'between':
+            if len(words) != 3:
+                return "Usage: notes between [YYYY-MM-DD] [YYYY-MM-DD]"
+            first, last = self._parse_note_date(words[1]), self._parse_note_date(words[2])
+            if first is None or last is None:
+                return "Usage: notes between [YYYY-MM-DD] [YYYY-MM-DD]"
+            # '~' sorts after any time, so the whole last day counts
+            start, stop = self.notes.bisect(first), self.notes.bisect(last + '~')
+            if start >= stop:
+                return f"📝 No notes between {first} and {last}"
+            return self._note_lines(f"Notes {first} to {last}", start,
+                                    self.notes.range(start, stop))
+        
+        if words and words[0] == 'page':
+            if len(words) != 2 or not words[1].isdigit() or not 1 <= int(words[1]) <= pages:
+                return f"Usage: notes page [1-{pages}]"
+            page = int(words[1])
+        elif words:
+            return "Usage: notes, notes page [N], notes all, notes since [date], notes between [date] [date]"
+        else:
+            page = pages  # Newest notes first thing
+        
+        start = (page - 1) * page_size
+        footer = f"💡 {total} notes in all - see others with: notes page [N]" if pages > 1 else None
+        return self._note_lines(f"Your Notes (page {page} of {pages})", start,
+                                self.notes.range(start, start + page_size), footer)
+    
+    def delete_note(self, args):
+        """Delete one note by its number"""
+        number = args.strip()
+        if not number.isdigit() or not 1 <= int(number) <= len(self.notes):
+            return f"Usage: delete note [1-{len(self.notes)}]"
+        self.notes.delete(int(number) - 1)
+        self.search.reset_notes(self.notes)
+        self.embeddings_dirty = True
+        return f"✓ Deleted note {number}"
     
     def clear_notes(self, args):
         """Delete all your notes - careful with this one!"""
         if not self.notes:
             return "You don't have any notes to clear."
         count = len(self.notes)
-        print(f"⚠️  Are you sure you want to delete all {count} notes? (yes/no): ", end='')
-        if input().strip().lower() != 'yes':
+        if not self.confirm(f"⚠️  Are you sure you want to delete all {count} notes? (yes/no): "):
             return "Okay, keeping your notes safe."
-        self.notes = []
-        self.save_json(self.notes_file, self.notes)
+        self.notes.clear()
+        self.search.reset_notes(self.notes)
+        self.embeddings_dirty = True
         return f"✓ Cleared all {count} notes"
     
     def calculate(self, args):
-        """Do some math for you"""
-        if not args.strip():
+        """Do some math for you - with variables, ans, functions, and ranges too"""
+        text = args.strip()
+        if not text:
             return "Usage: calc [math problem]"
         try:
-            # Only allowing safe math characters
-            allowed = set("0123456789+-*/().% ")
-            if not all(c in allowed for c in args):
-                return "❌ I can only do basic math with numbers and +, -, *, /, (, ), ., %"
+            # calc x = 5 saves a variable
+            assign = re.match(r'^([a-zA-Z_]\w*)\s*=(?!=)\s*(.+)$', text)
+            if assign:
+                name, expression = assign.groups()
+                if name in self.calc.CONSTANTS or name in self.calc.functions or name == 'ans':
+                    return f"❌ '{name}' is already taken, pick another name"
+                value = self._calc_number(self.calc.evaluate(expression))
+                self.calc.variables[name] = value
+                return f"🔢 {name} = {value}"
             
-            # Calculate it safely
-            result = eval(args, {"__builtins__": {}}, {})
+            # calc x**2 for x in 1..1e6 (step 2) works it out for a whole range
+            ranged = re.match(r'^(.+?)\s+for\s+([a-zA-Z_]\w*)\s+in\s+(.+?)\s*\.\.\s*(.+?)'
+                              r'(?:\s+step\s+(.+))?$', text)
+            if ranged:
+                return self._calc_range(text, *ranged.groups())
             
-            # Make sure we got a number back
-            if not isinstance(result, (int, float)):
-                return "❌ That didn't give me a number..."
-                
-            return f"🔢 {args} = {result}"
+            result = self._calc_number(self.calc.evaluate(text))
+            self.calc.variables['ans'] = result
+            return f"🔢 {text} = {result}"
+        except CalcError as e:
+            return f"❌ {e}"
         except ZeroDivisionError:
             return "❌ Whoa, can't divide by zero!"
         except SyntaxError:
             return "❌ That doesn't look like valid math to me."
+        except OverflowError:
+            return "❌ That number is way too big."
         except Exception as e:
             return f"❌ Something went wrong: {str(e)}"
     
+    def _calc_number(self, value):
+        # Make sure we got a number back
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise CalcError("that didn't give me a number...")
+        return value
+    
+    def _calc_range(self, text, expression, name, start, stop, step):
+        bounds = [self._calc_number(self.calc.evaluate(b)) for b in (start, stop, step or '1')]
+        values = self.calc.evaluate_range(expression, name, *bounds)
+        count = len(values)
+        if np is not None:
+            total, low, high = float(np.sum(values)), float(np.min(values)), float(np.max(values))
+        else:
+            total, low, high = sum(values), min(values), max(values)
+        first = ", ".join(f"{v:g}" for v in values[:5])
+        more = f", ... {float(values[-1]):g}" if count > 5 else ""
+        return (f"🔢 {text}\n    {count:,} values: {first}{more}"
+                f"\n    sum {total:g}, mean {total / count:g}, min {low:g}, max {high:g}")
+    
+    def _ping_line(self, target, stats):
+        if 'avg' not in stats:
+            return f"❌ {target}: no reply ({stats['loss']:.0f}% loss)"
+        return (f"{'✅' if stats['loss'] == 0 else '⚠️ '} {target}: "
+                f"min {stats['min']:.1f} / avg {stats['avg']:.1f} / max {stats['max']:.1f} ms, "
+                f"jitter {stats['jitter']:.1f} ms, {stats['loss']:.0f}% loss")
+    
     def ping_site(self, args):
-        """Check if a website is actually reachable"""
-        target = args.strip()
-        if not target:
-            return "Usage: ping [website]"
+        """Check if websites are reachable and how fast they answer"""
+        words = args.split()
+        if not words:
+            return "Usage: ping [site] [more sites...], ping watch [sites] every [N], ping history"
+        if words[0].lower() == 'watch':
+            return self._ping_watch(words[1:])
+        if words[0].lower() == 'history':
+            return self._ping_history(words[1:])
         
-        # Make sure the hostname looks safe
-        if not all(c.isalnum() or c in '.-_' for c in target):
+        # Make sure the hostnames look safe
+        if not all(all(c.isalnum() or c in '.-_:' for c in w) for w in words):
             return "❌ That doesn't look like a valid website name."
-            
+        
+        timeout = self.settings.get('ping_timeout', 2.0)
         try:
-            param = '-n' if os.name == 'nt' else '-c'
-            result = subprocess.run(['ping', param, '4', target], 
-                                  capture_output=True, text=True, timeout=10)
-            if "0 received" in result.stdout or "unreachable" in result.stdout.lower():
-                return f"❌ Couldn't reach {target}"
-            return f"✅ {target} is online and responding!"
-        except subprocess.TimeoutExpired:
-            return f"❌ Took too long to respond"
+            results = self.pinger.measure(words, self.settings.get('ping_count', 4), timeout)
         except Exception as e:
             return f"❌ Error: {str(e)}"
+        return "\n".join(self._ping_line(t, PingEngine.summarize(r)) for t, r in results.items())
+    
+    def _ping_watch(self, words):
+        lowered = [w.lower() for w in words]
+        if lowered == ['stop']:
+            if self.pinger.stop_watch():
+                return "✓ Stopped watching"
+            return "I wasn't watching anything."
+        if not words:
+            if self.pinger.watch_thread is None:
+                return "Not watching anything. Usage: ping watch [sites] every [N]"
+            return (f"👀 Watching {', '.join(self.pinger.watch_targets)} every "
+                    f"{self.pinger.watch_every:g}s - see it with: ping history")
+        
+        every = 10.0
+        if len(lowered) >= 2 and lowered[-2] == 'every':
+            try:
+                every = float(lowered[-1])
+            except ValueError:
+                return "Usage: ping watch [sites] every [N seconds]"
+            words = words[:-2]
+        if not words or every <= 0:
+            return "Usage: ping watch [sites] every [N seconds]"
+        if not all(all(c.isalnum() or c in '.-_:' for c in w) for w in words):
+            return "❌ That doesn't look like a valid website name."
+        
+        self.pinger.start_watch(words, every, self.settings.get('ping_timeout', 2.0))
+        return f"👀 Watching {', '.join(words)} every {every:g}s - see it with: ping history"
+    
+    def _ping_history(self, words):
+        with self.pinger.lock:
+            history = {t: list(r) for t, r in self.pinger.history.items()
+                       if not words or t in words}
+        if not history:
+            return "📈 No ping history yet. Start some with: ping watch [sites] every [N]"
+        lines = ["\n=== 📈 Ping History ===\n"]
+        for target, samples in history.items():
+            stats = PingEngine.summarize([ms for _, ms in samples])
+            lines.append(f"\n{self._ping_line(target, stats)} ({len(samples)} samples)")
+            recent = " ".join('--' if ms is None else f"{ms:.0f}" for _, ms in samples[-10:])
+            lines.append(f"\n    last few (ms): {recent}")
+        return "".join(lines)
     
     def show_ip(self, args):
         """Show your IP addresses - both public and local"""
@@ -578,12 +4585,13 @@ Want AI powers? Type 'download' to get started!
         # Let's make sure you know what you're doing
         print("\n⚠️  WARNING: Custom commands run actual system commands!")
         print(f"⚠️  This will execute: {action}")
-        print("Are you sure? (yes/no): ", end='')
-        
-        if input().strip().lower() != 'yes':
+        if not self.confirm("Are you sure? (yes/no): "):
             return "Okay, cancelled that."
             
         self.custom_commands[name] = action
+        self.dispatch.add(name, name, exact=True)
+        self.completer.commands.add(name)
+        self.completer.custom.add(name)
         self.save_json(self.commands_file, self.custom_commands)
         return f"✓ Custom command '{name}' created!"
     
@@ -594,6 +4602,10 @@ Want AI powers? Type 'download' to get started!
             return "Usage: remove command [name]"
         if name in self.custom_commands:
             del self.custom_commands[name]
+            self.dispatch.remove(name, exact=True)
+            if name not in self.core_commands:
+                self.completer.commands.remove(name)
+            self.completer.custom.remove(name)
             self.save_json(self.commands_file, self.custom_commands)
             return f"✓ Removed '{name}'"
         return f"❌ Couldn't find that command"
@@ -602,19 +4614,72 @@ Want AI powers? Type 'download' to get started!
         """Show all your custom commands"""
         if not self.custom_commands:
             return "⚙️ No custom commands yet. Create one with: add command [name]: [action]"
-        result = "\n=== Your Custom Commands ===\n"
-        for name, action in sorted(self.custom_commands.items()):
-            result += f"\n  {name}: {action}"
-        return result
+        return self._command_lines()
+    
+    def _command_lines(self):
+        yield ""
+        yield "=== Your Custom Commands ==="
+        yield ""
+        for name in sorted(self.custom_commands):
+            yield f"  {name}: {self.custom_commands[name]}"
     
     def execute_custom_command(self, command_name):
-        """Run one of your custom commands"""
+        """Run one of your custom commands as a background job"""
         action = self.custom_commands[command_name]
-        try:
-            subprocess.Popen(action, shell=True)
-            return f"✓ Running your '{command_name}' command!"
-        except Exception as e:
-            return f"❌ Couldn't run that: {str(e)}"
+        job = self.jobs.submit(command_name, action)
+        if job.status == 'failed':
+            return f"❌ Couldn't run that: {job.output[-1] if job.output else 'no idea why'}"
+        if job.status == 'queued':
+            return (f"⏳ '{command_name}' is waiting its turn as job {job.id} "
+                    f"({len(self.jobs.running())} already running)")
+        return f"✓ Running your '{command_name}' command! (job {job.id} - see it with: job {job.id})"
+    
+    def list_jobs(self, args):
+        """Show what's running, waiting and recently finished"""
+        with self.jobs.lock:
+            jobs = list(self.jobs.jobs.values())
+        if not jobs:
+            return "⚙️ No jobs yet. Run a custom command to start one."
+        icons = {'queued': '⏳', 'running': '▶️ ', 'done': '✅', 'failed': '❌',
+                 'killed': '🛑', 'cancelled': '🚫'}
+        lines = [f"\n=== ⚙️ Jobs (max {self.jobs.max_running} at once) ===\n"]
+        for job in jobs:
+            cpu = f", cpu {job.cpu_seconds:.2f}s" if job.cpu_seconds is not None else ""
+            code = f", exit {job.returncode}" if job.returncode is not None else ""
+            lines.append(f"\n  {icons.get(job.status, '?')} [{job.id}] {job.name} - "
+                         f"{job.status}, {job.runtime():.1f}s{cpu}{code}")
+        return "".join(lines)
+    
+    def show_job(self, args):
+        """Show one job's details and the last things it printed"""
+        job_id = args.strip()
+        job = self.jobs.jobs.get(int(job_id)) if job_id.isdigit() else None
+        if job is None:
+            return "Usage: job [id] - type 'jobs' to see them"
+        lines = [f"\n=== ⚙️ Job {job.id}: {job.name} ===\n",
+                 f"\n  Command: {job.command}",
+                 f"\n  Status: {job.status}" +
+                 (f" (exit code {job.returncode})" if job.returncode is not None else ""),
+                 f"\n  Ran for: {job.runtime():.1f}s"]
+        if job.cpu_seconds is not None:
+            lines.append(f"\n  CPU time: {job.cpu_seconds:.2f}s")
+        output = list(job.output)
+        if output:
+            hidden = job.output_count - len(output)
+            lines.append(f"\n\n  Output{f' (last {len(output)} lines)' if hidden > 0 else ''}:")
+            lines.extend(f"\n    {line}" for line in output)
+        else:
+            lines.append("\n\n  (no output yet)")
+        return "".join(lines)
+    
+    def kill_job(self, args):
+        """Stop a running job, or take a waiting one out of line"""
+        job_id = args.strip()
+        if not job_id.isdigit():
+            return "Usage: kill [job id]"
+        if self.jobs.kill(int(job_id)):
+            return f"✓ Stopped job {job_id}"
+        return f"❌ Job {job_id} isn't running or waiting"
     
     def exit_phantom(self, args):
         """Time to say goodbye!"""
@@ -628,33 +4693,259 @@ Want AI powers? Type 'download' to get started!
         if not user_input:
             return None
         
-        # Check if it's one of your custom commands first
-        if user_input.lower() in self.custom_commands:
-            return self.execute_custom_command(user_input.lower())
+        # One walk down the command tree finds both kinds of command
+        custom, length, func = self.dispatch.match(user_input.lower())
         
-        # Now check my built-in commands (longest match wins!)
-        sorted_commands = sorted(self.core_commands.items(), 
-                                key=lambda x: len(x[0]), reverse=True)
-        for cmd, func in sorted_commands:
-            if user_input.lower().startswith(cmd):
-                args = user_input[len(cmd):].strip()
-                try:
-                    return func(args)
-                except Exception as e:
-                    return f"❌ Oops, something broke: {str(e)}"
+        if not self.instruments.enabled:
+            return self._run_command(user_input, custom, length, func)
+        if custom is not None:
+            name = f"custom:{custom}"
+        else:
+            name = func.__name__ if func is not None else "unknown"
+        return self.instruments.measure(name, self._run_command, user_input, custom, length, func)
+    
+    def _run_command(self, user_input, custom, length, func):
+        """Actually run whatever process_input found"""
+        # Your custom commands win if the whole line matches one
+        if custom is not None:
+            return self.execute_custom_command(custom)
+        
+        # Otherwise the longest built-in command that fits wins
+        if func is not None:
+            args = user_input[length:].strip()
+            try:
+                result = func(args)
+            except Exception as e:
+                return f"❌ Oops, something broke: {str(e)}"
+            if isinstance(result, types.GeneratorType):
+                # Its body only runs as the lines get printed, after we've returned
+                return self._guarded_lines(result)
+            return result
         
         return f"❓ I don't know how to '{user_input}'. Type 'help' to see what I can do!"
     
+    def show_stats(self, args):
+        """See how long each command takes - stats on/off/reset/export"""
+        args = args.strip().lower()
+        if args in ('on', 'off'):
+            self.instruments.enabled = args == 'on'
+            self.settings['instrumentation'] = self.instruments.enabled
+            self.save_json(self.settings_file, self.settings)
+            return f"✓ Command timing is now {args.upper()}"
+        if args == 'reset':
+            self.instruments.reset()
+            return "✓ Stats cleared"
+        if args == 'export':
+            return self.export_metrics()
+        if args:
+            return "Usage: stats, stats on/off, stats reset, stats export"
+        
+        with self.instruments.lock:
+            commands = {name: dict(stats) for name, stats in self.instruments.commands.items()}
+        if not commands:
+            state = "on" if self.instruments.enabled else "off - turn it on with: stats on"
+            return f"📊 No stats yet (timing is {state})"
+        lines = ["\n=== 📊 Command Stats ===\n",
+                 f"\n  {'command':<24}{'runs':>7}{'avg ms':>10}{'p50 ≤':>10}{'p95 ≤':>10}"
+                 f"{'cpu ms':>10}{'disk KB':>10}"]
+        for name, stats in sorted(commands.items(), key=lambda item: -item[1]['wall']):
+            count = stats['count']
+            p50 = self.instruments.percentile(stats, 0.5) * 1000
+            p95 = self.instruments.percentile(stats, 0.95) * 1000
+            lines.append(f"\n  {name[:23]:<24}{count:>7}{stats['wall'] / count * 1000:>10.2f}"
+                         f"{p50:>10g}{p95:>10g}{stats['cpu'] / count * 1000:>10.2f}"
+                         f"{stats['written'] / 1024:>10.1f}")
+        return "".join(lines)
+    
+    def show_ai_stats(self, args):
+        """How fast each model answers - aistats, aistats [model], aistats clear"""
+        args = args.strip()
+        if args.lower() == 'clear':
+            self.answer_log.clear()
+            return "✓ AI stats cleared"
+        
+        models = self.answer_log.by_model()
+        if not models:
+            return "⏱️  No AI answers timed yet - try: ask [your question]"
+        pct = AnswerLog.percentile
+        
+        def show(value, fmt, unit=''):
+            return format(value, fmt) + unit if value is not None else '-'
+        
+        if args:
+            stats = models.get(args)
+            if stats is None:
+                return f"❌ No answers from '{args}' yet. Timed so far: {', '.join(sorted(models))}"
+            lines = [f"\n=== ⏱️  {args} ({stats['answers']} answers, {stats['failed']} failed, "
+                     f"{stats['stopped']} stopped) ===\n",
+                     f"\n  {'':<22}{'p50':>10}{'p90':>10}{'p99':>10}{'worst':>10}"]
+            rows = (('first word (s)', 'ttft', '.2f', False), ('whole answer (s)', 'total', '.2f', False),
+                    ('loading model (s)', 'load', '.2f', False),
+                    ('answer tokens/s', 'tok/s', '.1f', True),
+                    ('prompt tokens/s', 'prompt tok/s', '.0f', True),
+                    ('prompt tokens', 'prompt tokens', '.0f', False),
+                    ('answer tokens', 'answer tokens', '.0f', False))
+            for label, name, fmt, slow_is_low in rows:
+                values = stats.get(name, [])
+                # For speeds the bad end is the low one, so flip the percentiles round
+                qs = (0.5, 0.1, 0.01, 0.0) if slow_is_low else (0.5, 0.9, 0.99, 1.0)
+                cells = ''.join(f"{show(pct(values, q), fmt):>10}" for q in qs)
+                lines.append(f"\n  {label:<22}{cells}")
+            lines.append("\n\n💡 For speeds, p90/p99/worst are the slow end")
+            return "".join(lines)
+        
+        lines = ["\n=== ⏱️  AI Stats ===\n",
+                 f"\n  {'model':<22}{'answers':>8}{'failed':>7}{'1st word':>10}{'p95':>7}"
+                 f"{'tok/s':>8}{'prompt':>8}{'load p95':>10}"]
+        for model, stats in sorted(models.items(), key=lambda item: -item[1]['answers']):
+            ttft = stats.get('ttft', [])
+            lines.append(
+                f"\n  {model[:21]:<22}{stats['answers']:>8}{stats['failed']:>7}"
+                f"{show(pct(ttft, 0.5), '.2f', 's'):>10}{show(pct(ttft, 0.95), '.2f', 's'):>7}"
+                f"{show(pct(stats.get('tok/s', []), 0.5), '.1f'):>8}"
+                f"{show(pct(stats.get('prompt tok/s', []), 0.5), '.0f'):>8}"
+                f"{show(pct(stats.get('load', []), 0.95), '.2f', 's'):>10}"
+            )
+        lines.append(f"\n\n  (medians unless it says p95 - tok/s is answer tokens, prompt is "
+                     f"prompt tokens/s, from the last {self.answer_log.keep} answers)"
+                     f"\n\n💡 aistats [model] for the full picture, aistats clear to start over")
+        return "".join(lines)
+    
+    def export_metrics(self):
+        """Write the stats out for Prometheus (or anything that reads its format)"""
+        try:
+            temp = self.metrics_file.with_suffix('.tmp')
+            temp.write_text(self.instruments.prometheus(), encoding='utf-8')
+            os.replace(temp, self.metrics_file)
+        except OSError as e:
+            return f"❌ Couldn't write {self.metrics_file}: {e}"
+        return f"✓ Stats written to {self.metrics_file}"
+    
+    def _export_metrics_on_exit(self):
+        if self.instruments.enabled and self.instruments.commands:
+            self.export_metrics()
+    
+    def run_batch(self, lines, workers=4):
+        """Run a bunch of commands without the chit-chat, yielding one result per line
+        in the same order. Read-only commands next to each other run side by side."""
+        self.interactive = False
+        ansi = re.compile(r'\x1b\[[0-9;]*m')
+        
+        def run_one(item):
+            number, line = item
+            started = time.perf_counter()
+            output = self.as_text(self.process_input(line))
+            result = {
+                'line': number,
+                'input': line,
+                'output': ansi.sub('', output) if output is not None else None,
+                'ok': output is None or not output.startswith(('❌', '❓')),
+                'seconds': round(time.perf_counter() - started, 6),
+            }
+            return result
+        
+        def is_parallel_safe(line):
+            custom, _, func = self.dispatch.match(line.lower())
+            return custom is None and func in self.parallel_safe
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            group = []
+            for number, line in enumerate(lines, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if is_parallel_safe(line):
+                    group.append((number, line))
+                    if len(group) < workers * 4:
+                        continue
+                    # Don't let one huge group pile up in memory
+                    yield from pool.map(run_one, group)
+                    group = []
+                    continue
+                # Anything that changes stuff waits for everything before it
+                yield from pool.map(run_one, group)
+                group = []
+                result = run_one((number, line))
+                yield result
+                if result['output'] is None:
+                    return  # They said exit
+            yield from pool.map(run_one, group)
+    
+    def respond(self, user_input):
+        """Do one line and show what came back. Returns False when it's time to go"""
+        response = self.process_input(user_input)
+        
+        # If they want to exit, we're done
+        if response is None:
+            return False
+        
+        # If there's no response, there's nothing to show
+        if response == "":
+            return True
+        
+        # Streamed answers were already shown as they came in
+        if isinstance(response, StreamedAnswer):
+            print()
+            return True
+        
+        # Show them the result
+        self.show(response)
+        print()
+        return True
+    
+    def _setup_readline(self):
+        """Tab completion and up-arrow history that's still there next time"""
+        if readline is None:
+            return
+        self.history_file = self.config_dir / "history"
+        readline.set_history_length(self.settings.get('history_size', 1000))
+        with contextlib.suppress(OSError):
+            readline.read_history_file(str(self.history_file))
+        self.history_start = readline.get_current_history_length()
+        atexit.register(self._save_history)
+        
+        # Load the topics now, so the first Tab is as quick as the rest
+        threading.Thread(target=self.completer.topics.starting_with, args=('',),
+                         daemon=True).start()
+        readline.set_completer(self.completer.complete)
+        readline.set_completer_delims('')  # Topics have spaces, so complete the whole line
+        if 'libedit' in (readline.__doc__ or ''):
+            readline.parse_and_bind("bind ^I rl_complete")  # Mac's readline is different
+        else:
+            readline.parse_and_bind("tab: complete")
+    
+    def _save_history(self):
+        """Add this session's lines to the history file (which keeps it to history_size)"""
+        try:
+            new = readline.get_current_history_length() - self.history_start
+            if hasattr(readline, 'append_history_file'):
+                if not self.history_file.exists():
+                    self.history_file.touch()
+                readline.append_history_file(max(0, new), str(self.history_file))
+            else:
+                readline.write_history_file(str(self.history_file))
+        except OSError:
+            pass
+    
     def run(self):
         """This is where the magic happens - the main loop!"""
+        self._setup_readline()
+        
+        # Start loading the AI model while the banner prints
+        self.warm_up_when_ready = True
+        if self._ollama_ready and self.ollama is not None:
+            self.ollama.warm_up(self._pick_model(''))
+        
         # Show our cool banner when starting up
         print(self.colorize(self.ASCII_ART))
         print(self.colorize("=" * 60))
         print(self.colorize(f"        {self.PROGRAM_NAME} - {self.PROGRAM_TAGLINE}"))
         print(self.colorize("=" * 60))
         
-        # Let them know if AI is ready or not
-        if self.ollama_ready:
+        # Let them know if AI is ready or not (without waiting on the check)
+        if self._ollama_ready is None:
+            print(self.colorize("🤖 Checking on the AI in the background..."))
+        elif self._ollama_ready:
             print(self.colorize("🤖 AI is ready! Try: ask [your question]"))
         else:
             print(self.colorize("💡 Want AI powers? Type 'download' to get started!"))
@@ -664,29 +4955,24 @@ Want AI powers? Type 'download' to get started!
         # Keep going until they want to quit
         while True:
             try:
+                # Anything finish in the background since the last prompt?
+                self._print_notices()
+                
                 # Show the prompt and wait for input
                 prompt = self.colorize(f"{self.PROGRAM_NAME}> ")
+                if readline is not None:
+                    # Tell readline the color codes take up no room, or the cursor drifts
+                    prompt = re.sub(r'(\x1b\[[0-9;]*m)', '\x01\\1\x02', prompt)
                 user_input = input(prompt).strip()
                 
                 # If they just hit enter, skip it
                 if not user_input:
                     continue
                 
-                # Figure out what they want and do it
-                response = self.process_input(user_input)
-                
-                # If they want to exit, break the loop
-                if response is None:
+                # Figure out what they want and do it - and stop if they want to exit
+                if not self.respond(user_input):
                     break
                 
-                # If there's no response, just skip to next iteration
-                if response == "":
-                    continue
-                
-                # Show them the result
-                print(self.colorize(response))
-                print()
-                
             except KeyboardInterrupt:
                 # They pressed Ctrl+C, but don't quit - just let them know
                 print(self.colorize("\n\n👋 Press Ctrl+C again or type 'exit' to quit\n"))
@@ -700,15 +4986,225 @@ Want AI powers? Type 'download' to get started!
                 print(self.colorize(f"❌ Uh oh, something went wrong: {str(e)}\n"))
 
 
-if __name__ == "__main__":
-    try:
+class ThreadStreams:
+    """Stands in for sys.stdout or sys.stdin. A daemon client's thread gets pointed at
+    its own connection, every other thread still gets the real thing."""
+    
+    def __init__(self, real):
+        self.real = real
+        self.local = threading.local()
+    
+    def use(self, target):
+        self.local.target = target
+    
+    def __getattr__(self, name):
+        return getattr(getattr(self.local, 'target', None) or self.real, name)
+
+
+class DaemonClient:
+    """One connected window - whatever Phantom prints goes down the socket as it
+    happens, and input() asks the window for a line"""
+    
+    def __init__(self, sock, reader, tty):
+        self.sock = sock
+        self.reader = reader
+        self.tty = tty
+        self.encoding = 'utf-8'
+    
+    def send(self, **message):
+        self.sock.sendall((json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8'))
+    
+    def write(self, text):
+        if text:
+            self.send(out=text)
+        return len(text)
+    
+    def flush(self):
+        pass
+    
+    def isatty(self):
+        return self.tty
+    
+    def readline(self):
+        self.send(input=True)
+        line = self.reader.readline()
+        if not line:
+            raise EOFError
+        return json.loads(line).get('answer', '') + "\n"
+
+
+class PhantomDaemon:
+    """Keeps one Phantom warm - stores loaded, AI connection open - for any number of
+    phantom_client.py windows to share over a loopback socket. Only someone who can
+    read ~/.phantom/daemon.json (and so the token in it) gets to talk to it."""
+    
+    def __init__(self, port=0):
+        # Has to happen before Phantom() so its renderer writes through these too
+        self.stdout = ThreadStreams(sys.stdout)
+        self.stdin = ThreadStreams(sys.stdin)
+        sys.stdout, sys.stdin = self.stdout, self.stdin
+        
+        self.phantom = Phantom()
+        # Colors are up to each window - the client strips them if it isn't a terminal
+        self.phantom.use_color = 'NO_COLOR' not in os.environ
+        self.info_file = self.phantom.config_dir / "daemon.json"
+        self.token = secrets.token_hex(16)
+        self.lock = threading.Lock()  # Commands that change things take turns
+        
+        daemon = self
+        
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon.serve_client(self.connection, self.rfile)
+        
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+    
+    def serve(self):
+        port = self.server.server_address[1]
+        fd = os.open(self.info_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'port': port, 'token': self.token, 'pid': os.getpid()}, f)
+        
+        self.phantom.warm_up_when_ready = True
+        if self.phantom._ollama_ready and self.phantom.ollama is not None:
+            self.phantom.ollama.warm_up(self.phantom._pick_model(''))
+        print(f"👻 {Phantom.PROGRAM_NAME} is running in the background on port {port} "
+              f"(pid {os.getpid()})", flush=True)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            with contextlib.suppress(OSError):
+                if json.loads(self.info_file.read_text(encoding='utf-8')).get('pid') == os.getpid():
+                    self.info_file.unlink()
+    
+    def serve_client(self, sock, reader):
+        """Talk to one window until it goes away"""
+        try:
+            hello = json.loads(reader.readline() or b'{}')
+            if not hmac.compare_digest(str(hello.get('token', '')), self.token):
+                return
+            client = DaemonClient(sock, reader, bool(hello.get('tty')))
+            self.stdout.use(client)
+            self.stdin.use(client)
+            # Background answers this window asks for get announced here, not elsewhere
+            self.phantom.local.notices = deque()
+            client.send(prompt=self.phantom.colorize(f"{Phantom.PROGRAM_NAME}> "))
+            for raw in reader:
+                message = json.loads(raw)
+                if message.get('stop'):
+                    client.send(done=True, exit=True)
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    return
+                keep_going = self.run_line(message.get('line', '').strip())
+                client.send(done=True, exit=not keep_going)
+                if not keep_going:
+                    return
+        except (OSError, ValueError, EOFError):
+            pass  # Window closed (or Ctrl+C'd) mid-command
+        finally:
+            self.stdout.use(None)
+            self.stdin.use(None)
+            self.phantom.local.notices = None
+    
+    def run_line(self, line):
+        """Same as one turn of the main loop. Read-only commands run side by side,
+        anything that changes stuff waits for the others"""
+        if not line:
+            return True
+        custom, _, func = self.phantom.dispatch.match(line.lower())
+        shared = custom is None and func in self.phantom.parallel_safe
+        with contextlib.nullcontext() if shared else self.lock:
+            try:
+                keep_going = self.phantom.respond(line)
+            except (OSError, EOFError):
+                raise
+            except Exception as e:
+                print(self.phantom.colorize(f"❌ Uh oh, something went wrong: {str(e)}\n"))
+                keep_going = True
+        self.phantom._print_notices()
+        return keep_going
+
+
+def main(argv=None):
+    """Start Phantom - chatty mode by default, or batch mode for scripts and cron"""
+    parser = argparse.ArgumentParser(description=f"{Phantom.PROGRAM_NAME} - your desktop assistant")
+    parser.add_argument('-c', '--command', action='append', default=[],
+                        help="run this command and print the result as JSON (repeatable)")
+    parser.add_argument('--script', help="run every line of this file as a command")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="how many read-only commands can run at once (default 4)")
+    parser.add_argument('--yes', action='store_true',
+                        help="answer yes to any are-you-sure questions in batch mode")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the whole session and save it to ~/.phantom")
+    parser.add_argument('--daemon', action='store_true',
+                        help="stay running in the background for phantom_client.py to use")
+    parser.add_argument('--port', type=int, default=0,
+                        help="port for --daemon to listen on (default: any free one)")
+    args = parser.parse_args(argv)
+    
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(_start, args)
+        finally:
+            dump = Path.home() / ".phantom" / time.strftime("profile-%Y%m%d-%H%M%S.prof")
+            dump.parent.mkdir(exist_ok=True)
+            profiler.dump_stats(str(dump))
+            print(f"📊 Profile saved to {dump} (open it with: python -m pstats {dump})",
+                  file=sys.stderr)
+    return _start(args)
+
+
+def _start(args):
+    """Chatty mode, batch mode or daemon mode, depending on what we were given"""
+    if args.daemon:
+        try:
+            PhantomDaemon(args.port).serve()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    
+    lines = []
+    for command in args.command:
+        lines.extend(command.splitlines())
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as f:
+            lines.extend(f.read().splitlines())
+    batch = bool(lines) or not sys.stdin.isatty()
+    if batch and not lines:
+        lines = sys.stdin  # Commands piped in, read them as they come
+    
+    if not batch:
+        try:
+            phantom = Phantom()
+            phantom.run()
+        except KeyboardInterrupt:
+            print("\n👋 Goodbye!")
+        except Exception as e:
+            print(f"\n❌ Something went really wrong: {str(e)}")
+            import traceback
+            traceback.print_exc()
+        
+        input("\nPress Enter to close...")
+        return 0
+    
+    # JSON goes to stdout, anything the commands print along the way goes to stderr
+    out = sys.stdout
+    failed = False
+    with contextlib.redirect_stdout(sys.stderr):
         phantom = Phantom()
-        phantom.run()
-    except KeyboardInterrupt:
-        print("\n👋 Goodbye!")
-    except Exception as e:
-        print(f"\n❌ Something went really wrong: {str(e)}")
-        import traceback
-        traceback.print_exc()
-    
-    input("\nPress Enter to close...")
+        phantom.assume_yes = args.yes
+        for result in phantom.run_batch(lines, args.workers):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            failed = failed or not result['ok']
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,690 @@
+"""Speed checks for Phantom's hot paths - run with: python phantom_bench.py
+
+Everything runs in a throwaway home folder, and the AI benchmarks talk to a fake
+Ollama server started right here, so your real ~/.phantom and models aren't touched.
+
+    python phantom_bench.py --out today.json            save the numbers
+    python phantom_bench.py --baseline today.json       compare against a saved run
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Keep the benchmark away from your real ~/.phantom folder
+_home = tempfile.mkdtemp(prefix="phantom-bench-")
+os.environ['HOME'] = _home
+os.environ['USERPROFILE'] = _home
+
+import PHANTOM
+from PHANTOM import Phantom
+
+
+# ============================================
+# A pretend Ollama, so we can time the AI bits without a real model
+# ============================================
+
+class FakeOllama:
+    """A tiny local server that answers like Ollama does, with made-up delays"""
+
+    def __init__(self, tokens=50, first_token_delay=0.05, token_delay=0.002, embed_dim=64):
+        self.tokens = tokens
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.embed_dim = embed_dim
+        self.embedded = []  # Every text anyone asked us to embed, in order
+        self.prompts = []   # Every prompt (or last chat message) we were asked to answer
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    pass  # A pooled connection closed while we waited for its next request
+
+            def _send_json(self, data):
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_chunk(self, data):
+                line = (json.dumps(data) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def _stats(self):
+                return {
+                    'done': True, 'total_duration': 1000000, 'load_duration': 1000,
+                    'prompt_eval_count': 10, 'prompt_eval_duration': 100000,
+                    'eval_count': fake.tokens, 'eval_duration': 900000,
+                }
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    return self._send_json({'models': [
+                        {'name': 'llama3.2:latest', 'size': 2019393189},
+                        {'name': 'nomic-embed-text:latest', 'size': 274302450},
+                    ]})
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+
+                if self.path == '/api/embed':
+                    texts = request.get('input', [])
+                    texts = [texts] if isinstance(texts, str) else texts
+                    fake.embedded.extend(texts)
+                    vectors = [[(hash((t, i)) % 1000) / 1000 for i in range(fake.embed_dim)]
+                               for t in texts]
+                    return self._send_json({'embeddings': vectors})
+
+                if self.path not in ('/api/generate', '/api/chat'):
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                chat = self.path == '/api/chat'
+                if chat:
+                    fake.prompts.append((request.get('messages') or [{}])[-1].get('content', ''))
+                else:
+                    fake.prompts.append(request.get('prompt', ''))
+                words = [f"word{i} " for i in range(fake.tokens)]
+
+                def piece(text, done=False):
+                    if chat:
+                        return {'message': {'role': 'assistant', 'content': text}, 'done': done}
+                    return {'response': text, 'done': done}
+
+                time.sleep(fake.first_token_delay)
+                if not request.get('stream', True):
+                    time.sleep(fake.token_delay * fake.tokens)
+                    return self._send_json({**piece("".join(words), True), **self._stats()})
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for i, word in enumerate(words):
+                        if i:
+                            time.sleep(fake.token_delay)
+                        self._send_chunk(piece(word))
+                    self._send_chunk({**piece(""), **self._stats()})
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Phantom hung up on us, like a cancelled question does
+
+        return Handler
+
+
+# ============================================
+# Helpers
+# ============================================
+
+@contextlib.contextmanager
+def fresh_home(settings=None):
+    """A brand new, empty ~/.phantom for one benchmark"""
+    home = tempfile.mkdtemp(prefix="phantom-bench-", dir=_home)
+    os.environ['HOME'] = home
+    os.environ['USERPROFILE'] = home
+    if settings:
+        config = os.path.join(home, '.phantom')
+        os.makedirs(config, exist_ok=True)
+        with open(os.path.join(config, 'settings.json'), 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+    yield home
+
+
+def best_of(func, number, repeat=5):
+    """Fastest average time per call in seconds, out of a few tries"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def quiet():
+    """Swallow anything Phantom prints while we're timing it"""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+class Results:
+    """Collects numbers as name -> value, with the unit and which way is better"""
+
+    def __init__(self):
+        self.values = {}
+
+    def add(self, name, value, unit, lower_is_better=True):
+        self.values[name] = {'value': value, 'unit': unit, 'lower_is_better': lower_is_better}
+        shown = f"{value:,.3f}" if isinstance(value, float) else f"{value:,}"
+        print(f"  {name:<48} {shown:>14} {unit}", file=sys.stderr)
+
+
+def old_dispatch(phantom, user_input):
+    """How process_input used to find a command, kept here to compare against"""
+    if user_input.lower() in phantom.custom_commands:
+        return user_input.lower()
+    sorted_commands = sorted(phantom.core_commands.items(),
+                             key=lambda x: len(x[0]), reverse=True)
+    for cmd, func in sorted_commands:
+        if user_input.lower().startswith(cmd):
+            return func
+    return None
+
+
+# ============================================
+# The benchmarks
+# ============================================
+
+def bench_startup(results, sizes):
+    """Time from nothing to a ready Phantom, empty and with big stores"""
+    for size in (0, sizes[-1]):
+        with fresh_home():
+            phantom = Phantom()
+            fill_knowledge(phantom, size)
+            fill_notes(phantom, size)
+            phantom.save_search_index()
+            timings = []
+            for _ in range(5):
+                started = time.perf_counter()
+                Phantom()
+                timings.append(time.perf_counter() - started)
+            results.add(f"startup.init.{size}_entries", statistics.median(timings) * 1000, "ms")
+
+
+def bench_dispatch(results, sizes):
+    """How many lines a second process_input can get through"""
+    lines = ["time", "what do you know about python", "calc 1+1",
+             "custom-command-42x", "nope not a command"]
+    with fresh_home():
+        phantom = Phantom()
+        phantom.knowledge['python'] = "a snake, or a language"
+        for count in (0,) + tuple(sizes):
+            phantom.custom_commands = {f"custom-command-{i}": "echo hi" for i in range(count)}
+            phantom.init_commands()
+            per_line = best_of(lambda: [phantom.process_input(l) for l in lines], 200) / len(lines)
+            results.add(f"dispatch.process_input.{count}_custom", 1 / per_line, "lines/s",
+                        lower_is_better=False)
+            lookup = best_of(lambda: [phantom.dispatch.match(l) for l in lines], 2000) / len(lines)
+            old = best_of(lambda: [old_dispatch(phantom, l) for l in lines], 2000) / len(lines)
+            results.add(f"dispatch.trie_lookup.{count}_custom", lookup * 1e6, "us")
+            results.add(f"dispatch.old_sorted_lookup.{count}_custom", old * 1e6, "us")
+
+    # Tab completion has to keep up with typing, even with loads of topics
+    size = sizes[-1]
+    with fresh_home():
+        phantom = Phantom()
+        fill_knowledge(phantom, size)
+        completer = phantom.completer
+        completer.candidates("forget ")  # The first Tab loads the list
+        complete = best_of(lambda: completer.candidates("what do you know about topic 12"), 1000, 3)
+        results.add(f"dispatch.complete_topic.{size}_topics", complete * 1e6, "us")
+        command = best_of(lambda: completer.candidates("ch"), 1000, 3)
+        results.add("dispatch.complete_command", command * 1e6, "us")
+
+
+def fill_knowledge(phantom, count):
+    phantom.knowledge.update_many(
+        (f"topic {i}", f"some info about topic number {i}") for i in range(count))
+
+
+def fill_notes(phantom, count):
+    for i in range(count):
+        phantom.notes.append({'text': f"note number {i}", 'timestamp': '2025-01-01 12:00'})
+
+
+def bench_persistence(results, sizes):
+    """What one teach / note costs as the stores get bigger"""
+    for size in sizes:
+        with fresh_home():
+            phantom = Phantom()
+            fill_knowledge(phantom, size)
+            fill_notes(phantom, size)
+            counter = iter(range(10 ** 9))
+            teach = best_of(lambda: phantom.teach(f"new topic {next(counter)}: fresh info"), 100, 3)
+            note = best_of(lambda: phantom.add_note("another note"), 100, 3)
+            results.add(f"persistence.teach.{size}_entries", teach * 1000, "ms")
+            results.add(f"persistence.add_note.{size}_entries", note * 1000, "ms")
+
+    # Bulk import of a wiki-sized folder of Markdown
+    size = sizes[-1]
+    with fresh_home() as home:
+        wiki = os.path.join(home, 'wiki')
+        os.makedirs(wiki)
+        for page in range(20):
+            with open(os.path.join(wiki, f"page{page}.md"), 'w', encoding='utf-8') as f:
+                for i in range(page, size, 20):
+                    f.write(f"## topic {i}\n\nsome info about topic number {i}\n\n")
+        phantom = Phantom()
+        phantom.interactive = False
+        started = time.perf_counter()
+        phantom.import_knowledge(wiki)
+        elapsed = time.perf_counter() - started
+        results.add(f"persistence.import_markdown.{size}_topics", size / elapsed, "topics/s",
+                    lower_is_better=False)
+
+    # Settings changes get saved in the background, so a burst costs one write
+    with fresh_home():
+        phantom = Phantom()
+        colors = iter(['red', 'blue'] * 10 ** 6)
+        setcolor = best_of(lambda: phantom.change_color(next(colors)), 100, 3)
+        results.add("persistence.setcolor", setcolor * 1e6, "us")
+        started = time.perf_counter()
+        for _ in range(100):
+            phantom.change_color(next(colors))
+        phantom.storage.flush()
+        results.add("persistence.setcolor_burst_100_flushed", (time.perf_counter() - started) * 1000, "ms")
+
+
+def bench_rendering(results, sizes):
+    """Building the output for the list commands with lots of stuff in them"""
+    size = sizes[-1]
+    with fresh_home(), open(os.devnull, 'w', encoding='utf-8') as devnull:
+        phantom = Phantom()
+        fill_notes(phantom, size)
+        phantom.custom_commands = {f"command-{i}": f"echo {i}" for i in range(size)}
+        # Render all the way out (no pager), just into nowhere
+        phantom.interactive = False
+        phantom.renderer = PHANTOM.OutputRenderer(devnull)
+        page = best_of(lambda: phantom.show(phantom.list_notes("")), 20, 3)
+        results.add(f"render.list_notes.page.{size}_notes", page * 1000, "ms")
+        every = best_of(lambda: phantom.show(phantom.list_notes("all")), 1, 3)
+        results.add(f"render.list_notes.all.{size}_notes", every * 1000, "ms")
+        since = best_of(lambda: phantom.show(phantom.list_notes("since 2025-01-01")), 1, 3)
+        results.add(f"render.list_notes.since_all.{size}_notes", since * 1000, "ms")
+        commands = best_of(lambda: phantom.show(phantom.list_commands("")), 1, 3)
+        results.add(f"render.list_commands.{size}_commands", commands * 1000, "ms")
+
+
+def bench_locate(results, sizes):
+    """Crawling a folder tree, re-checking it, and finding files by name"""
+    with fresh_home() as home:
+        tree = os.path.join(home, 'tree')
+        for i in range(sizes[0]):
+            folder = os.path.join(tree, f"folder{i // 100}", f"sub{i // 10}")
+            os.makedirs(folder, exist_ok=True)
+            open(os.path.join(folder, f"file{i}.txt"), 'w').close()
+        phantom = Phantom()
+        phantom.interactive = False
+        phantom.settings['index_roots'] = [tree]
+        started = time.perf_counter()
+        phantom.file_index("refresh")
+        results.add(f"locate.first_crawl.{sizes[0]}_files", (time.perf_counter() - started) * 1000, "ms")
+        again = best_of(lambda: phantom.file_index("refresh"), 1, 3)
+        results.add(f"locate.refresh_unchanged.{sizes[0]}_files", again * 1000, "ms")
+
+        # Lots more names than we'd want to make real files for
+        count = sizes[-1] * 10
+        index = phantom.files
+        index.db.execute("BEGIN")
+        index.db.executemany("INSERT INTO files (dir, name, size, mtime) VALUES (1, ?, 0, 0)",
+                             ((f"document {i} draft.pdf",) for i in range(count)))
+        index.db.execute("COMMIT")
+        index._build_names()
+        found = best_of(lambda: index.search("document 4242"), 20, 3)
+        results.add(f"locate.substring.{count}_files", found * 1000, "ms")
+        missing = best_of(lambda: index.search("no such file"), 20, 3)
+        results.add(f"locate.no_match.{count}_files", missing * 1000, "ms")
+        glob = best_of(lambda: index.search("*4242*.pdf"), 20, 3)
+        results.add(f"locate.glob.{count}_files", glob * 1000, "ms")
+
+
+class LocalHosts:
+    """Listeners on this machine that act like live, refusing and dead hosts for ping"""
+
+    def __init__(self, count):
+        self.count = count
+        self.sockets = []
+
+    def _listener(self, family=socket.AF_INET, host='127.0.0.1', backlog=128):
+        sock = socket.socket(family)
+        sock.bind((host, 0))
+        sock.listen(backlog)
+        self.sockets.append(sock)
+        return sock.getsockname()[1]
+
+    def live(self):
+        # The kernel finishes the handshake for us, nobody has to accept()
+        return [f"127.0.0.1:{self._listener()}" for _ in range(self.count)]
+
+    def refusing(self):
+        ports = [self._listener() for _ in range(self.count)]
+        for sock in self.sockets[-self.count:]:
+            sock.close()
+        return [f"127.0.0.1:{port}" for port in ports]
+
+    def dead(self):
+        # A full backlog makes the kernel drop new SYNs, just like a host that's gone
+        targets = []
+        for _ in range(self.count):
+            port = self._listener(backlog=0)
+            for _ in range(3):
+                filler = socket.socket()
+                filler.setblocking(False)
+                with contextlib.suppress(BlockingIOError):
+                    filler.connect(('127.0.0.1', port))
+                self.sockets.append(filler)
+            targets.append(f"127.0.0.1:{port}")
+        return targets
+
+    def ipv6(self):
+        try:
+            return [f"[::1]:{self._listener(socket.AF_INET6, '::1')}"]
+        except OSError:
+            return []  # No IPv6 here
+
+    def close(self):
+        for sock in self.sockets:
+            sock.close()
+
+
+def bench_ping(results, sizes):
+    """Probing lots of hosts at once - the live, refusing and dead ones all at the same time"""
+    hosts = LocalHosts(50)
+    try:
+        # Refusing last, so none of the ports it frees up get picked by another listener
+        live, dead, ipv6, refusing = hosts.live(), hosts.dead(), hosts.ipv6(), hosts.refusing()
+        engine = PHANTOM.PingEngine()
+        timeout, count = 1.0, 4
+        started = time.perf_counter()
+        found = engine.measure(live + refusing + dead + ipv6, count=count, timeout=timeout,
+                               interval=0.05)
+        elapsed = time.perf_counter() - started
+        # Every dead probe waits out its timeout together, so it's one timeout in total
+        results.add(f"ping.{len(live + refusing + dead)}_hosts_x{count}.in_timeouts",
+                    elapsed / timeout, "timeouts")
+        answered = [t for t in live + refusing + ipv6 if None not in found[t]]
+        results.add("ping.answered_hosts", len(answered), "hosts", lower_is_better=False)
+        silent = [t for t in dead if set(found[t]) == {None}]
+        results.add("ping.dead_hosts_seen_as_dead", len(silent), "hosts", lower_is_better=False)
+        if len(answered) != len(live + refusing + ipv6) or len(silent) != len(dead):
+            print("  !! ping got some hosts wrong", file=sys.stderr)
+    finally:
+        hosts.close()
+
+
+def bench_ask(results, requests_count):
+    """ask latency and throughput against the fake Ollama"""
+    if not PHANTOM.OLLAMA_AVAILABLE:
+        print("  (skipping ask - requests isn't installed)", file=sys.stderr)
+        return
+    with FakeOllama() as fake, fresh_home({'ollama_url': fake.url, 'cache_enabled': False}):
+        phantom = Phantom()
+        phantom.ollama_ready = True
+
+        # Blocking answers, the way batch mode asks
+        phantom.interactive = False
+        with quiet():
+            timings = []
+            for i in range(requests_count):
+                started = time.perf_counter()
+                phantom.ask_ai(f"question {i}")
+                timings.append(time.perf_counter() - started)
+        results.add("ask.blocking.latency_p50", statistics.median(timings) * 1000, "ms")
+
+        # Streamed answers - time to first word is what people actually notice
+        phantom.interactive = True
+        first_words, totals = [], []
+        for i in range(requests_count):
+            out = _FirstWrite()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(out):
+                out.start = started
+                phantom.ask_ai(f"streamed question {i}")
+            totals.append(time.perf_counter() - started)
+            if out.first is not None:
+                first_words.append(out.first - started)
+        if first_words:
+            results.add("ask.stream.first_token_p50", statistics.median(first_words) * 1000, "ms")
+        results.add("ask.stream.total_p50", statistics.median(totals) * 1000, "ms")
+
+        # Lots of questions at once, through the shared connection pool
+        phantom.interactive = False
+        with quiet():
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(pool.map(lambda i: phantom.ask_ai(f"parallel {i}"), range(requests_count * 4)))
+        elapsed = time.perf_counter() - started
+        results.add("ask.blocking.throughput_8_threads", requests_count * 4 / elapsed, "asks/s",
+                    lower_is_better=False)
+
+        # Background asks - quick commands shouldn't wait behind them
+        phantom.interactive = True
+        count = requests_count * 4
+        phantom.asks.max_waiting = count
+        started = time.perf_counter()
+        for i in range(count):
+            phantom.ask_ai(f"background {i} &")
+        note = best_of(lambda: phantom.process_input("note while the AI is busy"), 20, 3)
+        results.add("ask.background.note_while_busy", note * 1e6, "us")
+        while phantom.asks.active():
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        results.add(f"ask.background.throughput_{phantom.asks.parallel}_workers", count / elapsed,
+                    "asks/s", lower_is_better=False)
+        phantom.notices.clear()
+        phantom.interactive = False
+
+        # A repeat question should come straight out of the cache
+        phantom.settings['cache_enabled'] = True
+        with quiet():
+            phantom.ask_ai("cached question")
+            hit = best_of(lambda: phantom.ask_ai("cached question"), 200, 3)
+        results.add("ask.cache_hit", hit * 1e6, "us")
+
+        # aistats over a full log, read fresh from disk like a new session would
+        log = phantom.answer_log
+        for i in range(log.keep - len(log.load())):
+            log.add(PHANTOM.AnswerLog.entry(f"model{i % 3}", 'ask', time.perf_counter() - 1,
+                                            None, {'eval_count': 50, 'eval_duration': 10 ** 9}, 'ok'))
+        log.entries = None
+        started = time.perf_counter()
+        phantom.show_ai_stats("")
+        results.add(f"ask.aistats.cold_{log.keep}_answers", (time.perf_counter() - started) * 1000, "ms")
+        warm = best_of(lambda: phantom.show_ai_stats(""), 5, 3)
+        results.add(f"ask.aistats.warm_{log.keep}_answers", warm * 1000, "ms")
+
+
+def bench_rag(results, sizes):
+    """Keeping the embeddings up to date, and asking with them, against the fake Ollama"""
+    if not PHANTOM.OLLAMA_AVAILABLE or PHANTOM.np is None:
+        print("  (skipping rag - it needs requests and numpy)", file=sys.stderr)
+        return
+    size = sizes[0]
+    with FakeOllama(tokens=5) as fake, fresh_home({'ollama_url': fake.url, 'cache_enabled': False,
+                                                   'rag_enabled': True}):
+        phantom = Phantom()
+        phantom.ollama_ready = True
+        phantom.interactive = False
+        fill_knowledge(phantom, size)
+
+        # First sync has to embed everything, once
+        started = time.perf_counter()
+        phantom._sync_embeddings()
+        results.add(f"rag.first_sync.{size}_entries", (time.perf_counter() - started) * 1000, "ms")
+        first = len(fake.embedded)
+        results.add("rag.first_sync.texts_embedded", first, "texts")
+
+        # Changing one topic should only send that one text
+        del fake.embedded[:]
+        phantom.teach("topic 7: some new info about topic number 7")
+        started = time.perf_counter()
+        phantom._sync_embeddings()
+        results.add(f"rag.one_change_sync.{size}_entries", (time.perf_counter() - started) * 1000, "ms")
+        changed = list(fake.embedded)
+        results.add("rag.one_change_sync.texts_embedded", len(changed), "texts")
+
+        # The fake embeds a text the same way every time, so asking with a topic's own
+        # text has to bring that topic back first
+        del fake.prompts[:]
+        question = "topic 12: some info about topic number 12"
+        with quiet():
+            phantom.ask_ai(question)
+        prompt = fake.prompts[-1] if fake.prompts else ""
+        context = [line for line in prompt.splitlines() if line.startswith("- ")]
+        top_k = phantom.settings.get('rag_top_k', 4)
+        results.add("rag.ask.context_lines", len(context), "lines", lower_is_better=False)
+
+        # A new session maps the saved vectors back in instead of embedding again
+        del fake.embedded[:]
+        phantom.storage.flush()
+        fresh = Phantom()
+        fresh.ollama_ready = True
+        started = time.perf_counter()
+        fresh._sync_embeddings()
+        results.add(f"rag.reload_sync.{size}_entries", (time.perf_counter() - started) * 1000, "ms")
+        mapped = isinstance(fresh.embeddings.vectors, PHANTOM.np.memmap)
+        reloaded = len(fake.embedded)
+        vector = fresh.ollama.embed('nomic-embed-text', [question])[0]
+        query = best_of(lambda: fresh.embeddings.query(vector, top_k), 200, 3)
+        results.add(f"rag.query.{size}_entries", query * 1e6, "us")
+
+        # Without numpy it should still answer, just without the extra context
+        del fake.prompts[:]
+        numpy, PHANTOM.np = PHANTOM.np, None
+        try:
+            with quiet():
+                fresh.ask_ai(question)
+        finally:
+            PHANTOM.np = numpy
+        plain = fake.prompts[-1] if fake.prompts else None
+
+        if first != size or changed != ["topic 7: some new info about topic number 7"]:
+            print("  !! rag embedded the wrong texts", file=sys.stderr)
+        if len(context) != min(top_k, size) or f"- {question}" not in context[:1]:
+            print("  !! rag didn't put the closest notes in the prompt", file=sys.stderr)
+        if not mapped or reloaded:
+            print("  !! rag didn't reuse the saved vectors", file=sys.stderr)
+        if plain != question:
+            print("  !! rag without numpy didn't fall back to the plain question", file=sys.stderr)
+
+
+class _FirstWrite(io.StringIO):
+    """Notes when the first real word of an answer gets printed"""
+
+    def __init__(self):
+        super().__init__()
+        self.first = None
+        self.start = None
+
+    def write(self, text):
+        if self.first is None and 'word' in text:
+            self.first = time.perf_counter()
+        return super().write(text)
+
+
+# ============================================
+# Comparing against an older run
+# ============================================
+
+def compare(current, baseline, threshold):
+    """List every number that got worse than the baseline by more than threshold"""
+    regressions = []
+    for name, now in current.items():
+        before = baseline.get(name)
+        if not before or not before['value']:
+            continue
+        change = (now['value'] - before['value']) / before['value']
+        worse = change > threshold if now['lower_is_better'] else change < -threshold
+        if worse:
+            regressions.append((name, before['value'], now['value'], change))
+    return regressions
+
+
+GROUPS = {
+    'startup': bench_startup,
+    'dispatch': bench_dispatch,
+    'persistence': bench_persistence,
+    'render': bench_rendering,
+    'locate': bench_locate,
+    'ping': bench_ping,
+    'ask': bench_ask,
+    'rag': bench_rag,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Phantom's hot paths")
+    parser.add_argument('--only', action='append', choices=sorted(GROUPS),
+                        help="just run this group (repeatable)")
+    parser.add_argument('--quick', action='store_true',
+                        help="smaller stores (up to 10^4 instead of 10^5) for a fast check")
+    parser.add_argument('--out', help="save the results to this JSON file")
+    parser.add_argument('--baseline', help="flag regressions against this saved JSON file")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="how much worse counts as a regression (default 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    sizes = (1000, 10000) if args.quick else (1000, 10000, 100000)
+    results = Results()
+    for name in args.only or GROUPS:
+        print(f"=== {name} ===", file=sys.stderr)
+        if name == 'ask':
+            bench_ask(results, 10 if args.quick else 30)
+        else:
+            GROUPS[name](results, sizes)
+
+    report = {
+        'version': 1,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results.values,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results.values, baseline, args.threshold)
+        for name, before, now, change in regressions:
+            print(f"⚠️  REGRESSION {name}: {before:,.3f} -> {now:,.3f} ({change:+.0%})",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+        print("✅ No regressions against the baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
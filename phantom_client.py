@@ -0,0 +1,145 @@
+"""Talk to a Phantom that's already running in the background - starts instantly
+
+    python phantom_client.py                 chat, just like python PHANTOM.py
+    python phantom_client.py calc 2+2        run one command and quit
+    python phantom_client.py --stop          shut the background Phantom down
+
+If there's no background Phantom yet, this starts one (python PHANTOM.py --daemon)
+and it stays running, so every window after the first opens right away.
+Only uses the standard library on purpose - importing less is what makes it quick.
+"""
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+INFO_FILE = Path.home() / ".phantom" / "daemon.json"
+LOG_FILE = Path.home() / ".phantom" / "daemon.log"
+ANSI = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def start_daemon():
+    """Start PHANTOM.py --daemon, detached so it outlives this window"""
+    LOG_FILE.parent.mkdir(exist_ok=True)
+    script = Path(__file__).resolve().with_name("PHANTOM.py")
+    with open(LOG_FILE, 'a', encoding='utf-8') as log:
+        subprocess.Popen(
+            [sys.executable, str(script), '--daemon'],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            **({'start_new_session': True} if os.name != 'nt'
+               else {'creationflags': subprocess.DETACHED_PROCESS |
+                                      subprocess.CREATE_NEW_PROCESS_GROUP})
+        )
+
+
+class Session:
+    """One connection to the background Phantom"""
+
+    def __init__(self, start=True):
+        self.plain = not sys.stdout.isatty() or 'NO_COLOR' in os.environ
+        self.prompt = "Phantom> "
+        started = False
+        for _ in range(150):
+            try:
+                self._connect()
+                return
+            except (OSError, ValueError, KeyError):
+                if not start:
+                    raise ConnectionError("no background Phantom running")
+                if not started:
+                    start_daemon()
+                    started = True
+                time.sleep(0.1)
+        raise ConnectionError(f"the background Phantom didn't start - see {LOG_FILE}")
+
+    def _connect(self):
+        info = json.loads(INFO_FILE.read_text(encoding='utf-8'))
+        self.sock = socket.create_connection(('127.0.0.1', info['port']), timeout=5)
+        self.sock.settimeout(None)  # Answers can take a while
+        self.reader = self.sock.makefile('rb')
+        self.send(token=info['token'], tty=sys.stdout.isatty())
+        hello = json.loads(self.reader.readline())
+        self.prompt = hello['prompt']
+
+    def send(self, **message):
+        self.sock.sendall((json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8'))
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def write(self, text):
+        sys.stdout.write(ANSI.sub('', text) if self.plain else text)
+        sys.stdout.flush()
+
+    def run(self, line):
+        """Send one line and show everything that comes back. False means they exited"""
+        self.send(line=line)
+        for raw in self.reader:
+            message = json.loads(raw)
+            if 'out' in message:
+                self.write(message['out'])
+            elif 'input' in message:
+                try:
+                    answer = input()
+                except EOFError:
+                    answer = ''
+                self.send(answer=answer)
+            elif message.get('done'):
+                return not message.get('exit')
+        raise ConnectionError("the background Phantom went away")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv == ['--stop']:
+        try:
+            session = Session(start=False)
+        except ConnectionError:
+            print("💤 No background Phantom running")
+            return 0
+        session.send(stop=True)
+        session.close()
+        print("👋 Background Phantom stopped")
+        return 0
+
+    try:
+        session = Session()
+        if argv:
+            session.run(' '.join(argv))
+            return 0
+    except ConnectionError as e:
+        print(f"❌ Can't reach Phantom: {e}", file=sys.stderr)
+        return 1
+
+    while True:
+        try:
+            line = input(ANSI.sub('', session.prompt) if session.plain else session.prompt).strip()
+        except KeyboardInterrupt:
+            print("\n\n👋 Press Ctrl+C again or type 'exit' to quit\n")
+            continue
+        except EOFError:
+            print("\n\n👋 See you later!\n")
+            return 0
+        if not line:
+            continue
+        try:
+            if not session.run(line):
+                return 0
+        except KeyboardInterrupt:
+            # Hanging up is what stops the command - then just dial back in
+            print("\n✋ Stopped.\n")
+            session.close()
+            session = Session()
+        except (ConnectionError, OSError, ValueError) as e:
+            print(f"\n❌ Lost Phantom ({e}), reconnecting...\n")
+            session = Session()
+
+
+if __name__ == "__main__":
+    sys.exit(main())